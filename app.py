@@ -1,13 +1,19 @@
 import datetime
+import fcntl
 import json
+import math
+import multiprocessing
+import random
+import signal
 import time
+import traceback
 import sys
 import os
+from contextlib import contextmanager
 
 from scrapy.crawler import CrawlerProcess  # type: ignore pylint: disable=import-error
-from scrapy.exporters import JsonItemExporter  # type: ignore pylint: disable=import-error
-from geopy.geocoders import Nominatim  # type: ignore pylint: disable=import-error
 from geopy import Point  # type: ignore pylint: disable=import-error
+import numpy as np  # type: ignore pylint: disable=import-error
 import pandas as pd  # type: ignore pylint: disable=import-error
 from discord_webhook import DiscordWebhook, DiscordEmbed  # pylint: disable=import-error
 from flask import (  # pylint: disable=import-error
@@ -29,14 +35,21 @@ from sreality_scraper.sreality.spiders.sreality_spider import (  # pylint: disab
     SrealitySpider,
 )
 
-from database_wrapper import DatabaseWrapper
+from database_wrapper import CRAWL_PHASES, DatabaseWrapper, format_timestamp
 from furnished import Furnished
 from property_status import PropertyStatus
 from property_type import PropertyType
 from listing import Listing
 from user_preferences import UserPreferences, SCORING_COLUMNS, BOOLEAN_COLUNNS
 from disposition import Disposition
-from listings_cleaner import clean_listing_database
+from listings_cleaner import update_clean_listings
+from listings_cache import ListingsCache
+from profile_scoring import ProfileScorer
+from locality import search_cities, split_places
+from geocoding import Geocoder, parse_coordinates
+from scrape_archive import ARCHIVE_COMPRESSIONS, archive_feed, crawl_files, read_items, rotate
+from incremental_crawl import load_known_listings, save_known_listings
+from http_cache import http_cache_settings, prune
 
 
 CRAWL = False
@@ -44,20 +57,53 @@ USER_DATA_DIR = "userdata"
 if not os.path.exists(USER_DATA_DIR):
     os.makedirs(USER_DATA_DIR)
 LAST_CRAWL_FILE = USER_DATA_DIR + "/" + "last_crawl.txt"
-SCRAPER_OUTPUT_FILE = USER_DATA_DIR + "/" + "scraped_listings.json"
+# held by the running crawl, so crawls started by the daemon and by hand never overlap
+CRAWL_LOCK_FILE = USER_DATA_DIR + "/" + "crawl.lock"
+# the items scraped by each spider in each crawl, see scrape_archive
+SCRAPE_ARCHIVE_DIR = USER_DATA_DIR + "/" + "scraped"
+# the number of crawls the scraped items are kept for
+SCRAPE_ARCHIVE_KEEP = 10
+# the listings stored before the crawl, passed to the spiders, see incremental_crawl
+KNOWN_LISTINGS_FILE = USER_DATA_DIR + "/" + "known_listings.json"
+# the pages downloaded by the spiders if HTTP_CACHE is on, see http_cache
+HTTP_CACHE_DIR = USER_DATA_DIR + "/" + "httpcache"
+# the number of seconds cached search results and detail pages are used without asking the portals,
+# they are revalidated with ETag and Last-Modified after that, and the age of the pages downloaded in full again
+HTTP_CACHE_SEARCH_TTL = 0
+HTTP_CACHE_DETAIL_TTL = 24 * 3600
+HTTP_CACHE_MAX_AGE = 7 * 24 * 3600
 PREFERENCES_FILE = USER_DATA_DIR + "/" + "preferences.json"
+PROFILES_DIR = USER_DATA_DIR + "/" + "profiles"
+DEFAULT_PROFILE = "default"
 POI = "NTK Praha"
 DB_FILE = USER_DATA_DIR + "/" + "listings.db"
-items = []
+GEOCODING_DB_FILE = USER_DATA_DIR + "/" + "geocoding.db"
+# the longest time a crawl spends geocoding listings without coordinates, the rest is geocoded by the next crawls
+BACKFILL_SECONDS = 300
+LISTINGS_PER_PAGE = 30
+# the number of scraped listings stored in the database at once while the spiders run
+DATABASE_BATCH_SIZE = 500
 load_dotenv(USER_DATA_DIR + "/" + ".env")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
 if WEBHOOK_URL == "" or WEBHOOK_URL is None:
     print("Webhook URL not found in .env file")
     sys.exit(1)
+SCRAPE_ARCHIVE_COMPRESSION = os.getenv("SCRAPE_ARCHIVE_COMPRESSION", "")
+if SCRAPE_ARCHIVE_COMPRESSION not in ARCHIVE_COMPRESSIONS:
+    print(f"Unknown SCRAPE_ARCHIVE_COMPRESSION {SCRAPE_ARCHIVE_COMPRESSION}, the scraped items are not compressed")
+    SCRAPE_ARCHIVE_COMPRESSION = ""
+HTTP_CACHE = os.getenv("HTTP_CACHE", "").lower() in ("1", "true", "yes")
+# the number of seconds between the crawls of the crawler daemon, each one moved by up to CRAWL_JITTER seconds,
+# and the time after which the spiders of a crawl are stopped
+CRAWL_INTERVAL = int(os.getenv("CRAWL_INTERVAL") or 600)
+CRAWL_JITTER = int(os.getenv("CRAWL_JITTER") or 60)
+CRAWL_TIMEOUT = int(os.getenv("CRAWL_TIMEOUT") or 1800)
 
 app = Flask(__name__)
 SECRET_KEY = os.urandom(32)
 app.config["SECRET_KEY"] = SECRET_KEY
+LISTINGS_CACHE = ListingsCache()
+GEOCODER = Geocoder(GEOCODING_DB_FILE)
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -94,6 +140,8 @@ def index():
         save_preferences(user_preferences)
 
     df = analyze_listings(DB_FILE, user_preferences)
+    page_count = max(1, math.ceil(len(df) / LISTINGS_PER_PAGE))
+    page = min(max(request.args.get("page", 1, type=int), 1), page_count)
 
     column_names = {
         "score": "Skóre*",
@@ -112,16 +160,49 @@ def index():
         "poi_distance": "Vzdálenost od bodů zájmu**",
         "url": "url",
     }
+    # distances to the individual points of interest
+    poi_columns = [col for col in df.columns if col.startswith("poi_distance_")]
+    for col in poi_columns:
+        column_names[col] = f"Vzdálenost od bodu {int(col.split('_')[-1]) + 1}"
 
     return render_template(
         "index.html",
         preferences=user_preferences,
         sorting_columns=SCORING_COLUMNS,
-        listings_df=format_result(df),
-        column_names=column_names
+        listings_df=format_result(df, offset=(page - 1) * LISTINGS_PER_PAGE),
+        column_names=column_names,
+        poi_columns=poi_columns,
+        page=page,
+        page_count=page_count,
     )
 
 
+@app.route("/cache")
+def cache_stats():
+    """
+    Report the hit and miss counters of the cleaned listings cache and the geocoding cache.
+
+    Returns:
+        The counters as a JSON object.
+    """
+    return {**LISTINGS_CACHE.stats(), "geocoding": GEOCODER.stats()}
+
+
+@app.route("/crawls")
+def crawl_runs():
+    """
+    Report the most recent runs of the crawler and how long their phases took.
+
+    Returns:
+        The runs as a JSON list, from the most recent one.
+    """
+    db = DatabaseWrapper(DB_FILE)
+    db.create_table()
+    runs = db.get_crawl_runs()
+    db.close_conn()
+    return runs
+
+
 @app.route("/preferences", methods=["GET", "POST"])
 def preferences():
     """
@@ -147,12 +228,22 @@ def preferences():
                     f"{';'.join([str(x[0])+','+str(x[1]) for x in value])}"
                 )
                 continue
+            if key == "poi_weights":
+                form.poi_weights.data = ",".join(str(x) for x in value)
+                continue
             if "weight_" in key:
                 continue
             getattr(form, key).data = value
     # if submit is pushed
     if request.method == "POST":
         form = UserPreferencesForm(request.form)
+        # only the fields parsed here are validated, the others are saved as entered
+        invalid = [field for field in (form.location, form.poi_weights) if not field.validate(form)]
+        if invalid:
+            for field in invalid:
+                for error in field.errors:
+                    flash(error)
+            return render_template("preferences.html", title="Set Preferences", form=form)
         user_preferences = load_preferences()
         for key, value in form.data.items():
             if key in ("csrf_token", "submit"):
@@ -169,10 +260,13 @@ def preferences():
             if key == "status":
                 user_preferences.status = [PropertyStatus(x) for x in value]
                 continue
+            if key == "poi_weights":
+                user_preferences.poi_weights = (
+                    [float(x) for x in value.split(",")] if value else None
+                )
+                continue
             if key == "points_of_interest" and value != "":
-                user_preferences.points_of_interest = [
-                    Point(value) for value in value.split(";")
-                ]
+                user_preferences.points_of_interest = parse_points(value)
                 continue
             setattr(user_preferences, key, value)
         save_preferences(user_preferences)
@@ -201,6 +295,28 @@ def load_preferences() -> UserPreferences:
     return UserPreferences.from_dict(data=user_preferences)
 
 
+def load_profiles() -> dict[str, UserPreferences]:
+    """
+    Load the preferences of all users notified about new listings.
+
+    The preferences set in the web app are the DEFAULT_PROFILE profile,
+    every other <name>.json file in PROFILES_DIR holds the preferences of the profile <name>.
+
+    Returns:
+        dict[str, UserPreferences]: The preferences by the profile names.
+    """
+    profiles = {DEFAULT_PROFILE: load_preferences()}
+    if not os.path.isdir(PROFILES_DIR):
+        return profiles
+    for filename in sorted(os.listdir(PROFILES_DIR)):
+        name, extension = os.path.splitext(filename)
+        if extension != ".json" or name == DEFAULT_PROFILE:
+            continue
+        with open(os.path.join(PROFILES_DIR, filename), "r", encoding="utf-8") as f:
+            profiles[name] = UserPreferences.from_dict(data=json.load(f))
+    return profiles
+
+
 def save_preferences(user_preferences: UserPreferences) -> None:
     """
     Save the user preferences to a file.
@@ -215,76 +331,208 @@ def save_preferences(user_preferences: UserPreferences) -> None:
         f.write(json.dumps(user_preferences.to_dict()))
 
 
-def crawl_regularly(crawl=True):
+def crawl_regularly(crawl=True, isolate=False, durations=None):
     """
-    Crawls the real estate platforms for new listings and notifies the user about them.
+    Crawls the real estate platforms for new listings and notifies the users about them,
+    the listings are scored for the preferences of all the profiles at once.
 
     Args:
         crawl (bool, optional): Indicates whether to perform crawling or use existing data. 
             Defaults to True.
+        isolate (bool, optional): Whether to run the spiders in a worker process, see run_spiders_isolated.
+            Defaults to False.
+        durations (None | dict, optional): Filled in with the number of seconds each of the phases
+            of the crawl took as they finish, see CRAWL_PHASES. Defaults to None.
 
     Returns:
-        None
+        dict[str, float]: The number of seconds each of the phases of the crawl took.
+
+    Raises:
+        ChildProcessError: If the spiders of an isolated crawl failed or timed out,
+            the listing database is then left as the spiders stored it.
     """
-    # while True:
     print("starting crawling")
-    global items  # pylint: disable=global-statement
+    durations = {} if durations is None else durations
+    start = time.time()
     if crawl:
-        run_spiders(SCRAPER_OUTPUT_FILE)
+        last_crawl_time = datetime.datetime.now()
+        if isolate:
+            run_spiders_isolated(last_crawl_time)
+        else:
+            run_spiders(last_crawl_time)
     else:
-        with open(SCRAPER_OUTPUT_FILE, "r", encoding="utf-8") as f:
-            items = json.load(f)
+        with open(LAST_CRAWL_FILE, "r", encoding="utf-8") as f:
+            last_crawl_time = datetime.datetime.fromisoformat(f.read())
+        store_scraped_listings(crawl_files(SCRAPE_ARCHIVE_DIR, last_crawl_time), last_crawl_time)
+    durations["spiders"] = time.time() - start
 
-    listings = []
-    for item in items:
-        listings.append(Listing(item))
+    start = time.time()
+    update_listing_database(DB_FILE, last_crawl_time)
+    durations["update"] = time.time() - start
+    start = time.time()
+    backfill_coordinates(DB_FILE, GEOCODER)
+    durations["backfill"] = time.time() - start
 
-    with open(LAST_CRAWL_FILE, "r", encoding="utf-8") as f:
-        last_crawl_time = datetime.datetime.fromisoformat(f.read())
+    start = time.time()
+    profiles = load_profiles()
+    df = LISTINGS_CACHE.get(DB_FILE)
+    db = DatabaseWrapper(DB_FILE)
+    scores = ProfileScorer(
+        df, LISTINGS_CACHE.get_spatial_index(df), db.search_text
+    ).score(list(profiles.values()))
+    db.close_conn()
+    new_listings = (df["updated"] == format_timestamp(last_crawl_time)).to_numpy()
+    for (profile, user_preferences), profile_scores in zip(profiles.items(), scores.T):
+        rows = new_listings & ~np.isnan(profile_scores)
+        scored = df[rows].assign(score=profile_scores[rows])
+        try:
+            notify_user(scored, last_crawl_time, profile, user_preferences.webhook_url)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # e.g. an unreachable webhook, the crawl and the other profiles go on
+            print(traceback.format_exc())
+    durations["notify"] = time.time() - start
+    return durations
+
+
+@contextmanager
+def crawl_lock():
+    """
+    Takes the lock of CRAWL_LOCK_FILE for the duration of a crawl, without waiting for it.
 
-    update_listing_database(DB_FILE, listings, last_crawl_time)
+    Yields:
+        bool: Whether the lock was taken, False if another crawl is running.
+    """
+    with open(CRAWL_LOCK_FILE, "a", encoding="utf-8") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def crawl_once(isolate=False) -> str:
+    """
+    Runs a crawl unless another one is running, and records it in the crawl_runs table.
 
-    user_preferences = load_preferences()
+    Args:
+        isolate (bool, optional): Whether to run the spiders in a worker process. Defaults to False.
 
-    df = analyze_listings(DB_FILE, user_preferences)
+    Returns:
+        str: How the crawl ended, "ok", "failed: <phase>" or "skipped" if another crawl is running.
+    """
+    started = datetime.datetime.now()
+    start = time.time()
+    durations = {}
+    with crawl_lock() as locked:
+        if not locked:
+            print("another crawl is running, skipping this one")
+            status = "skipped"
+        else:
+            try:
+                crawl_regularly(isolate=isolate, durations=durations)
+                status = "ok"
+            except Exception:  # pylint: disable=broad-exception-caught
+                print(traceback.format_exc())
+                # the phases get their durations as they finish
+                status = "failed: " + next(phase for phase in CRAWL_PHASES if phase not in durations)
+    duration = time.time() - start
+    db = DatabaseWrapper(DB_FILE)
+    db.create_table()
+    db.record_crawl_run(started, status, duration, durations)
+    db.close_conn()
+    print(
+        f"crawl {status} in {duration:.1f}s ("
+        + ", ".join(f"{phase} {seconds:.1f}s" for phase, seconds in durations.items())
+        + ")"
+    )
+    return status
+
+
+def crawl_daemon(interval: float = CRAWL_INTERVAL, jitter: float = CRAWL_JITTER):
+    """
+    Crawls every interval seconds until stopped, keeping the process with its imports and caches running
+    between the crawls. The spiders of each crawl run in a worker process, as the Twisted reactor
+    they run in cannot be restarted.
 
-    notify_user(df, last_crawl_time)
+    Each crawl is started up to jitter seconds earlier or later, so the portals do not see requests
+    at the same times. A crawl taking longer than the interval delays the next one instead of overlapping it.
 
+    Args:
+        interval (float, optional): The number of seconds between the crawls. Defaults to CRAWL_INTERVAL.
+        jitter (float, optional): The largest number of seconds a crawl is moved by. Defaults to CRAWL_JITTER.
 
-def format_result(df: pd.DataFrame):
+    Returns:
+        None
+    """
+    # docker stop sends SIGTERM, exiting stops the worker process as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print(f"crawling every {interval}s")
+    next_run = time.time()
+    while True:
+        delay = next_run - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        next_run = time.time() + interval + random.uniform(-jitter, jitter)
+        crawl_once(isolate=True)
+
+
+def format_result(df: pd.DataFrame, k: int = LISTINGS_PER_PAGE, offset: int = 0):
     """
-    Formats the given DataFrame by sorting it based on the 'score' column in descending order,
-    and applying specific formatting to certain columns.
+    Selects the k listings with the highest score after skipping the first offset of them,
+    and applies specific formatting to certain columns.
+
+    Only the selected listings are sorted and formatted.
 
     Args:
         df (pd.DataFrame): The DataFrame to be formatted.
+        k (int, optional): The number of listings to select. Defaults to LISTINGS_PER_PAGE.
+        offset (int, optional): The number of best listings to skip, e.g. for paging. Defaults to 0.
 
     Returns:
-        pd.DataFrame: The formatted DataFrame.
+        pd.DataFrame: The formatted DataFrame sorted by the score in descending order.
     """
     if df.empty:
         return df
-    df = df.sort_values(by="score", ascending=False, inplace=False)
+    # positions of the offset + k best listings, equal scores are ordered by position,
+    # so the pages neither repeat nor skip listings
+    scores = np.nan_to_num(df.score.to_numpy(dtype=float), nan=-np.inf)
+    n = min(offset + k, len(df))
+    if n <= offset:
+        return df.iloc[0:0]
+    threshold = np.partition(scores, len(df) - n)[len(df) - n]
+    better = np.flatnonzero(scores > threshold)
+    top = np.concatenate(
+        [better, np.flatnonzero(scores == threshold)[: n - len(better)]]
+    )
+    top = top[np.lexsort((top, -scores[top]))]
+    df = df.take(top[offset:])
     df.price = df.price.apply(lambda x: str(int(x)) + " Kč" if x > 0 else "")
     df.area = df.area.apply(lambda x: str(int(x)) + " m2" if x > 0 else "")
-    df.poi_distance = df.poi_distance.apply(
-        lambda x: str(int(x)) + " m" if x >= 0 else ""
-    )
+    for col in [col for col in df.columns if col.startswith("poi_distance")]:
+        df[col] = df[col].apply(lambda x: str(int(x)) + " m" if x >= 0 else "")
     df.garden = df.garden.apply(lambda x: str(int(x)) + " m2" if x > 0 else "Ne")
     df.score = df.score.apply(lambda x: round(x, 2) if x > 0 else 0)
     for col in BOOLEAN_COLUNNS:
         df[col] = df[col].apply(lambda x: "Ano" if x else "Ne")
-    df = df.head(30)
     return df
 
 
-def notify_user(df: pd.DataFrame, last_crawl_time: datetime.datetime):
+def notify_user(
+    df: pd.DataFrame, last_crawl_time: datetime.datetime, profile: str = DEFAULT_PROFILE, webhook_url=None
+):
     """
     Notifies the user about new listings found in the DataFrame.
 
     Args:
         df (pd.DataFrame): The DataFrame containing the listings.
         last_crawl_time (datetime.datetime): The last crawl time.
+        profile (str, optional): The name of the preference profile the listings were scored for.
+            Defaults to DEFAULT_PROFILE.
+        webhook_url (None | str, optional): The Discord webhook of the profile. Defaults to WEBHOOK_URL.
 
     Returns:
         None
@@ -293,21 +541,20 @@ def notify_user(df: pd.DataFrame, last_crawl_time: datetime.datetime):
     with open(LAST_CRAWL_FILE, "r", encoding="utf-8") as f:
         last_crawl_time = datetime.datetime.fromisoformat(f.read())
 
-    df = df[df["updated"] == str(last_crawl_time)]
+    df = df[df["updated"] == format_timestamp(last_crawl_time)]
 
     if df.empty:
-        print("No new listings found")
-        return
-    df = format_result(df)
-    if WEBHOOK_URL is None:
-        print("Webhook URL not found in .env file")
+        print(f"No new listings found for profile {profile}")
         return
-    webhook = DiscordWebhook(url=WEBHOOK_URL, username="Real Estate")
+    # discord message length should be limited
+    df = format_result(df, k=5)
+    webhook = DiscordWebhook(url=webhook_url or WEBHOOK_URL, username="Real Estate")
 
-    embed = DiscordEmbed(title="Nové inzeráty nalezeny", description="", color="03b2f8")
+    title = "Nové inzeráty nalezeny"
+    if profile != DEFAULT_PROFILE:
+        title += f" ({profile})"
+    embed = DiscordEmbed(title=title, description="", color="03b2f8")
     embed.set_timestamp()
-    # discord message length should be limited
-    df = df.head(5)
     for record in df.to_dict(orient="records"):
         embed.add_embed_field(
             name=f"{record['score']} - {record['address']}",
@@ -316,16 +563,17 @@ def notify_user(df: pd.DataFrame, last_crawl_time: datetime.datetime):
         )
 
     webhook.add_embed(embed)
-    if not df.empty:
-        response = webhook.execute()
-        if response.status_code != 200:
-            print("Error sending the message to discord")
+    response = webhook.execute()
+    if response.status_code != 200:
+        print("Error sending the message to discord")
 
 
 def get_point(address) -> None | Point:
     """
     Retrieves the latitude and longitude coordinates of a given address.
 
+    The coordinates are looked up once and cached, see Geocoder.
+
     Args:
         address (str): The address to geocode.
 
@@ -333,36 +581,64 @@ def get_point(address) -> None | Point:
         Point | None: A Point object representing the latitude and longitude coordinates
         of the given address, or None if the address cannot be geocoded.
     """
-    geolocator = Nominatim(user_agent="distance_calculator")
-    location = geolocator.geocode(address)
-    if location:
-        return Point(location.latitude, location.longitude)  # type: ignore
-    return None
+    return GEOCODER.geocode(address)
 
 
-def item_scraped(item):
+def parse_points(value: str) -> list[Point]:
     """
-    Function to handle scraped items.
+    Parses the points of interest entered in the preferences form.
 
     Args:
-        item (dict): The scraped item.
+        value (str): The points separated by semicolons, each one either the coordinates
+            (e.g. "50.1036,14.3901") or an address (e.g. "NTK Praha").
+
+    Returns:
+        list[Point]: The points, without the addresses that cannot be geocoded.
+    """
+    points = []
+    for entry in value.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        point = parse_coordinates(entry)
+        if point is None:
+            point = get_point(entry)
+        if point is None:
+            print(f"point of interest not found: {entry}")
+            continue
+        points.append(point)
+    return points
+
+
+def store_scraped_listings(paths: list[str], last_crawl_time: datetime.datetime):
+    """
+    Stores the listings archived by an earlier run of the spiders in the listing database,
+    reading the archive one listing at a time.
+
+    Args:
+        paths (list[str]): The archived items of the crawl, e.g. from scrape_archive.crawl_files.
+        last_crawl_time (datetime.datetime): The timestamp of the crawl the listings were scraped by.
 
     Returns:
         None
     """
-    print(item["url"])
-    items.append(item)
+    if not paths:
+        print(f"no scraped items of the crawl at {last_crawl_time.isoformat()} found")
+    for path in paths:
+        pipeline = DatabasePipeline(DB_FILE, last_crawl_time)
+        pipeline.open_spider(None)
+        for item in read_items(path):
+            pipeline.process_item(item, None)
+        pipeline.close_spider(None)
 
 
-def update_listing_database(
-    db_file: str, listings: list[Listing], last_crawl_time: datetime.datetime
-):
+def update_listing_database(db_file: str, last_crawl_time: datetime.datetime):
     """
-    Updates the listing database with the provided listings.
+    Finishes updating the listing database once the listings of a crawl are stored by DatabasePipeline,
+    deletes the listings the crawl has not seen and cleans the new and changed ones.
 
     Args:
         db_file (str): The path to the database file.
-        listings (list[Listing]): A list of Listing objects to update the database with.
         last_crawl_time (datetime.datetime): The timestamp of the last crawl.
 
     Returns:
@@ -372,61 +648,58 @@ def update_listing_database(
     start = time.time()
     db = DatabaseWrapper(db_file)
     db.create_table()
-    if listings is None:
-        print("no listings found")
-        return
-    for listing in listings:
-        found_listing = db.get_listing(listing.id)
-        if found_listing:
-            if (
-                found_listing != listing
-                and found_listing.updated
-                and datetime.datetime.strptime(
-                    found_listing.updated, "%Y-%m-%d %H:%M:%S.%f"
-                )
-                < last_crawl_time
-            ):
-                print(f"listing {listing.id} has changed:", end=" ")
-                for attr, value in listing.__dict__.items():
-                    if (
-                        found_listing.__dict__[attr] != value
-                        and attr != "updated"
-                        and attr != "last_seen"
-                        and attr != "created"
-                        and attr != "description"
-                    ):
-                        print(
-                            f"{attr} has changed from {found_listing.__dict__[attr]} to {value}"
-                        )
-                print("")
-                db.update_listing(
-                    listing,
-                    created=found_listing.created,
-                    date_updated=last_crawl_time,
-                    last_seen=last_crawl_time,
-                )
-            else:
-                db.update_listing(
-                    listing,
-                    created=found_listing.created,
-                    date_updated=found_listing.updated,
-                    last_seen=last_crawl_time,
-                )
-            continue
-        db.insert_listing(listing=listing, date_created=last_crawl_time)
-        print(f"found a new listing: {listing.id}")
+    print(f"deleted {db.delete_old_listings(last_crawl_time)} old listings")
+    print(f"cleaned {update_clean_listings(db)} new and changed listings")
+    db.close_conn()
+    print(f"updating db took {time.time() - start}s")
+
+
+def backfill_coordinates(
+    db_file: str, geocoder: Geocoder, max_seconds: float = BACKFILL_SECONDS
+) -> int:
+    """
+    Geocodes the addresses of the cleaned listings that have no coordinates.
+
+    Every address is geocoded once for all the listings with that address, and the geocoder
+    keeps the coordinates, so addresses geocoded by previous crawls are not looked up again.
 
-    db.delete_old_listings(last_crawl_time)
+    Args:
+        db_file (str): The path to the database file.
+        geocoder (Geocoder): The geocoder looking up the addresses, e.g. GEOCODER.
+        max_seconds (float, optional): The time after which the remaining addresses are left
+            for the next crawl. Defaults to BACKFILL_SECONDS.
 
+    Returns:
+        int: The number of listings the coordinates were found for.
+    """
+    start = time.time()
+    db = DatabaseWrapper(db_file)
+    addresses = db.get_addresses_without_coordinates()
+    coordinates = []
+    geocoded = 0
+    for address, ids in addresses.items():
+        if time.time() - start > max_seconds:
+            break
+        point = geocoder.geocode(address)
+        geocoded += 1
+        if point is not None:
+            coordinates += [(point.latitude, point.longitude, listing_id) for listing_id in ids]
+    db.store_coordinates(coordinates)
     db.close_conn()
-    end = time.time()
-    print(f"updating db took {end - start}s")
+    print(
+        f"found coordinates of {len(coordinates)} listings, geocoded {geocoded} of "
+        f"{len(addresses)} addresses in {time.time() - start}s"
+    )
+    return len(coordinates)
 
 
 def analyze_listings(db_file: str, user_preferences: UserPreferences):
     """
     Analyzes the listings in the given database file based on the user's preferences.
 
+    The filtered listings prepared for scoring are kept in LISTINGS_CACHE, so when only
+    the scoring weights change, the listings are just scored again.
+
     Args:
         db_file (str): The path to the database file.
         user_preferences (UserPreferences): An instance of the UserPreferences class containing the user's preferences.
@@ -435,9 +708,45 @@ def analyze_listings(db_file: str, user_preferences: UserPreferences):
         pandas.DataFrame: A DataFrame containing the analyzed listings.
     """
 
-    df = clean_listing_database(db_file)
+    # the preference filters are applied by the database, only the matching listings are loaded
+    where, params = user_preferences.to_sql_filter()
+    cached_df = LISTINGS_CACHE.get(db_file, where, params)
+    df = LISTINGS_CACHE.get_scoring_features(
+        cached_df,
+        user_preferences.scoring_signature(),
+        lambda: prepare_listings(cached_df, user_preferences),
+    )
+    if df.empty:
+        print("No listings found after filtering")
+        # the number of listings each of the preferences leaves on its own
+        all_listings = LISTINGS_CACHE.get(db_file)
+        db = DatabaseWrapper(db_file)
+        plan = user_preferences.filter_plan(
+            LISTINGS_CACHE.get_spatial_index(all_listings), db.search_text
+        )
+        print(f"listings matching each preference: {plan.selectivity(all_listings)}")
+        db.close_conn()
+        return df
+    # the prepared frame is shared, the score is added to a shallow copy,
+    # the callers take a new frame (sorting, slicing) before modifying it
+    df = df.copy(deep=False)
+    df["score"] = user_preferences.score(df)
+    return df
 
-    df = df[
+
+def prepare_listings(cached_df: pd.DataFrame, user_preferences: UserPreferences):
+    """
+    Filters the cached listings and prepares them for scoring.
+
+    Args:
+        cached_df (pd.DataFrame): The cleaned listings as returned by LISTINGS_CACHE.get.
+        user_preferences (UserPreferences): An instance of the UserPreferences class containing the user's preferences.
+
+    Returns:
+        pandas.DataFrame: The filtered listings with the features weighted by the score.
+    """
+    # the cached frame is shared, selecting the columns makes a copy that is safe to modify
+    df = cached_df[
         [  # pylint: disable=duplicate-code
             "address",
             "area",
@@ -466,55 +775,168 @@ def analyze_listings(db_file: str, user_preferences: UserPreferences):
             "last_seen",
         ]
     ]
-    df = user_preferences.filter_listings(df)
+    spatial_index = None
+    if user_preferences.max_poi_distance:
+        spatial_index = LISTINGS_CACHE.get_spatial_index(cached_df)
+    df = user_preferences.filter_poi_distance(df, spatial_index)
     if df.empty:
-        print("No listings found after filtering")
         return df
-    df = user_preferences.calculate_score(df)
+    return user_preferences.prepare_scoring(df)
 
-    return df
 
-
-# pipeline to fill the items list
-class ItemCollectorPipeline:
+class DatabasePipeline:
     """
-    A Scrapy pipeline class for collecting items.
+    A Scrapy pipeline storing the scraped listings in the listing database while the spiders run,
+    in batches of batch_size listings, so only one batch is kept in memory.
 
-    Attributes:
-        ids_seen (set): A set to store the seen item IDs.
+    The listings the crawl has not seen are deleted by update_listing_database once all spiders have finished.
 
+    Attributes:
+        db_file (str): The path to the database file.
+        crawl_time (datetime.datetime): The timestamp of the crawl.
+        batch_size (int): The number of listings stored at once.
+        result (dict): The number of "inserted", "changed" and "unchanged" listings stored so far.
     """
 
-    def __init__(self):
-        self.ids_seen = set()
+    def __init__(
+        self,
+        db_file: str,
+        crawl_time: datetime.datetime,
+        batch_size: int = DATABASE_BATCH_SIZE,
+    ):
+        """
+        Initialize a DatabasePipeline object.
+
+        Args:
+            db_file (str): The path to the database file.
+            crawl_time (datetime.datetime): The timestamp of the crawl.
+            batch_size (int, optional): The number of listings stored at once. Defaults to DATABASE_BATCH_SIZE.
+        """
+        self.db_file = db_file
+        self.crawl_time = crawl_time
+        self.batch_size = batch_size
+        self.result = {"inserted": 0, "changed": 0, "unchanged": 0}
+        self._db: None | DatabaseWrapper = None
+        self._batch: list[Listing] = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """
+        Creates the pipeline from the LISTINGS_DB_FILE, CRAWL_TIME and DATABASE_BATCH_SIZE crawler settings.
+
+        Args:
+            crawler (Crawler): The crawler of the spider.
+
+        Returns:
+            DatabasePipeline: The pipeline.
+        """
+        return cls(
+            crawler.settings.get("LISTINGS_DB_FILE", DB_FILE),
+            datetime.datetime.fromisoformat(crawler.settings.get("CRAWL_TIME")),
+            crawler.settings.getint("DATABASE_BATCH_SIZE", DATABASE_BATCH_SIZE),
+        )
+
+    def open_spider(self, spider):  # pylint: disable=unused-argument
+        """
+        Opens the listing database.
+
+        Args:
+            spider (Spider): The spider instance.
+        """
+        self._db = DatabaseWrapper(self.db_file)
+        self._db.create_table()
 
     def process_item(self, item, spider):  # pylint: disable=unused-argument
         """
-        Process the given item and perform necessary operations.
+        Adds the scraped listing to the batch, storing the batch once it is full.
 
         Args:
             item (dict): The item to be processed.
             spider (Spider): The spider instance.
 
         Returns:
-            None
-
+            dict: The item, for the feed exports.
         """
         print(item["url"])
-        items.append(item)
+        self._batch.append(Listing(item))
+        if len(self._batch) >= self.batch_size:
+            self._store_batch()
+        return item
+
+    def close_spider(self, spider):
+        """
+        Stores the rest of the listings and closes the listing database.
+
+        Args:
+            spider (Spider): The spider instance.
+        """
+        self._store_batch()
+        self._db.close_conn()  # type: ignore
+        print(
+            f"{spider.name if spider is not None else 'stored'}: found {self.result['inserted']} new listings, "
+            f"{self.result['changed']} changed listings, {self.result['unchanged']} unchanged listings"
+        )
+
+    def _store_batch(self):
+        if not self._batch:
+            return
+        result = self._db.upsert_listings(self._batch, self.crawl_time, expire=False)  # type: ignore
+        for key in self.result:
+            self.result[key] += result[key]
+        self._batch = []
 
 
-def run_spiders(json_output: str):
+def run_spiders_isolated(crawl_time: datetime.datetime, timeout: float = CRAWL_TIMEOUT):
     """
-    Runs the web spiders to scrape data and save it to a JSON file.
+    Runs run_spiders in a worker process forked from this one, so the crawls of a long running process
+    each get a new Twisted reactor, and the memory of the crawl is freed once it has finished.
 
     Args:
-        json_output (str): The path to the output JSON file.
+        crawl_time (datetime.datetime): The timestamp of the crawl.
+        timeout (float, optional): The number of seconds after which the worker is stopped. Defaults to CRAWL_TIMEOUT.
 
     Returns:
         None
+
+    Raises:
+        ChildProcessError: If the worker failed or was stopped after the timeout.
+    """
+    worker = multiprocessing.get_context("fork").Process(
+        target=run_spiders, args=(crawl_time,), name="spiders", daemon=True
+    )
+    worker.start()
+    worker.join(timeout)
+    if worker.is_alive():
+        # the spiders are given some time to stop on SIGTERM, a worker stuck in a spider is killed
+        worker.terminate()
+        worker.join(10)
+        if worker.is_alive():
+            worker.kill()
+            worker.join()
+        raise ChildProcessError(f"the spiders were stopped after {timeout}s")
+    if worker.exitcode != 0:
+        raise ChildProcessError(f"the spiders exited with code {worker.exitcode}")
+
+
+def run_spiders(crawl_time: datetime.datetime):
     """
+    Runs the web spiders, storing the scraped listings in the listing database by DatabasePipeline
+    and archiving them to a JSON Lines file of each spider in SCRAPE_ARCHIVE_DIR.
 
+    The listings already in the database are passed to the spiders in KNOWN_LISTINGS_FILE, the detail pages
+    of the ones whose price has not changed are skipped by incremental_crawl.SkipKnownListingsMiddleware.
+    If HTTP_CACHE is on, the downloaded pages are cached in HTTP_CACHE_DIR, see http_cache.
+    Each spider searches each city of the places of the location preference, see locality.search_cities.
+
+    Args:
+        crawl_time (datetime.datetime): The timestamp of the crawl.
+
+    Returns:
+        None
+    """
+
+    known_listings = load_known_listings(DB_FILE)
+    save_known_listings(KNOWN_LISTINGS_FILE, known_listings)
     process = CrawlerProcess(
         settings={
             "LOG_LEVEL": "INFO",
@@ -523,47 +945,55 @@ def run_spiders(json_output: str):
                     AppleWebKit/537.36 (KHTML, like Gecko)
                     Chrome/60.0.3112.113 Safari/537.36""",
             },
-            "ITEM_PIPELINES": {"__main__.ItemCollectorPipeline": 100},
+            "ITEM_PIPELINES": {"__main__.DatabasePipeline": 100},
+            "DOWNLOADER_MIDDLEWARES": {"incremental_crawl.SkipKnownListingsMiddleware": 50},
+            "LISTINGS_DB_FILE": DB_FILE,
+            "CRAWL_TIME": crawl_time.isoformat(),
+            "DATABASE_BATCH_SIZE": DATABASE_BATCH_SIZE,
+            "KNOWN_LISTINGS_FILE": KNOWN_LISTINGS_FILE,
+            **(
+                http_cache_settings(HTTP_CACHE_DIR, HTTP_CACHE_SEARCH_TTL, HTTP_CACHE_DETAIL_TTL, HTTP_CACHE_MAX_AGE)
+                if HTTP_CACHE
+                else {}
+            ),
         }
     )
 
     start = time.time()
     p = load_preferences()
-    spider_settings = {}
-    spider_settings["listing_type"] = p.listing_type
-    spider_settings["estate_type"] = p.estate_type
-    spider_settings["location"] = p.location
-
-    crawler = process.create_crawler(SearchFlatsSpider)
-    crawler2 = process.create_crawler(SrealitySpider)
-
-    process.crawl(crawler, spider_settings)
-    process.crawl(crawler2, spider_settings)
+    spider_settings = {"listing_type": p.listing_type, "estate_type": p.estate_type, "known_listings": known_listings}
+    # the portals are searched by city, the districts and quarters are filtered after the crawl
+    places = split_places(p.location)
+    db = DatabaseWrapper(DB_FILE)
+    cities = search_cities(places, db.get_quarter_cities(places))
+    db.close_conn()
+    for city in cities:
+        # each city is archived to files of its own
+        feed = archive_feed(SCRAPE_ARCHIVE_DIR, crawl_time, SCRAPE_ARCHIVE_COMPRESSION, city if len(cities) > 1 else "")
+        for spider in (SearchFlatsSpider, SrealitySpider):
+            crawler = process.create_crawler(spider)
+            # above the project settings of the process, which are merged into the crawler
+            crawler.settings.set("FEEDS", feed, priority="cmdline")
+            process.crawl(crawler, {**spider_settings, "location": city})
     process.start()
+    print(f"{datetime.datetime.now().isoformat()}: scraped items saved to {SCRAPE_ARCHIVE_DIR}")
+    for path in rotate(SCRAPE_ARCHIVE_DIR, SCRAPE_ARCHIVE_KEEP):
+        print(f"deleted {path}")
+    if HTTP_CACHE:
+        print(f"deleted {prune(HTTP_CACHE_DIR, HTTP_CACHE_MAX_AGE)} pages from the HTTP cache")
 
-    with open(file=json_output, mode="wb") as output_file:
-        exporter = JsonItemExporter(output_file)
-        exporter.start_exporting()
-        for item in items:
-            exporter.export_item(item)
-        exporter.finish_exporting()
-    print(
-        f"{datetime.datetime.now().isoformat()}: scraped items saved to {output_file}"
-    )
-
-    end = time.time()
-
-    if start != 0.0 and end != 0.0:
-        print(f"crawling finished in {end - start}s")
+    print(f"crawling finished in {time.time() - start}s")
 
     # writing the last crawl time to a file
     with open(LAST_CRAWL_FILE, "w", encoding="utf-8") as f:
-        f.write(datetime.datetime.now().isoformat())
+        f.write(crawl_time.isoformat())
 
 
 if __name__ == "__main__":
     args = sys.argv[1:]
     if len(args) > 0 and args[0] == "--crawl":
-        crawl_regularly()
+        crawl_once()
+    elif len(args) > 0 and args[0] == "--daemon":
+        crawl_daemon()
     else:
         app.run(debug=True, host="0.0.0.0")
@@ -1,9 +1,340 @@
+import datetime
 from sqlite3 import Error, connect
 import pandas as pd  # pylint: disable=import-error
-from listing import Listing
+from listing import Listing, FIELDS, PAYLOAD_FIELDS
+from locality import parse_address
+from text_search import FTS_TOKENIZER
 
 
-class DatabaseWrapper:
+SCHEMA_VERSION = 9
+
+# declared types of the listings table columns, one for each of the Listing fields.
+# The scraped fields come in a different shape from each portal (e.g. sreality codes
+# vs. bezrealitky labels), those are declared as BLOB so sqlite stores them as they are
+# and the listings cleaner can tell them apart.
+LISTING_COLUMNS = {
+    "address": "TEXT",
+    "area": "NUMERIC",
+    "available_from": "BLOB",
+    "balcony": "BLOB",
+    "cellar": "BLOB",
+    "created": "TEXT",
+    "description": "TEXT",
+    "disposition": "BLOB",
+    "elevator": "BLOB",
+    "floor": "NUMERIC",
+    "furnished": "BLOB",
+    "garage": "BLOB",
+    "garden": "BLOB",
+    "gps_lat": "REAL",
+    "gps_lon": "REAL",
+    "id": "TEXT NOT NULL PRIMARY KEY",
+    "last_seen": "TEXT",
+    "loggie": "BLOB",
+    "ownership": "BLOB",
+    "parking": "BLOB",
+    "price": "NUMERIC",
+    "security_deposit": "NUMERIC",
+    "service_fees": "NUMERIC",
+    "status": "BLOB",
+    "terrace": "BLOB",
+    "type": "BLOB",
+    "updated": "TEXT",
+    "url": "TEXT",
+}
+
+# declared types of the listings_clean table columns, the listings as unified by the listings cleaner
+CLEAN_LISTING_COLUMNS = {
+    "address": "TEXT",
+    "area": "REAL",
+    "price": "REAL",
+    "disposition": "TEXT",
+    "floor": "REAL",
+    "furnished": "TEXT",
+    "garden": "REAL",
+    "type": "TEXT",
+    "status": "TEXT",
+    "ownership": "TEXT",
+    "balcony": "NUMERIC",
+    "cellar": "NUMERIC",
+    "loggie": "REAL",
+    "elevator": "NUMERIC",
+    "terrace": "NUMERIC",
+    "garage": "NUMERIC",
+    "parking": "REAL",
+    "gps_lat": "REAL",
+    "gps_lon": "REAL",
+    "url": "TEXT",
+    "description": "TEXT",
+    "available_from": "TEXT",
+    "city": "TEXT",
+    "district": "TEXT",
+    "quarter": "TEXT",
+    "street": "TEXT",
+}
+
+# the listings_clean columns parsed from the address, see locality.parse_address
+LOCATION_COLUMNS = ["city", "district", "quarter", "street"]
+
+# indexes of the listings_clean columns used to narrow down the listings by the user preferences
+CLEAN_LISTING_INDEXES = {
+    "listings_clean_price": "price",
+    "listings_clean_area": "area",
+    "listings_clean_disposition": "disposition",
+    "listings_clean_city": "city",
+    "listings_clean_district": "district",
+    "listings_clean_quarter": "quarter",
+}
+
+# the IDs of the cleaned listings matching a query of the listings_fts full-text index, e.g. from TextQuery
+FTS_MATCHING_IDS = """SELECT c.id FROM listings_fts JOIN listings_clean AS c ON c.rowid = listings_fts.rowid
+    WHERE listings_fts MATCH ?"""
+
+# the phases of a crawl, the crawl_runs table holds the number of seconds each of them took
+CRAWL_PHASES = ["spiders", "update", "backfill", "notify"]
+
+LISTING_INDEXES = {
+    "listings_last_seen": "last_seen",
+    "listings_updated": "updated",
+    "listings_price": "price",
+}
+
+
+def format_timestamp(value):
+    """
+    Format a timestamp the way it is stored in the database.
+
+    Timestamps are stored as "YYYY-MM-DD HH:MM:SS.ffffff" text, which sorts the same way
+    as the times it represents, so the columns can be indexed and compared directly.
+
+    Parameters:
+    - value (datetime.datetime | str | None): The timestamp to be formatted.
+
+    Returns:
+    - str | None: The formatted timestamp.
+    """
+    if value is None or value == "":
+        return value
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value.isoformat(sep=" ", timespec="microseconds")
+
+
+def _create_listings_table(cur, table="listings"):
+    """
+    Create the typed listings table and its indexes.
+
+    Parameters:
+    - cur: The database cursor.
+    - table (str): The name of the table to be created.
+    """
+    columns = ",".join(f"{name} {LISTING_COLUMNS[name]}" for name in FIELDS)
+    cur.execute(f"CREATE TABLE {table} ({columns})")
+
+
+def _create_listings_indexes(cur):
+    """
+    Create the indexes of the listings table.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    for name, column in LISTING_INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON listings ({column})")
+
+
+def _migrate_to_v1(cur):
+    """
+    Create the typed listings table, or convert an untyped one created by older versions.
+
+    Rows of the old table are copied over, duplicate ids are resolved in favour of
+    the most recently written row and timestamps are normalized to format_timestamp.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='listings'")
+    if cur.fetchone() is None:
+        _create_listings_table(cur)
+        _create_listings_indexes(cur)
+        return
+    cur.execute("PRAGMA table_info(listings)")
+    columns = [row["name"] for row in cur.fetchall() if row["name"] in LISTING_COLUMNS]
+    _create_listings_table(cur, "listings_v1")
+    cur.execute(
+        f"""INSERT OR REPLACE INTO listings_v1({','.join(columns)})
+        SELECT {','.join(columns)} FROM listings WHERE id IS NOT NULL ORDER BY rowid"""
+    )
+    cur.execute("DROP TABLE listings")
+    cur.execute("ALTER TABLE listings_v1 RENAME TO listings")
+    for column in ("created", "updated", "last_seen"):
+        cur.execute(
+            f"UPDATE listings SET {column} = {column} || '.000000' WHERE length({column}) = 19"
+        )
+    _create_listings_indexes(cur)
+
+
+def _migrate_to_v2(cur):
+    """
+    Add the content_hash column and fill it in for the stored listings.
+
+    The hashes are computed from the stored values, listings whose values were converted
+    by the column types get a different hash and are compared in full on the next crawl.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    cur.execute("ALTER TABLE listings ADD COLUMN content_hash TEXT")
+    cur.execute("SELECT * FROM listings")
+    hashes = [(Listing(row).content_hash(), row["id"]) for row in cur.fetchall()]
+    cur.executemany("UPDATE listings SET content_hash = ? WHERE id = ?", hashes)
+
+
+def _migrate_to_v3(cur):
+    """
+    Add the listings_clean table holding the cleaned version of each listing.
+
+    The source_hash column holds the content hash of the listing the row was cleaned from,
+    rows are removed together with their listing.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    columns = ",".join(f"{name} {kind}" for name, kind in CLEAN_LISTING_COLUMNS.items())
+    cur.execute(
+        f"CREATE TABLE listings_clean (id TEXT NOT NULL PRIMARY KEY,{columns},source_hash TEXT)"
+    )
+    cur.execute(
+        """CREATE TRIGGER listings_clean_delete AFTER DELETE ON listings
+        BEGIN DELETE FROM listings_clean WHERE id = old.id; END"""
+    )
+
+
+def _migrate_to_v4(cur):
+    """
+    Index the listings_clean columns used to narrow down the listings by the user preferences.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    for name, column in CLEAN_LISTING_INDEXES.items():
+        # the location columns are added and indexed by _migrate_to_v6
+        if column not in LOCATION_COLUMNS:
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON listings_clean ({column})")
+
+
+def _migrate_to_v5(cur):
+    """
+    Add the listings_fts full-text index of the addresses and descriptions of the cleaned listings.
+
+    The index refers to the listings_clean rows by their rowid and is kept up to date by triggers,
+    the words are indexed case and diacritics insensitive.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    cur.execute(
+        f"""CREATE VIRTUAL TABLE listings_fts USING fts5(address, description,
+        content='listings_clean', content_rowid='rowid', tokenize='{FTS_TOKENIZER}')"""
+    )
+    cur.execute(
+        """CREATE TRIGGER listings_fts_insert AFTER INSERT ON listings_clean BEGIN
+        INSERT INTO listings_fts(rowid, address, description) VALUES (new.rowid, new.address, new.description);
+        END"""
+    )
+    cur.execute(
+        """CREATE TRIGGER listings_fts_delete AFTER DELETE ON listings_clean BEGIN
+        INSERT INTO listings_fts(listings_fts, rowid, address, description)
+        VALUES ('delete', old.rowid, old.address, old.description);
+        END"""
+    )
+    cur.execute(
+        """CREATE TRIGGER listings_fts_update AFTER UPDATE OF address, description ON listings_clean BEGIN
+        INSERT INTO listings_fts(listings_fts, rowid, address, description)
+        VALUES ('delete', old.rowid, old.address, old.description);
+        INSERT INTO listings_fts(rowid, address, description) VALUES (new.rowid, new.address, new.description);
+        END"""
+    )
+    cur.execute("INSERT INTO listings_fts(listings_fts) VALUES ('rebuild')")
+
+
+def _migrate_to_v6(cur):
+    """
+    Add the city, district, quarter and street columns of the cleaned listings, parsed from their
+    addresses, and index the city, district and quarter.
+
+    Databases created at this version already have the columns from _migrate_to_v3.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    cur.execute("PRAGMA table_info(listings_clean)")
+    existing = {row["name"] for row in cur.fetchall()}
+    for column in LOCATION_COLUMNS:
+        if column not in existing:
+            cur.execute(f"ALTER TABLE listings_clean ADD COLUMN {column} {CLEAN_LISTING_COLUMNS[column]}")
+    for name, column in CLEAN_LISTING_INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON listings_clean ({column})")
+    cur.execute("SELECT rowid, address FROM listings_clean")
+    locations = [parse_address(row["address"]) + (row["rowid"],) for row in cur.fetchall()]
+    cur.executemany(
+        f"UPDATE listings_clean SET {','.join(f'{column} = ?' for column in LOCATION_COLUMNS)} WHERE rowid = ?",
+        locations,
+    )
+
+
+def _migrate_to_v7(cur):
+    """
+    Add the crawl_runs table recording when each crawl started, how it ended and how long its phases took.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    phases = ",".join(f"{phase}_seconds REAL" for phase in CRAWL_PHASES)
+    cur.execute(
+        f"""CREATE TABLE crawl_runs (started TEXT NOT NULL, status TEXT NOT NULL,
+        duration REAL,{phases})"""
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS crawl_runs_started ON crawl_runs (started)")
+
+
+def _migrate_to_v8(cur):
+    """
+    Store the missing coordinates of cleaned listings as NULL, listings scraped without coordinates
+    used to have them stored as empty strings.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    for column in ["gps_lat", "gps_lon"]:
+        cur.execute(f"UPDATE listings_clean SET {column} = NULL WHERE {column} = ''")
+
+
+def _migrate_to_v9(cur):
+    """
+    Clean the listings without an available_from date again, older versions of the listings cleaner
+    dropped the dates with a day above 12.
+
+    Parameters:
+    - cur: The database cursor.
+    """
+    cur.execute("UPDATE listings_clean SET source_hash = NULL WHERE available_from IS NULL")
+
+# schema migrations, MIGRATIONS[n] upgrades a database from version n to n + 1
+MIGRATIONS = [
+    _migrate_to_v1,
+    _migrate_to_v2,
+    _migrate_to_v3,
+    _migrate_to_v4,
+    _migrate_to_v5,
+    _migrate_to_v6,
+    _migrate_to_v7,
+    _migrate_to_v8,
+    _migrate_to_v9,
+]
+
+
+class DatabaseWrapper:  # pylint: disable=too-many-public-methods
     """
     A class that provides methods to interact with a SQLite listings database.
     """
@@ -24,23 +355,27 @@ class DatabaseWrapper:
 
     def create_table(self):
         """
-        Create a table in the database based on the attributes of the Listing class.
+        Create the listings table, or migrate an existing database to the current schema version.
+
+        The schema version is kept in the user_version pragma of the database and
+        all pending migrations are applied in a single transaction.
         """
         if self.conn is None:
             return
         try:
             c = self.conn.cursor()
-            listing = Listing()
-            columns = [
-                attr
-                for attr in dir(listing)
-                if not callable(getattr(listing, attr)) and not attr.startswith("__")
-            ]
-            create_table_sql = (
-                f"CREATE TABLE IF NOT EXISTS listings ({','.join(columns)});"
-            )
-            c.execute(create_table_sql)
+            c.execute("PRAGMA user_version")
+            version = c.fetchone()["user_version"]
+            if version >= SCHEMA_VERSION:
+                return
+            c.execute("BEGIN")
+            for migration in MIGRATIONS[version:]:
+                migration(c)
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.conn.commit()
+            print(f"migrated the database from version {version} to {SCHEMA_VERSION}")
         except Error as e:
+            self.conn.rollback()
             print(e)
 
     def insert_listing(self, listing, date_created):
@@ -56,19 +391,14 @@ class DatabaseWrapper:
         """
         if self.conn is None:
             return None
-        columns = [
-            attr
-            for attr in dir(listing)
-            if not callable(getattr(listing, attr)) and not attr.startswith("__")
-        ]
-        placeholders = ",".join(["?" for _ in columns])
-        sql = f"INSERT INTO listings({','.join(columns)}) VALUES({placeholders}) "
+        placeholders = ",".join(["?" for _ in FIELDS])
+        sql = f"INSERT INTO listings({','.join(FIELDS)},content_hash) VALUES({placeholders},?) "
         cur = self.conn.cursor()
         if date_created is not None:
-            listing.created = date_created
-            listing.last_seen = date_created
-            listing.updated = date_created
-        cur.execute(sql, [getattr(listing, attr) for attr in columns])
+            listing.created = format_timestamp(date_created)
+            listing.last_seen = format_timestamp(date_created)
+            listing.updated = format_timestamp(date_created)
+        cur.execute(sql, listing.to_row() + (listing.content_hash(),))
         self.conn.commit()
         return cur.lastrowid
 
@@ -101,14 +431,15 @@ class DatabaseWrapper:
         if self.conn is None:
             return None
         cur = self.conn.cursor()
-        cur.execute("SELECT * FROM listings WHERE id=?", (listing_id,))
+        cur.row_factory = None
+        cur.execute(f"SELECT {','.join(FIELDS)} FROM listings WHERE id=?", (listing_id,))
 
         row = cur.fetchone()
 
         if row is None:
             return None
 
-        listing = Listing(row)
+        listing = Listing.from_row(row)
         return listing
 
     def remove_listing(self, listing_id):
@@ -137,42 +468,182 @@ class DatabaseWrapper:
         """
         if self.conn is None:
             return
-        attributes = [
-            attr
-            for attr in dir(listing)
-            if not callable(getattr(listing, attr)) and not attr.startswith("__")
-        ]
-        sql = f"UPDATE listings SET {','.join([f'{attr}=?' for attr in attributes if attr != 'id'])} WHERE id=?"
+        sql = (
+            f"UPDATE listings SET {','.join([f'{attr}=?' for attr in FIELDS if attr != 'id'])},"
+            "content_hash=? WHERE id=?"
+        )
         cur = self.conn.cursor()
         if date_updated is not None:
-            listing.updated = date_updated
+            listing.updated = format_timestamp(date_updated)
         if last_seen is not None:
-            listing.last_seen = last_seen
+            listing.last_seen = format_timestamp(last_seen)
         if created is not None:
-            listing.created = created
-        attribute_values = [
-            getattr(listing, attr) for attr in attributes if attr != "id"
-        ]
-        attribute_values.append(listing.id)
-        cur.execute(sql, attribute_values)
+            listing.created = format_timestamp(created)
+        cur.execute(sql, listing.to_row()[1:] + (listing.content_hash(), listing.id))
         self.conn.commit()
 
+    def _load_incoming(self, cur, listings):
+        """
+        Load a batch of listings into the incoming_listings temporary table.
+
+        Parameters:
+        - cur: The database cursor.
+        - listings (list[Listing]): The Listing objects to be loaded.
+
+        Returns:
+        - dict: The loaded Listing objects by their ID as stored in the database.
+        """
+        # the last occurrence of a listing within the batch wins
+        batch = {str(item.id): item for item in listings if item.id is not None}
+        cur.execute(
+            f"""CREATE TEMP TABLE IF NOT EXISTS incoming_listings
+            ({','.join(f'{attr} {LISTING_COLUMNS[attr]}' for attr in PAYLOAD_FIELDS)},
+            content_hash TEXT)"""
+        )
+        cur.execute("DELETE FROM incoming_listings")
+        cur.executemany(
+            f"INSERT INTO incoming_listings({','.join(PAYLOAD_FIELDS)},content_hash) "
+            f"VALUES({','.join(['?' for _ in PAYLOAD_FIELDS])},?)",
+            [
+                item.payload() + (item.content_hash(),) for item in batch.values()
+            ],
+        )
+        return batch
+
+    def _diff_incoming(self, cur):
+        """
+        Compare the incoming_listings table with the stored listings column by column.
+
+        Same as Listing.__eq__, the created, updated and last_seen attributes are not compared.
+
+        Parameters:
+        - cur: The database cursor.
+
+        Returns:
+        - dict: The names of the changed fields by listing ID, only for listings that have changed.
+        """
+        compared = [attr for attr in PAYLOAD_FIELDS if attr != "id"]
+        cur.execute(
+            f"""SELECT i.id AS id, {','.join(f'i.{attr} IS NOT l.{attr} AS {attr}' for attr in compared)}
+            FROM incoming_listings AS i JOIN listings AS l ON l.id = i.id
+            WHERE {' OR '.join(f'i.{attr} IS NOT l.{attr}' for attr in compared)}"""
+        )
+        return {row["id"]: [attr for attr in compared if row[attr]] for row in cur.fetchall()}
+
+    def get_changed_listings(self, listings):
+        """
+        Find the listings of a batch that differ from their stored version.
+
+        Parameters:
+        - listings (list[Listing]): The Listing objects to be compared.
+
+        Returns:
+        - list[tuple[Listing, list[str]]]: The changed Listing objects with the names of their changed fields.
+        """
+        if self.conn is None:
+            return []
+        try:
+            with self.conn:
+                cur = self.conn.cursor()
+                batch = self._load_incoming(cur, listings)
+                changes = self._diff_incoming(cur)
+                cur.execute("DELETE FROM incoming_listings")
+        except Error as e:
+            print(e)
+            return []
+        return [(batch[listing_id], fields) for listing_id, fields in changes.items()]
+
+    def upsert_listings(self, listings, last_crawl_time, expire=True):
+        """
+        Insert, update and expire a whole crawl's worth of listings in one transaction.
+
+        The batch is loaded into a temporary table and merged into the listings table
+        with set-based statements instead of a query and a commit per listing.
+        Listings with the same content hash as the stored ones only get their last_seen
+        date bumped, the rest is compared and rewritten in full. Listings with a different
+        hash but the same stored values are counted as unchanged.
+
+        Parameters:
+        - listings (list[Listing]): The scraped Listing objects.
+        - last_crawl_time (datetime.datetime): The time of the crawl.
+        - expire (bool): Whether to delete the listings not seen by the crawl. A crawl stored in several
+          batches passes False and calls delete_old_listings once all its batches are stored.
+
+        Returns:
+        - dict: The number of "inserted", "changed", "unchanged" and "expired" listings.
+        """
+        result = {"inserted": 0, "changed": 0, "unchanged": 0, "expired": 0}
+        if self.conn is None:
+            return result
+        now = format_timestamp(last_crawl_time)
+        expired = format_timestamp(last_crawl_time - datetime.timedelta(hours=1))
+        try:
+            with self.conn:
+                cur = self.conn.cursor()
+                self._load_incoming(cur, listings)
+                # looked up by the IDs of the batch, an UPDATE FROM would scan all the stored listings
+                cur.execute(
+                    """UPDATE listings SET last_seen = ? WHERE id IN (SELECT id FROM incoming_listings)
+                    AND content_hash = (SELECT i.content_hash FROM incoming_listings AS i WHERE i.id = listings.id)""",
+                    (now,),
+                )
+                result["unchanged"] = cur.rowcount
+                cur.execute(
+                    """DELETE FROM incoming_listings AS i WHERE EXISTS (SELECT 1 FROM listings
+                    WHERE listings.id = i.id AND listings.content_hash = i.content_hash)"""
+                )
+                changes = self._diff_incoming(cur)
+                for listing_id, fields in changes.items():
+                    print(f"listing {listing_id} has changed: {', '.join(fields)}")
+                result["changed"] = len(changes)
+                cur.executemany(
+                    """UPDATE listings SET updated = ? WHERE id = ?
+                    AND updated IS NOT NULL AND updated != '' AND updated < ?""",
+                    [(now, listing_id, now) for listing_id in changes],
+                )
+                cur.execute(
+                    f"""UPDATE listings SET {','.join(f'{attr}=i.{attr}' for attr in PAYLOAD_FIELDS)},
+                    content_hash = i.content_hash, last_seen = ?
+                    FROM incoming_listings AS i WHERE i.id = listings.id""",
+                    (now,),
+                )
+                # listings whose hash differs only because the column types converted the stored values,
+                # e.g. by _migrate_to_v2, are equal column by column and only get their hash rewritten
+                result["unchanged"] += cur.rowcount - len(changes)
+                cur.execute(
+                    f"""INSERT INTO listings({','.join(PAYLOAD_FIELDS)},content_hash,created,updated,last_seen)
+                    SELECT {','.join(PAYLOAD_FIELDS)},content_hash,?,?,? FROM incoming_listings AS i
+                    WHERE NOT EXISTS (SELECT 1 FROM listings WHERE listings.id = i.id)""",
+                    (now, now, now),
+                )
+                result["inserted"] = cur.rowcount
+                if expire:
+                    cur.execute("DELETE FROM listings WHERE last_seen < ?", (expired,))
+                    result["expired"] = cur.rowcount
+                cur.execute("DELETE FROM incoming_listings")
+        except Error as e:
+            print(e)
+        return result
+
     def delete_old_listings(self, last_crawl_time):
         """
         Delete all listings with a last_seen date older than the last crawl time.
 
         Parameters:
-        - last_crawl_time (str): The last crawl time.
+        - last_crawl_time (datetime.datetime): The last crawl time.
+
+        Returns:
+        - int: The number of deleted listings.
         """
         if self.conn is None:
-            return
-        sql = "DELETE FROM listings WHERE datetime(last_seen) < datetime(?, '-1 hour')"
+            return 0
+        sql = "DELETE FROM listings WHERE last_seen < ?"
         cur = self.conn.cursor()
-        cur.execute(sql, (last_crawl_time,))
-        deleted_ids = cur.fetchall()
-        for listing_id in deleted_ids:
-            print(f"Deleted listing with id: {listing_id}")
+        cur.execute(
+            sql, (format_timestamp(last_crawl_time - datetime.timedelta(hours=1)),)
+        )
         self.conn.commit()
+        return cur.rowcount
 
     def get_df(self):
         """
@@ -188,6 +659,243 @@ class DatabaseWrapper:
         self.conn.row_factory = self.dict_factory
         return df
 
+    def get_unclean_df(self):
+        """
+        Retrieve the listings that have not been cleaned yet or have changed since they were cleaned.
+
+        Returns:
+        - pandas.DataFrame: The retrieved listings as a DataFrame.
+        """
+        if self.conn is None:
+            return None
+        self.conn.row_factory = None
+        df = pd.read_sql_query(
+            """SELECT l.* FROM listings AS l LEFT JOIN listings_clean AS c ON c.id = l.id
+            WHERE c.id IS NULL OR c.source_hash IS NOT l.content_hash""",
+            self.conn,
+        )
+        self.conn.row_factory = self.dict_factory
+        return df
+
+    def store_clean_listings(self, df):
+        """
+        Insert cleaned listings into the listings_clean table, or update the ones already there.
+
+        The rows are updated in place rather than replaced, so they keep their rowid in the listings_fts index.
+
+        Parameters:
+        - df (pandas.DataFrame): The cleaned listings indexed by their ID, with the
+          CLEAN_LISTING_COLUMNS columns and the content_hash they were cleaned from.
+        """
+        if self.conn is None:
+            return
+        columns = list(CLEAN_LISTING_COLUMNS) + ["content_hash"]
+        values = df[columns].astype(object)
+        values = values.where(values.notna(), None)
+        sql = (
+            f"INSERT INTO listings_clean(id,{','.join(CLEAN_LISTING_COLUMNS)},source_hash) "
+            f"VALUES(?,{','.join(['?' for _ in columns])}) ON CONFLICT(id) DO UPDATE SET "
+            + ",".join(f"{name}=excluded.{name}" for name in list(CLEAN_LISTING_COLUMNS) + ["source_hash"])
+        )
+        try:
+            with self.conn:
+                self.conn.executemany(sql, values.itertuples(name=None))
+        except Error as e:
+            print(e)
+
+    def get_clean_df(self, where="", params=()):
+        """
+        Retrieve the cleaned listings from the listings_clean table as a pandas DataFrame,
+        together with the created, updated and last_seen dates of the listings.
+
+        Parameters:
+        - where (str): A condition over the retrieved columns the listings must meet, all listings if empty.
+        - params (list): The parameters of the condition.
+
+        Returns:
+        - pandas.DataFrame: The retrieved listings as a DataFrame.
+        """
+        if self.conn is None:
+            return None
+        self.conn.row_factory = None
+        df = pd.read_sql_query(
+            f"""SELECT * FROM (SELECT c.id,{','.join(f'c.{name}' for name in CLEAN_LISTING_COLUMNS)},
+            l.created,l.updated,l.last_seen
+            FROM listings_clean AS c JOIN listings AS l ON l.id = c.id)
+            {f'WHERE {where}' if where else ''}""",
+            self.conn,
+            params=list(params),
+        )
+        self.conn.row_factory = self.dict_factory
+        return df
+
+    def get_addresses_without_coordinates(self):
+        """
+        Retrieve the addresses of the cleaned listings that have no coordinates.
+
+        Returns:
+        - dict[str, list[str]]: The IDs of the listings by their address.
+        """
+        if self.conn is None:
+            return {}
+        addresses = {}
+        for row in self.conn.execute(
+            """SELECT id, address FROM listings_clean
+            WHERE (gps_lat IS NULL OR gps_lon IS NULL OR gps_lat = '' OR gps_lon = '')
+            AND address IS NOT NULL AND address != ''"""
+        ):
+            addresses.setdefault(row["address"], []).append(row["id"])
+        return addresses
+
+    def get_quarter_cities(self, quarters):
+        """
+        Retrieve the cities the given quarters are in, as parsed from the addresses of the cleaned listings.
+
+        Parameters:
+        - quarters (list[str]): The names of the quarters, e.g. "Karlín".
+
+        Returns:
+        - dict[str, list[str]]: The cities of each of the quarters found by its name.
+        """
+        if self.conn is None or not quarters:
+            return {}
+        cities = {}
+        for row in self.conn.execute(
+            f"""SELECT DISTINCT quarter, city FROM listings_clean
+            WHERE quarter IN ({','.join(['?' for _ in quarters])}) AND city IS NOT NULL ORDER BY city""",
+            list(quarters),
+        ):
+            cities.setdefault(row["quarter"], []).append(row["city"])
+        return cities
+
+    def store_coordinates(self, coordinates):
+        """
+        Set the coordinates of cleaned listings.
+
+        Parameters:
+        - coordinates (list[tuple[float, float, str]]): The latitude, longitude and ID of each listing.
+        """
+        if self.conn is None:
+            return
+        try:
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE listings_clean SET gps_lat = ?, gps_lon = ? WHERE id = ?", coordinates
+                )
+        except Error as e:
+            print(e)
+
+    def get_listing_prices(self):
+        """
+        Retrieve the price of each stored listing, which tells whether a listing on a search
+        results page has changed since it was last scraped.
+
+        Returns:
+        - dict[str, object]: The price of each listing as stored, by its ID.
+        """
+        if self.conn is None:
+            return {}
+        try:
+            return {
+                str(row["id"]): row["price"]
+                for row in self.conn.execute("SELECT id, price FROM listings")
+            }
+        except Error as e:
+            print(e)
+            return {}
+
+    def touch_listings(self, listing_ids, last_seen):
+        """
+        Mark stored listings as seen by a crawl without changing their content.
+
+        Parameters:
+        - listing_ids (list[str]): The IDs of the listings.
+        - last_seen (datetime.datetime): The time the listings were seen.
+
+        Returns:
+        - int: The number of listings marked.
+        """
+        if self.conn is None:
+            return 0
+        timestamp = format_timestamp(last_seen)
+        try:
+            with self.conn:
+                cur = self.conn.executemany(
+                    "UPDATE listings SET last_seen = ? WHERE id = ?",
+                    ((timestamp, listing_id) for listing_id in listing_ids),
+                )
+            return cur.rowcount
+        except Error as e:
+            print(e)
+            return 0
+
+    def record_crawl_run(self, started, status, duration, phase_durations):
+        """
+        Record a run of the crawler.
+
+        Parameters:
+        - started (datetime.datetime): The time the run started.
+        - status (str): How the run ended, e.g. "ok", "failed: update" or "skipped".
+        - duration (float): The number of seconds the run took.
+        - phase_durations (dict[str, float]): The number of seconds each of the CRAWL_PHASES took,
+          phases the run did not get to are left out.
+        """
+        if self.conn is None:
+            return
+        columns = ",".join(f"{phase}_seconds" for phase in CRAWL_PHASES)
+        try:
+            with self.conn:
+                self.conn.execute(
+                    f"INSERT INTO crawl_runs(started,status,duration,{columns}) "
+                    f"VALUES(?,?,?,{','.join(['?' for _ in CRAWL_PHASES])})",
+                    (format_timestamp(started), status, duration)
+                    + tuple(phase_durations.get(phase) for phase in CRAWL_PHASES),
+                )
+        except Error as e:
+            print(e)
+
+    def get_crawl_runs(self, limit=100):
+        """
+        Retrieve the most recent runs of the crawler.
+
+        Parameters:
+        - limit (int): The maximum number of runs.
+
+        Returns:
+        - list[dict]: The runs from the most recent one, with the columns of the crawl_runs table.
+        """
+        if self.conn is None:
+            return []
+        try:
+            return self.conn.execute(
+                "SELECT * FROM crawl_runs ORDER BY started DESC LIMIT ?", (limit,)
+            ).fetchall()
+        except Error as e:
+            print(e)
+            return []
+
+    def search_text(self, query, column):
+        """
+        Find the cleaned listings matching a keyword search using the listings_fts full-text index.
+
+        Parameters:
+        - query (TextQuery): The keyword search.
+        - column (str): The searched column, "address" or "description".
+
+        Returns:
+        - list[str]: The IDs of the matching listings.
+        """
+        if self.conn is None:
+            return []
+        sql = FTS_MATCHING_IDS
+        if query.negated:
+            sql = f"SELECT id FROM listings_clean WHERE id NOT IN ({FTS_MATCHING_IDS})"
+        try:
+            return [row["id"] for row in self.conn.execute(sql, (query.fts_match(column),))]
+        except Error as e:
+            print(e)
+            return []
+
     def close_conn(self):
         """
         Close the database connection.
@@ -3,15 +3,61 @@ from wtforms import (  # pylint: disable=import-error
     SelectField,
     StringField,
     IntegerField,
+    FloatField,
     BooleanField,
     SubmitField,
     SelectMultipleField,
 )
-from wtforms.validators import DataRequired, Optional  # pylint: disable=import-error
+from wtforms.validators import (  # pylint: disable=import-error
+    DataRequired,
+    Optional,
+    Regexp,
+    ValidationError,
+)
 from disposition import Disposition
 from property_type import PropertyType
 from furnished import Furnished
 from property_status import PropertyStatus
+from locality import split_places
+
+
+# comma separated non-negative numbers, e.g. "2, 1, 0.5"
+POI_WEIGHTS_PATTERN = r"^\s*\d+(\.\d+)?\s*(,\s*\d+(\.\d+)?\s*)*$"
+
+
+def join_places(value):
+    """
+    Normalizes the places of the location, e.g. " Praha  2,,Karlín" to "Praha 2, Karlín".
+
+    Args:
+        value (None | str): The location as entered.
+
+    Returns:
+        None | str: The places as returned by split_places separated by commas, "" if there are none.
+    """
+    return value if value is None else ", ".join(split_places(value))
+
+
+def weights_match_points(form, field):
+    """
+    Validates that there is one weight for each point of interest.
+
+    Args:
+        form (UserPreferencesForm): The form.
+        field (StringField): The poi_weights field.
+
+    Raises:
+        ValidationError: If the number of the weights and the points of interest differ.
+    """
+    if field.errors:
+        # not numbers separated by commas
+        return
+    points = [entry for entry in (form.points_of_interest.data or "").split(";") if entry.strip()]
+    weights = field.data.split(",")
+    if len(weights) != len(points):
+        raise ValidationError(
+            f"one weight is needed for each of the {len(points)} points of interest, {len(weights)} given"
+        )
 
 
 class UserPreferencesForm(FlaskForm):
@@ -21,10 +67,14 @@ class UserPreferencesForm(FlaskForm):
     This form allows users to specify their preferences for property search.
 
     Attributes:
-        location (SelectField): The location of the property.
+        location (StringField): The cities, districts or quarters of the property separated by commas.
         estate_type (SelectField): The type of the property (e.g., apartment, house).
         listing_type (SelectField): The type of the listing (e.g., sale, rental).
-        points_of_interest (StringField): Points of interest near the property.
+        points_of_interest (StringField): Points of interest near the property, addresses or coordinates
+            separated by semicolons.
+        poi_aggregation (SelectField): How the distances to the points of interest are combined.
+        poi_weights (StringField): Comma separated weights of the points of interest, one for each point.
+        max_poi_distance (FloatField): The maximum distance in kilometers from the nearest point of interest.
         disposition (SelectMultipleField): The layout of the property.
         min_area (IntegerField): The minimum area of the property.
         max_area (IntegerField): The maximum area of the property.
@@ -42,12 +92,15 @@ class UserPreferencesForm(FlaskForm):
         furnished (SelectMultipleField): The level of furnishing of the property.
         status (SelectMultipleField): The status of the property.
         floor (IntegerField): The floor of the property.
-        description (StringField): Description of the property.
+        description (StringField): Keywords in the description of the property, see TextQuery.
         submit (SubmitField): Submit button for the form.
     """
 
-    location = SelectField(
-        "Město", validators=[DataRequired()], choices=["Praha", "Brno", "Ostrava"]
+    location = StringField(
+        "Lokalita",
+        filters=[join_places],
+        validators=[DataRequired(message="enter the cities, districts or quarters separated by commas")],
+        render_kw={"placeholder": "Praha 2, Karlín"},
     )
     estate_type = SelectField(
         "Typ nemovitosti", validators=[DataRequired()], choices=["byt", "dům"]
@@ -55,7 +108,32 @@ class UserPreferencesForm(FlaskForm):
     listing_type = SelectField(
         "Typ inzerátu", validators=[DataRequired()], choices=["prodej", "pronájem"]
     )
-    points_of_interest = StringField("Body zájmu")
+    points_of_interest = StringField(
+        "Body zájmu", render_kw={"placeholder": "NTK Praha; 50.0755,14.4378"}
+    )
+    poi_aggregation = SelectField(
+        "Vzdálenost od bodů zájmu",
+        choices=[
+            ("nearest", "k nejbližšímu"),
+            ("mean", "průměrná"),
+            ("weighted", "vážený průměr"),
+        ],
+    )
+    poi_weights = StringField(
+        "Váhy bodů zájmu",
+        validators=[
+            Optional(),
+            Regexp(
+                POI_WEIGHTS_PATTERN,
+                message="the weights of the points of interest must be numbers separated by commas",
+            ),
+            weights_match_points,
+        ],
+        render_kw={"placeholder": "2, 1"},
+    )
+    max_poi_distance = FloatField(
+        "Max. vzdálenost od bodů zájmu (km)", validators=[Optional()]
+    )
     disposition = SelectMultipleField(
         "Dispozice",
         choices=[(disposition.value) for disposition in Disposition],
@@ -89,5 +167,7 @@ class UserPreferencesForm(FlaskForm):
         validators=[Optional()],
     )
     floor = IntegerField("Patro")
-    description = StringField("Popis")
+    description = StringField(
+        "Popis", render_kw={"placeholder": "výtah AND (sklep OR balkon) NOT suterén"}
+    )
     submit = SubmitField("Uložit")
@@ -0,0 +1,283 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from sqlite3 import Error, connect
+from typing import Callable
+from geopy import Point  # type: ignore pylint: disable=import-error
+from geopy.exc import GeopyError  # type: ignore pylint: disable=import-error
+from geopy.geocoders import Nominatim  # type: ignore pylint: disable=import-error
+
+
+# how long the coordinates of an address are kept, and how long an address that was not found is not looked up
+GEOCODING_TTL = 30 * 24 * 3600
+NEGATIVE_GEOCODING_TTL = 24 * 3600
+
+COMMA = re.compile(r"\s*,\s*")
+# a latitude and longitude, e.g. "50.1036, 14.3901"
+COORDINATES = re.compile(r"^\s*([+-]?\d+(?:\.\d+)?)\s*,\s*([+-]?\d+(?:\.\d+)?)\s*$")
+
+
+def normalize_address(address: str) -> str:
+    """
+    Returns the key of an address in the geocoding cache, the same for addresses
+    differing only in letter case and whitespace.
+
+    Args:
+        address (str): The address, e.g. "NTK  Praha".
+
+    Returns:
+        str: The normalized address, e.g. "ntk praha".
+    """
+    return COMMA.sub(", ", " ".join(address.casefold().split())).strip(", ")
+
+
+def parse_coordinates(text: str) -> None | Point:
+    """
+    Parses coordinates written as the latitude and longitude separated by a comma.
+
+    Args:
+        text (str): The text, e.g. "50.1036,14.3901".
+
+    Returns:
+        None | Point: The coordinates, None if the text is not coordinates (e.g. an address).
+    """
+    match = COORDINATES.match(text)
+    if match is None:
+        return None
+    try:
+        return Point(float(match[1]), float(match[2]))
+    except ValueError:
+        return None
+
+
+class NominatimBackend:
+    """
+    Looks up addresses in the OpenStreetMap Nominatim geocoder, reusing one client for all lookups.
+    """
+
+    def __init__(self, user_agent: str = "distance_calculator") -> None:
+        """
+        Initialize a NominatimBackend object.
+
+        Args:
+            user_agent (str, optional): The application name sent to Nominatim. Defaults to "distance_calculator".
+        """
+        self._geolocator = Nominatim(user_agent=user_agent)
+
+    def __call__(self, address: str) -> None | tuple[float, float]:
+        """
+        Looks up an address.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            None | tuple[float, float]: The latitude and longitude, None if the address was not found.
+
+        Raises:
+            GeopyError: If the lookup failed, e.g. the service is unavailable or rate limited.
+        """
+        location = self._geolocator.geocode(address)
+        if location is None:
+            return None
+        return location.latitude, location.longitude
+
+
+class RateLimitedBackend:
+    """
+    Calls a backend at most once per min_interval seconds, even from several threads,
+    e.g. Nominatim allows one request per second.
+    """
+
+    def __init__(
+        self, backend: Callable[[str], None | tuple[float, float]], min_interval: float = 1.0
+    ) -> None:
+        """
+        Initialize a RateLimitedBackend object.
+
+        Args:
+            backend (Callable[[str], None | tuple[float, float]]): The rate limited backend.
+            min_interval (float, optional): The minimum number of seconds between the calls. Defaults to 1.0.
+        """
+        self.backend = backend
+        self.min_interval = min_interval
+        self._next_call = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, address: str) -> None | tuple[float, float]:
+        """
+        Looks up an address, waiting for the previous call to be min_interval seconds ago.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            None | tuple[float, float]: The latitude and longitude, None if the address was not found.
+        """
+        with self._lock:
+            wait = self._next_call - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                return self.backend(address)
+            finally:
+                self._next_call = time.monotonic() + self.min_interval
+
+
+class Geocoder:
+    """
+    Finds the coordinates of addresses, caching them in memory and in a SQLite database.
+
+    Addresses are looked up by the backend only if they are in neither cache or have expired there,
+    addresses the backend did not find are cached as well, for a shorter time.
+    Failed lookups (e.g. the service is unavailable) are not cached.
+
+    Attributes:
+        db_file (str): The path to the database file of the persistent cache.
+        backend (Callable[[str], None | tuple[float, float]]): The function looking up the latitude
+            and longitude of an address, None if the address does not exist.
+        ttl (float): The number of seconds the coordinates of an address are cached.
+        negative_ttl (float): The number of seconds an address that was not found is cached.
+        max_entries (int): The maximum number of addresses cached in memory.
+        hits (int): The number of lookups served from memory.
+        db_hits (int): The number of lookups served from the database.
+        misses (int): The number of lookups made by the backend.
+    """
+
+    def __init__(
+        self,
+        db_file: str,
+        backend: None | Callable[[str], None | tuple[float, float]] = None,
+        ttl: float = GEOCODING_TTL,
+        negative_ttl: float = NEGATIVE_GEOCODING_TTL,
+        max_entries: int = 1024,
+    ) -> None:
+        """
+        Initialize a Geocoder object.
+
+        Args:
+            db_file (str): The path to the database file of the persistent cache, created if it does not exist.
+            backend (None | Callable[[str], None | tuple[float, float]], optional): The function looking up
+                the coordinates of an address, a NominatimBackend limited to one lookup per second if not given.
+                Defaults to None.
+            ttl (float, optional): The number of seconds the coordinates of an address are cached.
+                Defaults to GEOCODING_TTL.
+            negative_ttl (float, optional): The number of seconds an address that was not found is cached.
+                Defaults to NEGATIVE_GEOCODING_TTL.
+            max_entries (int, optional): The maximum number of addresses cached in memory. Defaults to 1024.
+        """
+        self.db_file = db_file
+        self.backend = backend if backend is not None else RateLimitedBackend(NominatimBackend())
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        # normalized address -> (expiration time, coordinates or None)
+        self._entries: OrderedDict[str, tuple[float, None | tuple[float, float]]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def geocode(self, address: str) -> None | Point:
+        """
+        Finds the coordinates of an address.
+
+        Args:
+            address (str): The address to geocode.
+
+        Returns:
+            None | Point: The coordinates of the address, None if it was not found or the lookup failed.
+        """
+        key = normalize_address(address)
+        if not key:
+            return None
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._point(entry[1])
+        entry = self._load(key, now)
+        if entry is not None:
+            with self._lock:
+                self.db_hits += 1
+            self._remember(key, entry)
+            return self._point(entry[1])
+        with self._lock:
+            self.misses += 1
+        try:
+            coordinates = self.backend(address)
+        except GeopyError as e:
+            print(e)
+            return None
+        entry = (now + (self.ttl if coordinates is not None else self.negative_ttl), coordinates)
+        self._store(key, entry)
+        self._remember(key, entry)
+        return self._point(coordinates)
+
+    @staticmethod
+    def _point(coordinates: None | tuple[float, float]) -> None | Point:
+        return None if coordinates is None else Point(*coordinates)
+
+    def _remember(self, key: str, entry: tuple[float, None | tuple[float, float]]) -> None:
+        """
+        Caches an address in memory, forgetting the least recently used ones over max_entries.
+        """
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _connect(self):
+        conn = connect(self.db_file)
+        conn.execute(
+            """CREATE TABLE IF NOT EXISTS geocoding (address TEXT NOT NULL PRIMARY KEY,
+            lat REAL, lon REAL, expires REAL NOT NULL)"""
+        )
+        return conn
+
+    def _load(self, key: str, now: float) -> None | tuple[float, None | tuple[float, float]]:
+        """
+        Returns the entry of an address in the database, None if it is not there or has expired.
+        """
+        try:
+            with closing(self._connect()) as conn:
+                row = conn.execute(
+                    "SELECT expires, lat, lon FROM geocoding WHERE address = ? AND expires > ?",
+                    (key, now),
+                ).fetchone()
+        except Error as e:
+            print(e)
+            return None
+        if row is None:
+            return None
+        return row[0], None if row[1] is None else (row[1], row[2])
+
+    def _store(self, key: str, entry: tuple[float, None | tuple[float, float]]) -> None:
+        """
+        Saves the entry of an address to the database.
+        """
+        lat, lon = entry[1] if entry[1] is not None else (None, None)
+        try:
+            with closing(self._connect()) as conn:
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO geocoding(address, lat, lon, expires) VALUES (?, ?, ?, ?)",
+                        (key, lat, lon, entry[0]),
+                    )
+        except Error as e:
+            print(e)
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the geocoder.
+
+        Returns:
+            dict: The number of lookups served from memory ("hits"), from the database ("db_hits")
+                and by the backend ("misses").
+        """
+        return {"hits": self.hits, "db_hits": self.db_hits, "misses": self.misses}
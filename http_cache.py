@@ -0,0 +1,218 @@
+import glob
+import os
+import shutil
+import time
+from scrapy import signals  # type: ignore pylint: disable=import-error
+from scrapy.extensions.httpcache import (  # type: ignore pylint: disable=import-error
+    FilesystemCacheStorage,
+    RFC2616Policy,
+)
+from incremental_crawl import LISTING_ID_META, LISTING_PRICE_META, price_marker
+
+
+# the request meta key overriding the number of seconds a cached page is used without asking the portal
+HTTP_CACHE_TTL_META = "http_cache_ttl"
+
+# the header a cached detail page keeps the price of the listing it was requested for in
+PRICE_HEADER = b"X-Listing-Price"
+
+
+def http_cache_settings(directory: str, search_ttl: float, detail_ttl: float, max_age: float) -> dict:
+    """
+    Returns the Scrapy settings caching the pages the spiders download.
+
+    Args:
+        directory (str): The directory of the cache.
+        search_ttl (float): The number of seconds a cached search results page is used without asking the portal,
+            after that it is requested again with the ETag and Last-Modified validators of the cached page.
+        detail_ttl (float): The same for the detail pages of listings, see LISTING_ID_META.
+        max_age (float): The number of seconds after which a cached page is downloaded in full again.
+
+    Returns:
+        dict: The settings, to be added to the settings of the CrawlerProcess.
+    """
+    return {
+        "HTTPCACHE_ENABLED": True,
+        # relative directories would be put in the .scrapy directory
+        "HTTPCACHE_DIR": os.path.abspath(directory),
+        "HTTPCACHE_POLICY": "http_cache.ListingCachePolicy",
+        "HTTPCACHE_STORAGE": "http_cache.ListingCacheStorage",
+        "HTTPCACHE_GZIP": True,
+        "HTTPCACHE_EXPIRATION_SECS": max_age,
+        "HTTPCACHE_SEARCH_TTL": search_ttl,
+        "HTTPCACHE_DETAIL_TTL": detail_ttl,
+        "EXTENSIONS": {"http_cache.HttpCacheStats": 500},
+    }
+
+
+class ListingCachePolicy(RFC2616Policy):
+    """
+    The RFC 2616 policy of the Scrapy HTTP cache with the freshness of the cached pages set by the crawler
+    instead of the portals: search results pages are fresh for HTTPCACHE_SEARCH_TTL seconds and detail pages
+    (requests tagged with LISTING_ID_META) for HTTPCACHE_DETAIL_TTL seconds, a request may set its own TTL
+    in HTTP_CACHE_TTL_META. Stale pages are revalidated with their ETag and Last-Modified headers,
+    so an unchanged page costs a 304 response.
+
+    A cached detail page is fresh only for the price it was requested for, a listing whose price has changed
+    is always revalidated. Pages with a TTL are cached even without validators, "Cache-Control: no-store"
+    and "no-cache" are honoured.
+    """
+
+    def __init__(self, settings) -> None:
+        """
+        Initialize a ListingCachePolicy object.
+
+        Args:
+            settings (Settings): The crawler settings.
+        """
+        super().__init__(settings)
+        self.search_ttl = settings.getfloat("HTTPCACHE_SEARCH_TTL", 0)
+        self.detail_ttl = settings.getfloat("HTTPCACHE_DETAIL_TTL", 0)
+
+    def ttl(self, request) -> float:
+        """
+        Returns the number of seconds a cached page is used without asking the portal.
+
+        Args:
+            request (Request): The request of the page.
+
+        Returns:
+            float: The TTL of the request, the detail or the search results TTL.
+        """
+        if HTTP_CACHE_TTL_META in request.meta:
+            return float(request.meta[HTTP_CACHE_TTL_META])
+        return self.detail_ttl if LISTING_ID_META in request.meta else self.search_ttl
+
+    def should_cache_response(self, response, request) -> bool:
+        """
+        Whether to cache a downloaded page.
+
+        Args:
+            response (Response): The page.
+            request (Request): The request of the page.
+
+        Returns:
+            bool: True for pages the RFC 2616 policy caches and for successful pages with a TTL.
+        """
+        if response.status == 200 and self.ttl(request) > 0 and b"no-store" not in self._parse_cachecontrol(response):
+            return True
+        return super().should_cache_response(response, request)
+
+    def is_cached_response_fresh(self, cachedresponse, request) -> bool:
+        """
+        Whether a cached page can be used without asking the portal, adding the validators
+        of the cached page to the request if not.
+
+        Args:
+            cachedresponse (Response): The cached page.
+            request (Request): The request of the page.
+
+        Returns:
+            bool: Whether the cached page is fresh.
+        """
+        if LISTING_PRICE_META in request.meta:
+            price = price_marker(request.meta[LISTING_PRICE_META]).encode("utf-8")
+            if cachedresponse.headers.get(PRICE_HEADER) != price:
+                self._set_conditional_validators(request, cachedresponse)
+                return False
+        return super().is_cached_response_fresh(cachedresponse, request)
+
+    def _compute_freshness_lifetime(self, response, request, now) -> float:
+        return self.ttl(request)
+
+
+class ListingCacheStorage(FilesystemCacheStorage):
+    """
+    The filesystem storage of the Scrapy HTTP cache, keeping the price a detail page was requested for
+    in the PRICE_HEADER of the cached page for ListingCachePolicy.
+    """
+
+    def store_response(self, spider, request, response) -> None:
+        """
+        Caches a page.
+
+        Args:
+            spider (Spider): The spider instance.
+            request (Request): The request of the page.
+            response (Response): The page.
+        """
+        if LISTING_PRICE_META in request.meta:
+            headers = response.headers.copy()
+            headers[PRICE_HEADER] = price_marker(request.meta[LISTING_PRICE_META])
+            response = response.replace(headers=headers)
+        super().store_response(spider, request, response)
+
+
+class HttpCacheStats:
+    """
+    A Scrapy extension adding the share of the requests served by the HTTP cache to the crawl stats
+    when a spider closes: "httpcache/hit_ratio" for fresh cached pages, "httpcache/revalidate_ratio" for
+    pages the portal answered as unchanged and "httpcache/download_ratio" for pages downloaded in full.
+    """
+
+    def __init__(self, stats) -> None:
+        """
+        Initialize a HttpCacheStats object.
+
+        Args:
+            stats (StatsCollector): The stats of the crawler.
+        """
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """
+        Creates the extension.
+
+        Args:
+            crawler (Crawler): The crawler of the spider.
+
+        Returns:
+            HttpCacheStats: The extension.
+        """
+        extension = cls(crawler.stats)
+        crawler.signals.connect(extension.spider_closed, signal=signals.spider_closed)
+        return extension
+
+    def spider_closed(self, spider):
+        """
+        Adds the ratios to the crawl stats.
+
+        Args:
+            spider (Spider): The spider instance.
+        """
+        hits = self.stats.get_value("httpcache/hit", 0)
+        revalidated = self.stats.get_value("httpcache/revalidate", 0)
+        # pages not in the cache and stale pages that have changed
+        downloaded = self.stats.get_value("httpcache/miss", 0) + self.stats.get_value("httpcache/invalidate", 0)
+        requests = hits + revalidated + downloaded
+        if requests == 0:
+            return
+        self.stats.set_value("httpcache/hit_ratio", hits / requests)
+        self.stats.set_value("httpcache/revalidate_ratio", revalidated / requests)
+        self.stats.set_value("httpcache/download_ratio", downloaded / requests)
+        print(
+            f"{spider.name}: {hits} of {requests} pages from the HTTP cache, {revalidated} revalidated, "
+            f"{downloaded} downloaded"
+        )
+
+
+def prune(directory: str, max_age: float) -> int:
+    """
+    Deletes the pages cached longer ago than max_age seconds, e.g. of listings that are gone.
+
+    Args:
+        directory (str): The directory of the cache.
+        max_age (float): The number of seconds after which a cached page is deleted.
+
+    Returns:
+        int: The number of deleted pages.
+    """
+    cutoff = time.time() - max_age
+    deleted = 0
+    # the pages are stored in <directory>/<spider>/<key prefix>/<key>
+    for path in glob.glob(f"{directory}/*/*/*/pickled_meta"):
+        if os.path.getmtime(path) < cutoff:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+            deleted += 1
+    return deleted
@@ -0,0 +1,188 @@
+import datetime
+import json
+import os
+from scrapy import signals  # type: ignore pylint: disable=import-error
+from scrapy.exceptions import IgnoreRequest, NotConfigured  # type: ignore pylint: disable=import-error
+from database_wrapper import DatabaseWrapper
+
+
+# the request meta keys the spiders tag the requests of listing detail pages with
+LISTING_ID_META = "listing_id"
+LISTING_PRICE_META = "listing_price"
+
+# the files read by read_known_listings by their paths, with the modification time they were read at
+_known_listings_files: dict[str, tuple[int, dict[str, str]]] = {}
+
+
+def price_marker(price) -> str:
+    """
+    Returns the price of a listing in the form it is compared in, the same for a price as scraped
+    and as stored in the NUMERIC price column, e.g. "15000", 15000 and 15000.0 are all "15000".
+
+    Args:
+        price: The price, e.g. "15000" or "12 500 €".
+
+    Returns:
+        str: The price as a string, "" if missing.
+    """
+    if price is None:
+        return ""
+    try:
+        number = float(price)
+    except (TypeError, ValueError):
+        return str(price).strip()
+    return str(int(number)) if number.is_integer() else repr(number)
+
+
+def load_known_listings(db_file: str) -> dict[str, str]:
+    """
+    Loads the listings the database already knows, for SkipKnownListingsMiddleware.
+
+    Args:
+        db_file (str): The path to the database file.
+
+    Returns:
+        dict[str, str]: The price of each stored listing, as returned by price_marker, by its ID.
+    """
+    db = DatabaseWrapper(db_file)
+    db.create_table()
+    known = {listing_id: price_marker(price) for listing_id, price in db.get_listing_prices().items()}
+    db.close_conn()
+    return known
+
+
+def save_known_listings(path: str, known: dict[str, str]) -> None:
+    """
+    Writes the known listings to a JSON file, which the crawlers get as the KNOWN_LISTINGS_FILE setting.
+
+    Args:
+        path (str): The path of the file.
+        known (dict[str, str]): The price of each stored listing by its ID, see load_known_listings.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(known, f, ensure_ascii=False)
+
+
+def read_known_listings(path: str) -> dict[str, str]:
+    """
+    Reads the known listings written by save_known_listings, once for all the crawlers of a process
+    as long as the file does not change.
+
+    The returned dictionary is shared between the callers and must not be modified.
+
+    Args:
+        path (str): The path of the file.
+
+    Returns:
+        dict[str, str]: The price of each stored listing by its ID.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    cached = _known_listings_files.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, "r", encoding="utf-8") as f:
+            cached = (mtime, json.load(f))
+        _known_listings_files[path] = cached
+    return cached[1]
+
+
+class SkipKnownListingsMiddleware:
+    """
+    A Scrapy downloader middleware dropping the requests of the detail pages of listings
+    that are stored in the database with the same price, so a crawl fetches only new and changed listings.
+
+    The spiders tag the requests of detail pages with the LISTING_ID_META and LISTING_PRICE_META meta keys,
+    taken from the search results, untagged requests are always fetched. The skipped listings do not reach
+    the item pipelines, their last_seen date is bumped when the spider closes, so they are not expired.
+
+    Attributes:
+        db_file (str): The path to the database file.
+        crawl_time (datetime.datetime): The timestamp of the crawl.
+        known (dict[str, str]): The price of each stored listing by its ID, see load_known_listings.
+        skipped (list[str]): The IDs of the listings skipped so far.
+        fetched (int): The number of detail pages of listings requested so far.
+    """
+
+    def __init__(self, db_file: str, crawl_time: datetime.datetime, known: dict[str, str]) -> None:
+        """
+        Initialize a SkipKnownListingsMiddleware object.
+
+        Args:
+            db_file (str): The path to the database file.
+            crawl_time (datetime.datetime): The timestamp of the crawl.
+            known (dict[str, str]): The price of each stored listing by its ID, see load_known_listings.
+        """
+        self.db_file = db_file
+        self.crawl_time = crawl_time
+        self.known = known
+        self.skipped: list[str] = []
+        self.fetched = 0
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """
+        Creates the middleware from the LISTINGS_DB_FILE, CRAWL_TIME and KNOWN_LISTINGS_FILE crawler settings,
+        the known listings are loaded from the database if no file is given.
+
+        The known listings are passed as a file rather than a setting, as the settings are copied for each crawler.
+
+        Args:
+            crawler (Crawler): The crawler of the spider.
+
+        Returns:
+            SkipKnownListingsMiddleware: The middleware.
+
+        Raises:
+            NotConfigured: If the INCREMENTAL_CRAWL setting is off.
+        """
+        if not crawler.settings.getbool("INCREMENTAL_CRAWL", True):
+            raise NotConfigured("INCREMENTAL_CRAWL is off")
+        db_file = crawler.settings.get("LISTINGS_DB_FILE")
+        known_file = crawler.settings.get("KNOWN_LISTINGS_FILE")
+        middleware = cls(
+            db_file,
+            datetime.datetime.fromisoformat(crawler.settings.get("CRAWL_TIME")),
+            read_known_listings(known_file) if known_file else load_known_listings(db_file),
+        )
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def process_request(self, request, spider):
+        """
+        Drops the request of the detail page of a known listing whose price has not changed.
+
+        Args:
+            request (Request): The request.
+            spider (Spider): The spider instance.
+
+        Returns:
+            None: The request is fetched.
+
+        Raises:
+            IgnoreRequest: If the listing is known and unchanged.
+        """
+        if LISTING_ID_META not in request.meta:
+            return None
+        listing_id = str(request.meta[LISTING_ID_META])
+        known_price = self.known.get(listing_id)
+        if known_price is not None and known_price == price_marker(request.meta.get(LISTING_PRICE_META)):
+            self.skipped.append(listing_id)
+            spider.crawler.stats.inc_value("incremental/skipped")
+            raise IgnoreRequest(f"listing {listing_id} has not changed")
+        self.fetched += 1
+        spider.crawler.stats.inc_value("incremental/fetched")
+        return None
+
+    def spider_closed(self, spider):
+        """
+        Marks the skipped listings as seen by the crawl.
+
+        Args:
+            spider (Spider): The spider instance.
+        """
+        db = DatabaseWrapper(self.db_file)
+        touched = db.touch_listings(self.skipped, self.crawl_time)
+        db.close_conn()
+        print(
+            f"{spider.name}: fetched {self.fetched} new and changed listings, "
+            f"skipped {touched} unchanged listings"
+        )
@@ -1,6 +1,51 @@
+import hashlib
+import json
+from operator import attrgetter
 import scrapy  # pylint: disable=import-error
 
 
+# attributes tracking when a listing was seen, they are not part of its content
+TIMESTAMP_ATTRIBUTES = ("created", "updated", "last_seen")
+
+# all attributes of a listing, in the order of its row representation
+FIELDS = (
+    "id",
+    "address",
+    "area",
+    "available_from",
+    "description",
+    "disposition",
+    "floor",
+    "furnished",
+    "price",
+    "security_deposit",
+    "service_fees",
+    "status",
+    "type",
+    "url",
+    "balcony",
+    "cellar",
+    "garden",
+    "terrace",
+    "elevator",
+    "parking",
+    "garage",
+    "loggie",
+    "ownership",
+    "gps_lat",
+    "gps_lon",
+    "created",
+    "updated",
+    "last_seen",
+)
+
+# attributes holding the scraped content of a listing
+PAYLOAD_FIELDS = tuple(field for field in FIELDS if field not in TIMESTAMP_ATTRIBUTES)
+
+_get_row = attrgetter(*FIELDS)
+_get_payload = attrgetter(*PAYLOAD_FIELDS)
+
+
 class Listing:
     """
     Represents a listing object.
@@ -36,41 +81,70 @@ class Listing:
         last_seen: The date when the listing was last seen.
     """
 
+    __slots__ = FIELDS
+
     def __init__(self, data=None):
         """
         Initialize a Listing object.
 
         Args:
-            data (dict): A dictionary containing the data for the listing.
-        """
-        self.id = self._value_factory("id", data)
-        self.address = self._value_factory("address", data)
-        self.area = self._value_factory("area", data)
-        self.available_from = self._value_factory("available_from", data)
-        self.description = self._value_factory("description", data)
-        self.disposition = self._value_factory("disposition", data)
-        self.floor = self._value_factory("floor", data)
-        self.furnished = self._value_factory("furnished", data)
-        self.price = self._value_factory("price", data)
-        self.security_deposit = self._value_factory("security_deposit", data)
-        self.service_fees = self._value_factory("service_fees", data)
-        self.status = self._value_factory("status", data)
-        self.type = self._value_factory("type", data)
-        self.url = self._value_factory("url", data)
-        self.balcony = self._value_factory("balcony", data)
-        self.cellar = self._value_factory("cellar", data)
-        self.garden = self._value_factory("garden", data)
-        self.terrace = self._value_factory("terrace", data)
-        self.elevator = self._value_factory("elevator", data)
-        self.parking = self._value_factory("parking", data)
-        self.garage = self._value_factory("garage", data)
-        self.loggie = self._value_factory("loggie", data)
-        self.ownership = self._value_factory("ownership", data)
-        self.gps_lat = self._value_factory("gps_lat", data)
-        self.gps_lon = self._value_factory("gps_lon", data)
-        self.created = self._value_factory("created", data)
-        self.updated = self._value_factory("updated", data)
-        self.last_seen = self._value_factory("last_seen", data)
+            data (dict | scrapy.Item | None): A dictionary containing the data for the listing.
+                Fields missing from the data are set to an empty string,
+                all fields are None if no data is given.
+        """
+        if isinstance(data, (scrapy.Item, dict)):
+            get = data.get
+            for attr in FIELDS:
+                setattr(self, attr, get(attr, ""))
+        else:
+            for attr in FIELDS:
+                setattr(self, attr, None)
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Create a Listing object from a database row.
+
+        Args:
+            row (tuple | dict): The values of the listing in the order of FIELDS,
+                or a dictionary of the values by their names.
+
+        Returns:
+            Listing: The Listing object created from the row.
+        """
+        if isinstance(row, dict):
+            return cls(row)
+        listing = cls.__new__(cls)
+        for attr, value in zip(FIELDS, row):
+            setattr(listing, attr, value)
+        return listing
+
+    def to_row(self):
+        """
+        Returns the values of the listing in the order of FIELDS.
+
+        Returns:
+            tuple: The values of the listing.
+        """
+        return _get_row(self)
+
+    def payload(self):
+        """
+        Returns the content of the listing in the order of PAYLOAD_FIELDS.
+
+        Returns:
+            tuple: The values of the listing without its timestamps.
+        """
+        return _get_payload(self)
+
+    def to_dict(self):
+        """
+        Returns the values of the listing by their names.
+
+        Returns:
+            dict: A dictionary representation of the listing.
+        """
+        return dict(zip(FIELDS, _get_row(self)))
 
     def __eq__(self, other):
         """
@@ -83,41 +157,30 @@ class Listing:
             True if the objects are equal, False otherwise.
         """
         if isinstance(other, Listing):
-            excluded_attributes = ["last_seen", "updated", "created"]
-            return all(
-                getattr(self, attr) == getattr(other, attr)
-                for attr in [
-                    attr
-                    for attr in dir(self)
-                    if not callable(getattr(self, attr)) and not attr.startswith("__")
-                ]
-                if attr not in excluded_attributes
-            )
+            return _get_payload(self) == _get_payload(other)
         return False
 
-    def __str__(self):
+    def content_hash(self):
         """
-        Returns a string representation of the object.
+        Returns a stable hash of the listing's content.
+
+        The created, updated and last_seen attributes are not part of the hash,
+        so two listings that are equal have the same hash.
 
         Returns:
-            str: A string representation of the object.
+            str: A hexadecimal digest of the listing's content.
         """
-        return str(self.__dict__)
+        return hashlib.sha1(
+            json.dumps(
+                list(_get_payload(self)), ensure_ascii=False, default=str
+            ).encode("utf-8")
+        ).hexdigest()
 
-    def _value_factory(self, attribute: str, data: dict | scrapy.Item | tuple | None):
+    def __str__(self):
         """
-        Returns the value of the specified attribute from the given data.
-
-        Args:
-            attribute: The name of the attribute to retrieve.
-            data (dict | scrapy.Item | tuple | None): The data from which to retrieve the attribute value.
+        Returns a string representation of the object.
 
         Returns:
-            The value of the specified attribute from the given data,
-            or None if the data is None or the attribute is not found.
+            str: A string representation of the object.
         """
-        if data is None:
-            return None
-        if isinstance(data, (scrapy.Item, dict)):
-            return data.get(attribute, "")
-        return None
+        return str(self.to_dict())
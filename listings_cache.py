@@ -0,0 +1,168 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable
+import pandas as pd  # type: ignore pylint: disable=import-error
+from listings_cleaner import clean_listing_database
+from spatial_index import GridIndex
+
+
+class ListingsCache:
+    """
+    Keeps the cleaned listings of each database and filter, the spatial index of their coordinates
+    and the listings prepared for scoring in memory until the database changes.
+
+    A database is considered changed when the modification time, size or inode of its file
+    or of its write-ahead log differs from the time the listings were loaded.
+    Only the most recently used max_entries frames are kept.
+
+    Attributes:
+        hits (int): The number of lookups served from memory.
+        misses (int): The number of lookups that had to load the listings from the database.
+        scoring_hits (int): The number of lookups of listings prepared for scoring served from memory.
+        scoring_misses (int): The number of lookups that had to prepare the listings for scoring.
+        max_entries (int): The maximum number of cached frames.
+    """
+
+    def __init__(self, max_entries: int = 8) -> None:
+        """
+        Initialize an empty ListingsCache object.
+
+        Args:
+            max_entries (int, optional): The maximum number of cached frames. Defaults to 8.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.scoring_hits = 0
+        self.scoring_misses = 0
+        self.max_entries = max_entries
+        # (db_file, where, params) -> [data version, listings, spatial index or None,
+        #                              (scoring signature, listings prepared for scoring) or None]
+        self._entries: OrderedDict[tuple, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def data_version(db_file: str) -> tuple:
+        """
+        Returns a value that changes whenever the database is written to.
+
+        Args:
+            db_file (str): The path to the database file.
+
+        Returns:
+            tuple: The inode, modification time and size of the database file and its write-ahead log.
+        """
+        version = []
+        for path in (db_file, db_file + "-wal"):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                version.append(None)
+                continue
+            version.append((stat.st_ino, stat.st_mtime_ns, stat.st_size))
+        return tuple(version)
+
+    def get(self, db_file: str, where: str = "", params: tuple = ()) -> pd.DataFrame:
+        """
+        Returns the cleaned listings of the database, loading them only if the database has changed.
+
+        The returned frame is shared between the callers and must not be modified in place.
+
+        Args:
+            db_file (str): The path to the database file.
+            where (str, optional): An SQL condition the listings must meet. Defaults to all listings.
+            params (tuple, optional): The parameters of the condition. Defaults to ().
+
+        Returns:
+            pd.DataFrame: The cleaned listings.
+        """
+        key = (db_file, where, tuple(params))
+        with self._lock:
+            # taken before loading, a write during the load is picked up by the next lookup
+            version = self.data_version(db_file)
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self.misses += 1
+            df = clean_listing_database(db_file, where, params)
+            self._entries[key] = [version, df, None, None]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return df
+
+    def get_spatial_index(self, df: pd.DataFrame) -> GridIndex:
+        """
+        Returns the spatial index of the listing coordinates, built once for each frame returned by get.
+
+        Args:
+            df (pd.DataFrame): The cleaned listings as returned by get.
+
+        Returns:
+            GridIndex: The index of the listing coordinates by the listing IDs.
+        """
+        with self._lock:
+            entry = self._entry_of(df)
+            if entry is None:
+                return GridIndex(df.index, df.gps_lat, df.gps_lon)
+            if entry[2] is None:
+                entry[2] = GridIndex(df.index, df.gps_lat, df.gps_lon)
+            return entry[2]
+
+    def get_scoring_features(
+        self, df: pd.DataFrame, signature: str, prepare: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """
+        Returns the listings prepared for scoring, prepared again only if the signature
+        differs from the one of the last preparation for the same frame.
+
+        The returned frame is shared between the callers and must not be modified in place.
+
+        Args:
+            df (pd.DataFrame): The cleaned listings as returned by get.
+            signature (str): The key of everything the preparation depends on besides the listings,
+                e.g. from UserPreferences.scoring_signature.
+            prepare (Callable[[], pd.DataFrame]): The function preparing the listings for scoring.
+
+        Returns:
+            pd.DataFrame: The listings prepared for scoring.
+        """
+        with self._lock:
+            entry = self._entry_of(df)
+            if entry is not None and entry[3] is not None and entry[3][0] == signature:
+                self.scoring_hits += 1
+                return entry[3][1]
+            self.scoring_misses += 1
+        # prepared without holding the lock, the preparation may look up the spatial index
+        features = prepare()
+        with self._lock:
+            entry = self._entry_of(df)
+            if entry is not None:
+                entry[3] = (signature, features)
+        return features
+
+    def _entry_of(self, df: pd.DataFrame) -> None | list:
+        """
+        Returns the cache entry of a frame returned by get, None if it is no longer cached.
+        """
+        for entry in self._entries.values():
+            if entry[1] is df:
+                return entry
+        return None
+
+    def stats(self) -> dict:
+        """
+        Returns the hit and miss counters of the cache.
+
+        Returns:
+            dict: The number of "hits" and "misses" of the listings
+                and the "scoring_hits" and "scoring_misses" of the listings prepared for scoring.
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "scoring_hits": self.scoring_hits,
+            "scoring_misses": self.scoring_misses,
+        }
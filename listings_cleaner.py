@@ -1,368 +1,334 @@
-# %% [markdown]
-# # Data Loading
-
-# %%
+import re
 import sys
+from datetime import date
 import unidecode  # pylint: disable=import-error
 import pandas as pd  # type: ignore pylint: disable=import-error
 import numpy as np  # pylint: disable=import-error
-from database_wrapper import DatabaseWrapper
+from database_wrapper import DatabaseWrapper, LOCATION_COLUMNS
+from locality import parse_address
 from sreality_scraper.sreality.spiders.sreality_spider import SrealityUrlBuilder  # pylint: disable=import-error
 
 
-def clean_listing_database(filename: str = "listings.db") -> pd.DataFrame:
+# unified disposition values
+DISPOSITION_MAPPING = {
+    "Garsoniéra": "1+kk",
+    "Ostatní": "other",
+    "atypicky": "other",
+    "pokoj": "other",
+    "6+kk": "6-a-více",
+    "6+1": "6-a-více",
+    "7+kk": "6-a-více",
+    "7+1": "6-a-více",
+}
+
+# everything after the floor number is removed, applied in order
+FLOOR_PATTERNS = [
+    re.compile(pattern)
+    for pattern in [
+        ". podlaží.*",
+        " z celkem.*",
+        " včetně.*",
+        " underground.*",
+        " podzemní.*",
+    ]
+]
+
+GARDEN_REPLACEMENTS = {"Predzahradka ": "", " m2": "", " ": "", ",": "."}
+PRICE_REPLACEMENTS = {" ": "", "Kč": "", "€": ""}
+
+# unified building types, applied in order
+TYPE_REPLACEMENTS = {
+    "cihlova": "Cihla",
+    "panelova": "Panel",
+    "ostatni": "Ostatní",
+    "Smíšená": "Ostatní",
+    "Skeletová": "Ostatní",
+    "Nízkoenergetická": "Ostatní",
+    "Montovaná": "Ostatní",
+    "Dřevostavba": "Ostatní",
+    "Kamenná": "Ostatní",
+}
+
+# labels of the sreality furnishing and ownership codes, applied in order to the code as a string
+FURNISHED_CODES = {"2": "Nevybaveno", "3": "Částečně", "1": "Vybaveno"}
+OWNERSHIP_CODES = {"1": "Osobní", "2": "Družstevní", "3": "Ostatní"}
+
+
+_type_of = np.frompyfunc(type, 1, 1)
+
+
+def _first_rows(codes: np.ndarray) -> np.ndarray:
+    """
+    Finds the first row of every code, the codes must be numbered in order of appearance as pd.factorize does.
     """
-    Cleans the listing database by performing various data cleaning operations.
+    return np.flatnonzero(np.diff(np.maximum.accumulate(codes), prepend=-1))
+
+
+def _apply_distinct(series: pd.Series, func) -> pd.Series:
+    """
+    Same as series.apply(func), but func is called once per distinct value instead of once per row.
+
+    Values that are equal but of a different type (e.g. 1 and 1.0) are kept apart,
+    so func can still tell them apart by their type.
 
     Args:
-        filename (str, optional): The filename of the database. Defaults to "listings.db".
+        series (pd.Series): The column to be transformed.
+        func: The function applied to the values of the column.
 
     Returns:
-        pd.DataFrame: The cleaned dataframe.
+        pd.Series: The transformed column, with its dtype inferred the same way Series.apply infers it.
+    """
+    values = series.to_numpy(dtype=object)
+    types = _type_of(values)
+    codes, _ = pd.factorize(values, use_na_sentinel=False)
+    first = _first_rows(codes)
+    if (types != types[first][codes]).any():
+        type_codes, distinct_types = pd.factorize(types)
+        codes, _ = pd.factorize(codes * len(distinct_types) + type_codes)
+        first = _first_rows(codes)
+    mapped = np.empty(len(first), dtype=object)
+    for code, row in enumerate(first):
+        mapped[code] = func(values[row])
+    return pd.Series(
+        mapped[codes], index=series.index, name=series.name
+    ).infer_objects()
+
+
+def _replace_all(value: str, replacements: dict) -> str:
+    """
+    Replaces substrings of the value, in the order of the replacements.
+    """
+    for old, new in replacements.items():
+        value = value.replace(old, new)
+    return value
 
-    Raises:
-        SystemExit: If there is no data to process in the database.
+
+def _strip_floor(value: str) -> str:
     """
-    # get the data from the database
-    db = DatabaseWrapper(filename)
-    df = db.get_df()
-    db.close_conn()
-    if df is None:
-        print("No data to process")
-        sys.exit(1)
+    Removes everything after the floor number.
+    """
+    for pattern in FLOOR_PATTERNS:
+        value = pattern.sub("", value)
+    return value
 
-    # %% [markdown]
-    # # Data Cleaning
 
-    # %%
-    # set id column as index
-    df.set_index("id", inplace=True)
+def clean_listings(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Unifies the format of the raw listings scraped from the different platforms.
 
-    # %%
-    # drop public_transport column, it's not useful for now
-    # df.drop(columns=["public_transport"], inplace=True)
-    # drop security_deposit column
-    df.drop(columns=["security_deposit"], inplace=True)
+    The columns hold only a handful of distinct values compared to the number of listings,
+    so every transformation is evaluated once per distinct value and broadcast back to the rows.
 
-    df.drop(columns=["service_fees"], inplace=True)
+    The available_from column keeps the dates given as DD.MM.YYYY and the updated date of listings
+    available immediately ("Ihned"). Older versions guessed the date format from the first date
+    and dropped the dates with a day above 12, those listings are cleaned again by _migrate_to_v9.
 
-    # %% [markdown]
-    # ## Dispositions
+    Args:
+        df (pd.DataFrame): The raw listings as stored in the listings table.
 
-    # %%
-    # print unique disposition values
-    df.disposition.unique()
+    Returns:
+        pd.DataFrame: The cleaned dataframe indexed by the listing id.
+    """
+    # set id column as index
+    df = df.set_index("id")
 
-    # %%
-    # map integers (sreality disposition ids) to strings
-    df.disposition = df.disposition.apply(
-        lambda x: SrealityUrlBuilder.map_category_sub_cb(x) if isinstance(x, int) else x
-    )
-    df.disposition.unique()
-
-    # %%
-    # unify disposition values
-    df.disposition = (
-        df.disposition.replace("Garsoniéra", "1+kk")
-        .replace("Ostatní", "other")
-        .replace("atypicky", "other")
-        .replace("pokoj", "other")
-        .replace("6+kk", "6-a-více")
-        .replace("6+1", "6-a-více")
-        .replace("7+kk", "6-a-více")
-        .replace("7+1", "6-a-více")
+    # drop security_deposit and service_fees columns, they are not useful for now
+    df = df.drop(columns=["security_deposit", "service_fees"])
+
+    # the location parsed from the address once per listing, matched by the location preference
+    locations = _apply_distinct(df.address, parse_address)
+    df[LOCATION_COLUMNS] = pd.DataFrame(
+        locations.tolist(), index=df.index, columns=LOCATION_COLUMNS, dtype=object
     )
-    df.disposition.unique()
 
-    # %% [markdown]
-    # ## Area
+    # map integers (sreality disposition ids) to strings and unify disposition values
+    df.disposition = _apply_distinct(
+        df.disposition,
+        lambda x: SrealityUrlBuilder.map_category_sub_cb(x) if isinstance(x, int) else x,
+    ).replace(DISPOSITION_MAPPING)
 
-    # %%
-    df.area = df.area.apply(
+    df.area = _apply_distinct(
+        df.area,
         lambda x: (
             int(unidecode.unidecode(x).replace(" ", "")) if isinstance(x, str) else x
-        )
+        ),
     )
 
-    # %% [markdown]
-    # ## Available from
-
-    # %%
-    df.available_from.unique()
+    # available from, trim whitespaces
+    df.available_from = _apply_distinct(
+        df.available_from, lambda x: x.replace(" ", "") if isinstance(x, str) else np.nan
+    ).astype(object)
 
-    # %%
-    # trim whitespaces
-    df.available_from = df.available_from.str.replace(" ", "")
-
-    # %%
     # replace "Ihned" with last updated date
     ihned_rows = df["available_from"] == "Ihned"
-    df.loc[df["available_from"] == "Ihned", "available_from"] = pd.to_datetime(
-        df.loc[df["available_from"] == "Ihned", "updated"],
+    df.loc[ihned_rows, "available_from"] = pd.to_datetime(
+        df.loc[ihned_rows, "updated"],
         format="%Y-%m-%d %H:%M:%S.%f",
         errors="coerce",
     ).dt.date
 
-    # %%
-    # try parsing the date for all non empty fields
-    invalid_indices = pd.to_datetime(df.available_from, errors="coerce").isnull()
-
-    # %%
+    # parse the date for all non empty fields, with the format given, so days above 12 are not
+    # taken for months when the format is guessed from the first date
+    invalid_indices = pd.to_datetime(df.available_from, format="%d.%m.%Y", errors="coerce").isnull()
     invalid_indices = invalid_indices | ihned_rows
-    df.loc[~invalid_indices, "available_from"].unique()
-
-    # %%
     df.loc[~invalid_indices, "available_from"] = pd.to_datetime(
         df.loc[~invalid_indices, "available_from"],
         format="%d.%m.%Y",
         errors="coerce",
     ).dt.date
 
-    # %% [markdown]
-    # ## Balcony
-
-    # %%
-    df.balcony.unique()
-
-    # %%
     # if there's a mention of balk in the field, then balcony is most likely present
-    df.balcony = df.balcony.apply(
-        lambda x: 1 if isinstance(x, str) and "balk" in x.lower() else x
+    df.balcony = _apply_distinct(
+        df.balcony, lambda x: 1 if isinstance(x, str) and "balk" in x.lower() else x
     )
     df.balcony = df.balcony.fillna(0)
 
-    # %%
-    df.balcony.unique()
-
-    # %% [markdown]
-    # ## Cellar
-
-    # %%
-    df.cellar.unique()
-
-    # %%
-    df.cellar = df.cellar.apply(
-        lambda x: 1 if isinstance(x, str) and "sklep" in x.lower() else x
+    df.cellar = _apply_distinct(
+        df.cellar, lambda x: 1 if isinstance(x, str) and "sklep" in x.lower() else x
     )
     df.cellar = df.cellar.fillna(0)
 
-    # %%
-    df.cellar.unique()
-
-    # %% [markdown]
-    # ## Balcony
-
-    # %%
-    df.balcony.unique()
-
-    # %% [markdown]
-    # ## Elevator
-
-    # %%
-    df.elevator.unique()
-
-    # %%
-    df.elevator = df.elevator.apply(
-        lambda x: 1 if isinstance(x, str) and "výtah" in x.lower() else x
-    ).apply(lambda x: 0 if x == 2 else x)
+    df.elevator = _apply_distinct(
+        df.elevator, lambda x: 1 if isinstance(x, str) and "výtah" in x.lower() else x
+    )
+    df.elevator = _apply_distinct(df.elevator, lambda x: 0 if x == 2 else x)
     df.elevator = df.elevator.fillna(0)
 
-    # %%
-    df.elevator.unique()
-
-    # %% [markdown]
-    # ## Floor
-
-    # %%
-    df.floor.unique()
-
-    # %%
-    df.loc[:, "floor"] = (
-        df.floor.replace(". podlaží.*", "", regex=True)
-        .replace(" z celkem.*", "", regex=True)
-        .replace(" včetně.*", "", regex=True)
-        .replace(" underground.*", "", regex=True)
-        .replace(" podzemní.*", "", regex=True)
+    df.loc[:, "floor"] = _apply_distinct(
+        df.floor,
+        lambda x: _strip_floor(x) if isinstance(x, str) else x,
     )
-    df.floor.unique()
-
-    # %%
-    df.floor = df.floor.apply(lambda x: 0 if x == "přízemí" else x)
-    df.floor.unique()
+    df.floor = _apply_distinct(df.floor, lambda x: 0 if x == "přízemí" else x)
 
-    # %% [markdown]
-    # ## Garden
-
-    # %%
-    df.garden.unique()
-
-    # %%
     # TODO: remove unidecode and move it to Listings class
-    df.garden = df.garden.apply(
+    df.garden = _apply_distinct(
+        df.garden,
         lambda x: (
-            unidecode.unidecode(x)
-            .replace("Predzahradka ", "")
-            .replace(" m2", "")
-            .replace(" ", "")
-            .replace(",", ".")
+            _replace_all(unidecode.unidecode(x), GARDEN_REPLACEMENTS)
             if isinstance(x, str)
             else x
-        )
+        ),
     ).astype(float)
     df.garden = df.garden.fillna(0)
 
-    # %% [markdown]
-    # ## Furnished
-
-    # %%
-    df.furnished.unique()
-
-    # %%
-    df.furnished = df.furnished.apply(
-        lambda x: (
-            str(x)
-            .replace("2", "Nevybaveno")
-            .replace("3", "Částečně")
-            .replace("1", "Vybaveno")
-            if isinstance(x, int)
-            else x
-        )
+    df.furnished = _apply_distinct(
+        df.furnished,
+        lambda x: _replace_all(str(x), FURNISHED_CODES) if isinstance(x, int) else x,
     ).replace("0", np.nan)
 
-    # %%
-    df.furnished.unique()
-
-    # %% [markdown]
-    # ## Garage
-
-    # %%
-    df.garage.unique()
-
-    # %%
-    df.garage = df.garage.apply(
-        lambda x: 1 if isinstance(x, str) and "Garáž" in x else x
+    df.garage = _apply_distinct(
+        df.garage, lambda x: 1 if isinstance(x, str) and "Garáž" in x else x
     )
     df.garage = df.garage.fillna(0)
-    df.garage.unique()
-
-    # %% [markdown]
-    # ## Loggie
 
-    # %%
-    df.loggie.unique()
-
-    # %%
-    df.loggie = df.loggie.apply(
-        lambda x: 1 if isinstance(x, str) and "Lodžie" in x else x
+    df.loggie = _apply_distinct(
+        df.loggie, lambda x: 1 if isinstance(x, str) and "Lodžie" in x else x
     ).astype(float)
     df.loggie = df.loggie.fillna(0)
-    df.loggie.unique()
-
-    # %% [markdown]
-    # ## Parking
-
-    # %%
-    df.parking.unique()
 
-    # %%
-    df.parking = df.parking.apply(
-        lambda x: 1 if isinstance(x, str) and "Parkování" in x else x
+    df.parking = _apply_distinct(
+        df.parking, lambda x: 1 if isinstance(x, str) and "Parkování" in x else x
     ).astype(float)
     df.parking = df.parking.fillna(0)
-    df.parking.unique()
 
-    # %% [markdown]
-    # ## price
-
-    # %%
-    df.price.unique()
-
-    # %%
-    df.loc[:, "price"] = df.price.apply(
+    df.loc[:, "price"] = _apply_distinct(
+        df.price,
         lambda x: (
-            int(x.replace(" ", "").replace("Kč", "").replace("€", ""))
-            if isinstance(x, str)
-            else x
-        )
+            int(_replace_all(x, PRICE_REPLACEMENTS)) if isinstance(x, str) else x
+        ),
     ).astype(float)
 
-    df.price.sort_values().unique()
+    df.ownership = _apply_distinct(
+        df.ownership,
+        lambda x: _replace_all(str(x), OWNERSHIP_CODES) if isinstance(x, int) else x,
+    )
+    df.ownership = _apply_distinct(
+        df.ownership,
+        lambda x: x.replace("Obecní", "Ostatní") if isinstance(x, str) else x,
+    )
 
-    # %% [markdown]
-    # ## Status
+    df.loc[:, "terrace"] = _apply_distinct(
+        df["terrace"], lambda x: 1 if isinstance(x, str) and "Terasa" in x else x
+    )
+    df.terrace = df.terrace.fillna(0)
 
-    # %%
-    # 'status'
+    df.loc[:, "type"] = _apply_distinct(
+        df["type"],
+        lambda x: SrealityUrlBuilder.map_building_type(x) if isinstance(x, int) else x,
+    )
+    df.loc[:, "type"] = _apply_distinct(
+        df["type"],
+        lambda x: _replace_all(x, TYPE_REPLACEMENTS) if isinstance(x, str) else x,
+    )
 
-    # unique values for status
-    df.status.unique()
+    df.floor = _apply_distinct(df.floor, lambda x: int(x) if isinstance(x, str) else x)
 
-    # %%
-    # ## Ownership
+    # listings scraped without coordinates have them empty, they are stored as NULL
+    df.gps_lat = pd.to_numeric(df.gps_lat, errors="coerce")
+    df.gps_lon = pd.to_numeric(df.gps_lon, errors="coerce")
 
-    # %%
-    df.ownership.unique()
+    df = df.infer_objects(copy=False).fillna(np.nan)
+    return df
 
-    # %%
-    df.ownership = df.ownership.apply(
-        lambda x: (
-            str(x)
-            .replace("1", "Osobní")
-            .replace("2", "Družstevní")
-            .replace("3", "Ostatní")
-            if isinstance(x, int)
-            else x
-        )
-    ).apply(lambda x: x.replace("Obecní", "Ostatní") if isinstance(x, str) else x)
 
-    # %%
-    df.ownership.unique()
+def update_clean_listings(db: DatabaseWrapper) -> int:
+    """
+    Cleans the listings that are new or have changed since they were last cleaned
+    and stores them in the listings_clean table.
 
-    # %% [markdown]
-    # ## Terrace
+    Only dates are kept in the available_from column, other values are stored as empty.
 
-    # %%
-    df.terrace.unique()
+    Args:
+        db (DatabaseWrapper): The listings database.
 
-    # %%
-    # 'terrace',
-    df.loc[:, "terrace"] = df["terrace"].apply(
-        lambda x: 1 if isinstance(x, str) and "Terasa" in x else x
+    Returns:
+        int: The number of cleaned listings.
+    """
+    df = db.get_unclean_df()
+    if df is None or df.empty:
+        return 0
+    df = clean_listings(df)
+    df.available_from = _apply_distinct(
+        df.available_from, lambda x: x.isoformat() if isinstance(x, date) else None
     )
-    df.terrace = df.terrace.fillna(0)
-    df.loc[:, "terrace"].unique()
+    db.store_clean_listings(df)
+    return len(df)
 
-    # %% [markdown]
-    # ## Type
 
-    # %%
-    # 'type'
-    df.type.unique()
-    df.loc[:, "type"] = df["type"].apply(
-        lambda x: SrealityUrlBuilder.map_building_type(x) if isinstance(x, int) else x
-    )
-    df.loc[:, "type"] = df["type"].apply(
-        lambda x: (
-            x.replace("cihlova", "Cihla")
-            .replace("panelova", "Panel")
-            .replace("ostatni", "Ostatní")
-            .replace("Smíšená", "Ostatní")
-            .replace("Skeletová", "Ostatní")
-            .replace("Nízkoenergetická", "Ostatní")
-            .replace("Montovaná", "Ostatní")
-            .replace("Dřevostavba", "Ostatní")
-            .replace("Kamenná", "Ostatní")
-            if isinstance(x, str)
-            else x
-        )
-    )
-    df.type.unique()
+def clean_listing_database(
+    filename: str = "listings.db", where: str = "", params: tuple = ()
+) -> pd.DataFrame:
+    """
+    Loads the cleaned listings from the listing database.
 
-    # %% [markdown]
-    # ## Floor
+    Listings are cleaned once when they are stored by the crawler, the listings that
+    have not been cleaned yet are cleaned before loading.
 
-    # %%
-    df.floor = df.floor.apply(lambda x: int(x) if isinstance(x, str) else x)
+    Args:
+        filename (str, optional): The filename of the database. Defaults to "listings.db".
+        where (str, optional): An SQL condition the loaded listings must meet,
+            e.g. from UserPreferences.to_sql_filter. Defaults to all listings.
+        params (tuple, optional): The parameters of the condition. Defaults to ().
 
+    Returns:
+        pd.DataFrame: The cleaned dataframe.
+
+    Raises:
+        SystemExit: If there is no data to process in the database.
+    """
+    # get the data from the database
+    db = DatabaseWrapper(filename)
+    db.create_table()
+    update_clean_listings(db)
+    df = db.get_clean_df(where, params)
+    db.close_conn()
+    if df is None:
+        print("No data to process")
+        sys.exit(1)
+    df = df.set_index("id")
+    df.available_from = _apply_distinct(
+        df.available_from,
+        lambda x: date.fromisoformat(x) if isinstance(x, str) else x,
+    )
     df = df.infer_objects(copy=False).fillna(np.nan)
     return df
@@ -0,0 +1,82 @@
+import re
+
+
+# the part of an address with the municipality, e.g. "Praha 2 - Vinohrady" or "Brno - Královo Pole"
+MUNICIPALITY = re.compile(r"^(?P<city>.+?)(?: (?P<number>\d+))?(?: - (?P<quarter>.+))?$")
+
+# the cities the spiders search the portals in
+SEARCHED_CITIES = ["Praha", "Brno", "Ostrava"]
+
+# parts of an address naming an administrative unit larger than the city, e.g. "okres Kladno"
+REGION_PREFIXES = ("okres ", "kraj ")
+
+
+def parse_address(address) -> tuple[None | str, None | str, None | str, None | str]:
+    """
+    Splits the address of a listing into its city, district, quarter and street.
+
+    Both portals write the addresses as "[street, ]city[ number][ - quarter]",
+    e.g. "Vinohradská 12, Praha 2 - Vinohrady", "Praha 10 - Strašnice" or "Údolní, Brno - Veveří".
+    The district is the numbered municipal district, e.g. "Praha 2".
+
+    Args:
+        address: The address as scraped, missing values (e.g. NaN) have no parts.
+
+    Returns:
+        tuple[None | str, None | str, None | str, None | str]: The city, district, quarter and street,
+            None if not present.
+    """
+    if not isinstance(address, str):
+        return None, None, None, None
+    parts = [
+        part.strip()
+        for part in address.split(",")
+        if part.strip() and not part.strip().startswith(REGION_PREFIXES)
+    ]
+    if not parts:
+        return None, None, None, None
+    match = MUNICIPALITY.match(" ".join(parts[-1].split()))
+    city = match["city"]  # type: ignore
+    district = f"{city} {match['number']}" if match["number"] else None  # type: ignore
+    street = parts[0] if len(parts) > 1 else None
+    return city, district, match["quarter"], street  # type: ignore
+
+
+def split_places(text: None | str) -> list[str]:
+    """
+    Splits a location preference into the places it lists.
+
+    Args:
+        text (None | str): The places separated by commas, e.g. "Praha 2, Praha 3" or "Brno".
+
+    Returns:
+        list[str]: The places, each one a city, district or quarter as returned by parse_address.
+    """
+    return [" ".join(place.split()) for place in (text or "").split(",") if place.strip()]
+
+
+def search_cities(places: list[str], quarter_cities: dict[str, list[str]]) -> list[str]:
+    """
+    Returns the cities the portals are searched in for the places of a location preference,
+    the listings are narrowed down to the districts and quarters after the crawl.
+
+    A place is searched in its city as returned by parse_address, e.g. "Praha" for "Praha 2",
+    a quarter named without its city, e.g. "Karlín", in the cities it is a quarter of.
+    All SEARCHED_CITIES are searched if none of the places is in any of them.
+
+    Args:
+        places (list[str]): The places as returned by split_places.
+        quarter_cities (dict[str, list[str]]): The cities of the known quarters by the quarter names.
+
+    Returns:
+        list[str]: The searched cities, each one of SEARCHED_CITIES once.
+    """
+    cities: list[str] = []
+    for place in places:
+        city = parse_address(place)[0]
+        found = [city] if city in SEARCHED_CITIES else quarter_cities.get(place, [])
+        found = [city for city in found if city in SEARCHED_CITIES]
+        if not found:
+            print(f"{place} is not in any of the searched cities {', '.join(SEARCHED_CITIES)}")
+        cities += [city for city in found if city not in cities]
+    return cities or list(SEARCHED_CITIES)
@@ -0,0 +1,156 @@
+from typing import Callable
+import numpy as np  # type: ignore pylint: disable=import-error
+import pandas as pd  # type: ignore pylint: disable=import-error
+from spatial_index import GridIndex, to_coordinates
+from text_search import TextQuery
+from user_preferences import UserPreferences, SCORING_COLUMNS, DISPOSITION_SCALE
+
+
+# the scoring columns shared by all profiles, the distance to the points of interest differs by profile
+FEATURE_COLUMNS = [col for col in SCORING_COLUMNS if col != "poi_distance"]
+
+# the scoring columns where lower values score higher
+DESCENDING_COLUMNS = ["price", "poi_distance"]
+
+# the text columns the filters look values up in, they hold few distinct values
+FILTER_CATEGORY_COLUMNS = ["disposition", "type", "furnished", "status", "city", "district", "quarter"]
+
+
+class ProfileScorer:
+    """
+    Scores the same listings for the preferences (profiles) of many users at once.
+
+    The score of UserPreferences.calculate_score is a weighted sum of min-max normalized columns,
+    which is an affine function of the column values. Given the minimum and maximum of each column
+    over the listings a profile keeps, the scores of all profiles are a single product of the listing
+    features and a matrix of the coefficients of each profile, and match the scores of calculate_score.
+
+    Attributes:
+        df (pd.DataFrame): The cleaned listings.
+        spatial_index (GridIndex): The index of the listing coordinates by the listing IDs.
+    """
+
+    def __init__(
+        self,
+        df: pd.DataFrame,
+        spatial_index: None | GridIndex = None,
+        text_search: None | Callable[[TextQuery, str], list] = None,
+    ) -> None:
+        """
+        Initialize a ProfileScorer object.
+
+        Args:
+            df (pd.DataFrame): The cleaned listings, e.g. from ListingsCache.get.
+            spatial_index (None | GridIndex, optional): The index of the listing coordinates,
+                built from the listings if not given. Defaults to None.
+            text_search (None | Callable[[TextQuery, str], list], optional): A function returning the IDs
+                of the listings matching a keyword search in a column, e.g. DatabaseWrapper.search_text.
+                The keywords are searched in the listings if not given. Defaults to None.
+        """
+        self.df = df
+        self._text_search = text_search
+        # the same keyword searches of different profiles are looked up once
+        self._text_matches: dict[tuple[str, str], list] = {}
+        if spatial_index is None:
+            spatial_index = GridIndex(df.index, df.gps_lat, df.gps_lon)
+        self.spatial_index = spatial_index
+        values = (
+            df[FEATURE_COLUMNS]
+            .assign(disposition=df.disposition.map(DISPOSITION_SCALE))
+            .to_numpy(dtype=float)
+        )
+        known = ~np.isnan(values)
+        # centered on the smallest values, so the coefficients of narrow ranges stay precise
+        origin = np.nan_to_num(np.fmin.reduce(values, axis=0, initial=np.nan))
+        self._values = values - origin
+        # the values with missing ones as 0, and whether they are known
+        self._features = np.hstack([np.where(known, self._values, 0.0), known])
+        self._coordinates = pd.DataFrame(
+            {"gps_lat": to_coordinates(df.gps_lat), "gps_lon": to_coordinates(df.gps_lon)}, index=df.index
+        )
+        # the filters of each profile are evaluated once per distinct value of the text columns
+        self._filter_df = df.astype({col: "category" for col in FILTER_CATEGORY_COLUMNS})
+
+    def masks(self, profiles: list[UserPreferences]) -> np.ndarray:
+        """
+        Evaluates the filters of the profiles.
+
+        Args:
+            profiles (list[UserPreferences]): The preferences of the users.
+
+        Returns:
+            np.ndarray: Whether each listing (row) meets the filters of each profile (column).
+        """
+        text_search = None if self._text_search is None else self._search_text
+        masks = np.ones((len(self.df), len(profiles)), dtype=bool)
+        for j, profile in enumerate(profiles):
+            masks[:, j] = profile.filter_plan(self.spatial_index, text_search).mask(self._filter_df)
+        return masks
+
+    def _search_text(self, query: TextQuery, column: str) -> list:
+        """
+        Returns the IDs of the listings matching a keyword search, searched once for all profiles.
+        """
+        key = (query.text, column)
+        if key not in self._text_matches:
+            self._text_matches[key] = self._text_search(query, column)  # type: ignore
+        return self._text_matches[key]
+
+    def score(self, profiles: list[UserPreferences]) -> np.ndarray:
+        """
+        Scores the listings for each of the profiles.
+
+        Args:
+            profiles (list[UserPreferences]): The preferences of the users.
+
+        Returns:
+            np.ndarray: The score of each listing (row) for each profile (column),
+                NaN where the listing does not meet the filters of the profile.
+        """
+        masks = self.masks(profiles)
+        coefficients = np.zeros((self._features.shape[1], len(profiles)))
+        poi_scores = np.zeros((len(self.df), len(profiles)))
+        for j, profile in enumerate(profiles):
+            mask = masks[:, j]
+            if not mask.any():
+                continue
+            weights = dict(zip(SCORING_COLUMNS, np.nan_to_num(profile.scoring_weights())))
+            kept = self._values[mask]
+            low = np.fmin.reduce(kept, axis=0, initial=np.nan)
+            high = np.fmax.reduce(kept, axis=0, initial=np.nan)
+            for i, col in enumerate(FEATURE_COLUMNS):
+                scale, offset = self._normalization(col, low[i], high[i])
+                coefficients[i, j] = weights[col] * scale
+                coefficients[len(FEATURE_COLUMNS) + i, j] = weights[col] * offset
+            poi_scores[mask, j] = weights["poi_distance"] * self._poi_distance_scores(profile, mask)
+        scores = self._features @ coefficients + poi_scores
+        scores[~masks] = np.nan
+        return scores
+
+    def _poi_distance_scores(self, profile: UserPreferences, mask: np.ndarray) -> np.ndarray:
+        """
+        Returns the normalized distance of the listings kept by the profile to its points of interest.
+        """
+        distances = profile.poi_distances(self._coordinates[mask])
+        if distances is None:
+            return np.zeros(int(mask.sum()))
+        distance = np.trunc(profile.aggregate_poi_distances(distances))
+        scale, offset = self._normalization(
+            "poi_distance",
+            np.fmin.reduce(distance, initial=np.nan),
+            np.fmax.reduce(distance, initial=np.nan),
+        )
+        return np.nan_to_num(distance * scale + offset)
+
+    @staticmethod
+    def _normalization(col: str, low: float, high: float) -> tuple[float, float]:
+        """
+        Returns the scale and offset of the min-max normalization of a column, (0, 0) when the
+        normalized values are 0 or missing for all listings, like in UserPreferences.prepare_scoring.
+        """
+        denominator = high - low
+        if np.isnan(denominator) or denominator == 0:
+            return 0.0, 0.0
+        if col in DESCENDING_COLUMNS:
+            return -1 / denominator, high / denominator
+        return 1 / denominator, -low / denominator
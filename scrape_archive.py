@@ -0,0 +1,144 @@
+import datetime
+import glob
+import gzip
+import json
+import os
+from typing import Iterator
+
+
+# the compressions of the archived items by their file extension, "" for none
+ARCHIVE_COMPRESSIONS = {"": "", "gz": ".gz", "zst": ".zst"}
+
+
+class ZstdPlugin:
+    """
+    A Scrapy feed postprocessing plugin compressing the feed with zstd, like the GzipPlugin of Scrapy.
+
+    Requires the zstandard package.
+    """
+
+    def __init__(self, file, feed_options: dict) -> None:
+        """
+        Initialize a ZstdPlugin object.
+
+        Args:
+            file: The file the compressed feed is written to.
+            feed_options (dict): The feed options, "zstd_compresslevel" sets the compression level (default 3).
+        """
+        import zstandard  # type: ignore pylint: disable=import-outside-toplevel,import-error
+
+        compressor = zstandard.ZstdCompressor(level=feed_options.get("zstd_compresslevel", 3))
+        self._writer = compressor.stream_writer(file, closefd=False)
+
+    def write(self, data: bytes) -> int:
+        """
+        Compresses a chunk of the feed.
+
+        Args:
+            data (bytes): The chunk.
+
+        Returns:
+            int: The number of bytes of the chunk written.
+        """
+        return self._writer.write(data)
+
+    def close(self) -> None:
+        """
+        Finishes the compressed feed, leaving the file open.
+        """
+        self._writer.close()
+
+
+def crawl_stamp(crawl_time: datetime.datetime) -> str:
+    """
+    Returns the part of the archive file names identifying a crawl.
+
+    Args:
+        crawl_time (datetime.datetime): The time of the crawl.
+
+    Returns:
+        str: The time of the crawl, e.g. "20240301T120000", file names sort in the order of the crawls.
+    """
+    return crawl_time.strftime("%Y%m%dT%H%M%S")
+
+
+def archive_feed(directory: str, crawl_time: datetime.datetime, compression: str = "", part: str = "") -> dict:
+    """
+    Returns the Scrapy FEEDS setting writing the items of each spider of a crawl to a JSON Lines file.
+
+    Args:
+        directory (str): The directory of the archive.
+        crawl_time (datetime.datetime): The time of the crawl.
+        compression (str, optional): One of ARCHIVE_COMPRESSIONS. Defaults to "" (not compressed).
+        part (str, optional): Added to the file name after the name of the spider, for spiders
+            crawled more than once in a crawl, e.g. the searched city. Defaults to "".
+
+    Returns:
+        dict: The FEEDS setting, "%(name)s" in the file name is replaced by the name of the spider.
+    """
+    name = f"%(name)s-{part}" if part else "%(name)s"
+    path = f"{directory}/{crawl_stamp(crawl_time)}_{name}.jsonl{ARCHIVE_COMPRESSIONS[compression]}"
+    options: dict = {"format": "jsonlines", "encoding": "utf8", "overwrite": True}
+    if compression == "gz":
+        options["postprocessing"] = ["scrapy.extensions.postprocessing.GzipPlugin"]
+    elif compression == "zst":
+        options["postprocessing"] = [ZstdPlugin]
+    return {path: options}
+
+
+def crawl_files(directory: str, crawl_time: datetime.datetime) -> list[str]:
+    """
+    Finds the archived items of a crawl.
+
+    Args:
+        directory (str): The directory of the archive.
+        crawl_time (datetime.datetime): The time of the crawl.
+
+    Returns:
+        list[str]: The paths of the files of the crawl, one for each spider and searched city.
+    """
+    return sorted(glob.glob(f"{directory}/{crawl_stamp(crawl_time)}_*.jsonl*"))
+
+
+def read_items(path: str) -> Iterator[dict]:
+    """
+    Reads the archived items one at a time, so the file is never loaded whole.
+
+    Args:
+        path (str): The path of a JSON Lines file, compressed if it ends with .gz or .zst.
+
+    Yields:
+        dict: The items in the order they were scraped.
+    """
+    if path.endswith(".gz"):
+        f = gzip.open(path, "rt", encoding="utf-8")
+    elif path.endswith(".zst"):
+        import zstandard  # type: ignore pylint: disable=import-outside-toplevel,import-error
+
+        f = zstandard.open(path, "rt", encoding="utf-8")
+    else:
+        f = open(path, "r", encoding="utf-8")  # pylint: disable=consider-using-with
+    with f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def rotate(directory: str, keep: int) -> list[str]:
+    """
+    Deletes the archived items of all but the most recent crawls.
+
+    Args:
+        directory (str): The directory of the archive.
+        keep (int): The number of crawls to keep.
+
+    Returns:
+        list[str]: The paths of the deleted files.
+    """
+    files = sorted(glob.glob(f"{directory}/*_*.jsonl*"))
+    stamps = sorted({os.path.basename(path).split("_", 1)[0] for path in files})
+    kept = set(stamps[-keep:]) if keep > 0 else set()
+    deleted = [path for path in files if os.path.basename(path).split("_", 1)[0] not in kept]
+    for path in deleted:
+        os.remove(path)
+    return deleted
@@ -0,0 +1,170 @@
+import numpy as np  # type: ignore pylint: disable=import-error
+import pandas as pd  # type: ignore pylint: disable=import-error
+
+
+# mean radius of the Earth in meters
+EARTH_RADIUS = 6371008.8
+
+# size of the grid cells in degrees, about 1.1 km of latitude
+CELL_SIZE = 0.01
+
+
+def to_coordinates(values) -> np.ndarray:
+    """
+    Converts coordinates as stored to floats, missing ones, e.g. the "" of listings scraped without coordinates,
+    become NaN.
+
+    Args:
+        values: The latitudes or longitudes, e.g. a column of the listings frame.
+
+    Returns:
+        np.ndarray: The coordinates in degrees, NaN where missing.
+    """
+    return pd.to_numeric(pd.Series(values), errors="coerce").to_numpy(dtype=float)
+
+
+def haversine_distance(
+    lat: np.ndarray, lon: np.ndarray, point_lat: np.ndarray, point_lon: np.ndarray
+) -> np.ndarray:
+    """
+    Calculates the great-circle distances between coordinates and points, the arguments are broadcast
+    against each other, e.g. column vectors of listings and row vectors of points give a distance matrix.
+
+    The distances differ from the geodesic ones on the WGS-84 ellipsoid by up to about 0.5 %.
+
+    Args:
+        lat (np.ndarray): The latitudes in degrees.
+        lon (np.ndarray): The longitudes in degrees.
+        point_lat (np.ndarray): The latitudes of the points in degrees.
+        point_lon (np.ndarray): The longitudes of the points in degrees.
+
+    Returns:
+        np.ndarray: The distances in meters, NaN where a coordinate is missing.
+    """
+    lat = np.radians(lat)
+    point_lat = np.radians(point_lat)
+    a = (
+        np.sin((lat - point_lat) / 2) ** 2
+        + np.cos(lat) * np.cos(point_lat) * np.sin(np.radians(lon - point_lon) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(a))
+
+
+class GridIndex:
+    """
+    A spatial index of listing coordinates on a regular latitude/longitude grid.
+
+    The listings are sorted by their cell, so the listings of a row of neighbouring cells
+    are found with a binary search and queries only look at the listings of the cells they overlap.
+    Listings without coordinates are not indexed. Queries do not wrap around the 180th meridian.
+
+    Attributes:
+        ids (np.ndarray): The IDs of the indexed listings.
+        lat (np.ndarray): The latitudes of the indexed listings.
+        lon (np.ndarray): The longitudes of the indexed listings.
+        cell_size (float): The size of the grid cells in degrees.
+    """
+
+    def __init__(self, ids, lat, lon, cell_size: float = CELL_SIZE) -> None:
+        """
+        Initialize a GridIndex object.
+
+        Args:
+            ids: The IDs of the listings, e.g. the index of the listings frame.
+            lat: The latitudes of the listings in degrees.
+            lon: The longitudes of the listings in degrees.
+            cell_size (float, optional): The size of the grid cells in degrees. Defaults to CELL_SIZE.
+        """
+        lat = to_coordinates(lat)
+        lon = to_coordinates(lon)
+        known = ~np.isnan(lat) & ~np.isnan(lon)
+        self.cell_size = cell_size
+        keys = self._cell_keys(lat[known], lon[known])
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self.ids = np.asarray(ids)[known][order]
+        self.lat = lat[known][order]
+        self.lon = lon[known][order]
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _cells(self, lat, lon) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the grid row and column of the coordinates.
+        """
+        return (
+            np.floor(np.asarray(lat) / self.cell_size).astype(np.int64),
+            np.floor(np.asarray(lon) / self.cell_size).astype(np.int64),
+        )
+
+    def _cell_keys(self, lat, lon) -> np.ndarray:
+        """
+        Returns the sort keys of the cells of the coordinates, cells of a grid row have consecutive keys.
+        """
+        rows, cols = self._cells(lat, lon)
+        return rows * (1 << 32) + (cols + (1 << 31))
+
+    def _candidates(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> np.ndarray:
+        """
+        Returns the positions of the listings in the cells overlapping the bounding box.
+        """
+        (first_row, last_row), (first_col, last_col) = self._cells(
+            [min_lat, max_lat], [min_lon, max_lon]
+        )
+        rows = np.arange(first_row, last_row + 1) * (1 << 32)
+        starts = np.searchsorted(self._keys, rows + (first_col + (1 << 31)), side="left")
+        ends = np.searchsorted(self._keys, rows + (last_col + (1 << 31)), side="right")
+        if len(starts) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(
+            [np.arange(start, end) for start, end in zip(starts, ends)]
+        )
+
+    def bounding_box(self, min_lat: float, max_lat: float, min_lon: float, max_lon: float) -> np.ndarray:
+        """
+        Finds the listings inside a bounding box.
+
+        Args:
+            min_lat (float): The southern edge of the box in degrees.
+            max_lat (float): The northern edge of the box in degrees.
+            min_lon (float): The western edge of the box in degrees.
+            max_lon (float): The eastern edge of the box in degrees.
+
+        Returns:
+            np.ndarray: The IDs of the listings inside the box.
+        """
+        positions = self._candidates(min_lat, max_lat, min_lon, max_lon)
+        lat = self.lat[positions]
+        lon = self.lon[positions]
+        inside = (lat >= min_lat) & (lat <= max_lat) & (lon >= min_lon) & (lon <= max_lon)
+        return self.ids[positions[inside]]
+
+    def within(self, lat, lon, radius: float) -> np.ndarray:
+        """
+        Finds the listings within a great-circle distance of any of the given points.
+
+        Args:
+            lat: The latitudes of the points in degrees.
+            lon: The longitudes of the points in degrees.
+            radius (float): The distance in meters.
+
+        Returns:
+            np.ndarray: The IDs of the listings within the distance.
+        """
+        found = [np.empty(0, dtype=np.int64)]
+        delta_lat = np.degrees(radius / EARTH_RADIUS)
+        for point_lat, point_lon in zip(np.atleast_1d(lat), np.atleast_1d(lon)):
+            cos_lat = np.cos(np.radians(min(abs(point_lat) + delta_lat, 90.0)))
+            delta_lon = 180.0 if cos_lat < 1e-9 else min(delta_lat / cos_lat, 180.0)
+            positions = self._candidates(
+                point_lat - delta_lat,
+                point_lat + delta_lat,
+                point_lon - delta_lon,
+                point_lon + delta_lon,
+            )
+            distances = haversine_distance(
+                self.lat[positions], self.lon[positions], point_lat, point_lon
+            )
+            found.append(positions[distances <= radius])
+        return self.ids[np.unique(np.concatenate(found))]
@@ -0,0 +1,495 @@
+import contextlib
+import datetime
+import io
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np  # type: ignore pylint: disable=import-error
+import pandas as pd  # type: ignore pylint: disable=import-error
+from scrapy.settings import Settings  # type: ignore pylint: disable=import-error
+from database_wrapper import DatabaseWrapper, format_timestamp
+from geocoding import Geocoder
+from listing import Listing
+from listings_cache import ListingsCache
+from listings_cleaner import clean_listing_database
+from profile_scoring import ProfileScorer
+from user_preferences import UserPreferences
+from tests.test_geocoding import FakeClock
+from tests.test_user_preferences import POI_PREFERENCES, PREFERENCES, random_item
+
+# the app exits without a webhook to notify the users through
+os.environ.setdefault("WEBHOOK_URL", "https://discord.com/api/webhooks/test")
+import app  # pylint: disable=wrong-import-position
+
+
+CRAWL_TIME = datetime.datetime(2024, 4, 1, 12, 0, 0, 5)
+
+WEIGHTS = {"weight_area": 1, "weight_price": 2, "weight_disposition": 1, "weight_poi_distance": 3}
+
+
+def scored_listings(scores: list, updated: datetime.datetime = CRAWL_TIME) -> pd.DataFrame:
+    """
+    Returns cleaned listings with the given scores, updated by the given crawl.
+    """
+    n = len(scores)
+    return pd.DataFrame(
+        {
+            "score": scores,
+            "price": np.arange(n) * 1000.0,
+            "area": np.full(n, 50.0),
+            "garden": np.zeros(n),
+            "poi_distance": np.arange(n) * 10.0,
+            "address": [f"Ulice {i}, Praha 2" for i in range(n)],
+            "disposition": "2+kk",
+            "url": [f"https://example.com/{i}" for i in range(n)],
+            "updated": format_timestamp(updated),
+        }
+        | {col: np.ones(n) for col in app.BOOLEAN_COLUNNS},
+        index=[f"listing-{i}" for i in range(n)],
+    )
+
+
+class SeededDatabaseTestCase(unittest.TestCase):
+    """
+    Base of the tests run on a database seeded with random listings.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        rnd = random.Random(1)
+        db = DatabaseWrapper(cls.path)
+        db.create_table()
+        db.upsert_listings([Listing(random_item(rnd, str(i))) for i in range(300)], CRAWL_TIME)
+        db.close_conn()
+        clean_listing_database(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+    def setUp(self):
+        app.LISTINGS_CACHE = ListingsCache()
+
+    def cold_score(self, preferences: UserPreferences) -> pd.Series:
+        """
+        Returns the scores of the listings calculated without the cache.
+        """
+        df = clean_listing_database(self.path, *preferences.to_sql_filter())
+        return preferences.calculate_score(preferences.filter_poi_distance(df)).score
+
+
+class TestAnalyzeListings(SeededDatabaseTestCase):
+    """
+    Tests of scoring the listings with the listings prepared for scoring kept in the cache.
+    """
+
+    def test_weights_reuse_features(self):
+        """
+        Changing only the weights scores the cached features again, with the scores of a cold calculation.
+        """
+        data = {"max_price": 30000, "points_of_interest": [(50.08, 14.42)], "poi_aggregation": "nearest"}
+        for i, weights in enumerate([WEIGHTS, WEIGHTS | {"weight_price": 0, "weight_area": 5}, {}]):
+            with self.subTest(weights=weights):
+                preferences = UserPreferences.from_dict(data | weights)
+                df = app.analyze_listings(self.path, preferences)
+                self.assertEqual(app.LISTINGS_CACHE.stats()["scoring_misses"], 1)
+                self.assertEqual(app.LISTINGS_CACHE.stats()["scoring_hits"], i)
+                expected = self.cold_score(preferences)
+                self.assertGreater(len(expected), 0)
+                pd.testing.assert_series_equal(df.score, expected)
+
+    def test_filters_invalidate_features(self):
+        """
+        Changing a filter, also one not applied by the database, prepares the listings again.
+        """
+        changes = [
+            {"max_price": 30000},
+            {"max_price": 25000},
+            {"max_price": 25000, "points_of_interest": [(50.08, 14.42)], "max_poi_distance": 3},
+            {"max_price": 25000, "points_of_interest": [(50.08, 14.42)], "max_poi_distance": 5},
+            {"max_price": 25000, "points_of_interest": [(50.08, 14.42), (50.1, 14.5)], "max_poi_distance": 5},
+        ]
+        for i, data in enumerate(changes):
+            with self.subTest(preferences=data):
+                preferences = UserPreferences.from_dict(data | WEIGHTS)
+                df = app.analyze_listings(self.path, preferences)
+                self.assertEqual(app.LISTINGS_CACHE.stats()["scoring_misses"], i + 1)
+                self.assertEqual(app.LISTINGS_CACHE.stats()["scoring_hits"], 0)
+                pd.testing.assert_series_equal(df.score, self.cold_score(preferences))
+
+    def test_shared_features_are_not_modified(self):
+        """
+        Scoring the cached features does not modify them.
+        """
+        preferences = UserPreferences.from_dict({"max_price": 30000} | WEIGHTS)
+        df = app.analyze_listings(self.path, preferences)
+        features = app.LISTINGS_CACHE.get_scoring_features(
+            app.LISTINGS_CACHE.get(self.path, *preferences.to_sql_filter()), preferences.scoring_signature(), None
+        )
+        self.assertNotIn("score", features.columns)
+        self.assertTrue(np.array_equal(features.index, df.index))
+
+
+class TestFormatResult(unittest.TestCase):
+    """
+    Tests of selecting the page of the best scored listings.
+    """
+
+    @staticmethod
+    def listings(scores: list) -> pd.DataFrame:
+        """
+        Returns listings with the given scores.
+        """
+        return scored_listings(scores)
+
+    def test_top_k_with_ties(self):
+        """
+        The best listings are the ones first after a stable sort by the score, equal scores in the order of the rows.
+        """
+        rnd = random.Random(0)
+        for n in (0, 1, 7, 45, 200):
+            scores = [rnd.choice([0.1, 0.5, 0.5, 1.25, np.nan, rnd.random()]) for _ in range(n)]
+            df = self.listings(scores)
+            for k in (1, 5, 30, 250):
+                with self.subTest(n=n, k=k):
+                    expected = df.sort_values("score", ascending=False, kind="stable").head(k)
+                    self.assertEqual(list(app.format_result(df, k).index), list(expected.index))
+
+    def test_pages(self):
+        """
+        The pages neither repeat nor skip listings.
+        """
+        df = self.listings([0.5] * 20 + [0.75] * 20 + [np.nan] * 5 + [0.25] * 20)
+        expected = list(df.sort_values("score", ascending=False, kind="stable").index)
+        pages = [list(app.format_result(df, 30, offset).index) for offset in (0, 30, 60, 90)]
+        self.assertEqual(pages[0] + pages[1] + pages[2], expected)
+        self.assertEqual([len(page) for page in pages], [30, 30, 5, 0])
+        self.assertEqual(pages[1][0], expected[30])
+
+    def test_formatting(self):
+        """
+        Only the selected listings are formatted, the given frame is not modified.
+        """
+        df = self.listings([0.5, 0.75, 0.25])
+        result = app.format_result(df, 2)
+        self.assertEqual(list(result.price), ["1000 Kč", ""])
+        self.assertEqual(list(result.poi_distance), ["10 m", "0 m"])
+        self.assertEqual(list(result.score), [0.75, 0.5])
+        self.assertEqual(list(result.balcony), ["Ano", "Ano"])
+        self.assertEqual(df.price.dtype, float)
+
+
+class TestProfileScoring(SeededDatabaseTestCase):
+    """
+    Tests of scoring the listings for all the profiles at once.
+    """
+
+    def test_parity_with_analyze_listings(self):
+        """
+        The listings kept for each profile and their scores are the ones of analyze_listings for the profile alone.
+        """
+        rnd = random.Random(0)
+        profiles = [
+            UserPreferences.from_dict(data | {weight: rnd.choice([0, 0.5, 1, 3]) for weight in WEIGHTS})
+            for data in PREFERENCES + POI_PREFERENCES
+        ]
+        df = app.LISTINGS_CACHE.get(self.path)
+        db = DatabaseWrapper(self.path)
+        scores = ProfileScorer(df, app.LISTINGS_CACHE.get_spatial_index(df), db.search_text).score(profiles)
+        db.close_conn()
+        for profile, profile_scores in zip(profiles, scores.T):
+            with self.subTest(preferences=profile.to_dict()):
+                expected = app.analyze_listings(self.path, profile)
+                kept = pd.Series(profile_scores, index=df.index).dropna()
+                self.assertCountEqual(kept.index, expected.index)
+                if not expected.empty:
+                    np.testing.assert_allclose(kept[expected.index], expected.score, rtol=1e-9, atol=1e-9)
+
+
+class TestNotifyUser(unittest.TestCase):
+    """
+    Tests of notifying the profiles about the new listings through their webhooks.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        last_crawl_file = os.path.join(self.directory.name, "last_crawl.txt")
+        with open(last_crawl_file, "w", encoding="utf-8") as f:
+            f.write(CRAWL_TIME.isoformat())
+        self.enterContext(mock.patch.object(app, "LAST_CRAWL_FILE", last_crawl_file))
+        self.webhook = self.enterContext(mock.patch.object(app, "DiscordWebhook"))
+        self.webhook.return_value.execute.return_value.status_code = 200
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_profile_webhook(self):
+        """
+        A profile with a webhook is notified through it, the others through WEBHOOK_URL.
+        """
+        app.notify_user(scored_listings([0.5, 0.75]), CRAWL_TIME, "anna", "https://example.com/anna")
+        app.notify_user(scored_listings([0.5, 0.75]), CRAWL_TIME, "petr")
+        urls = [call.kwargs["url"] for call in self.webhook.call_args_list]
+        self.assertEqual(urls, ["https://example.com/anna", app.WEBHOOK_URL])
+        self.assertEqual(self.webhook.return_value.execute.call_count, 2)
+
+    def test_no_new_listings(self):
+        """
+        Profiles without new listings are not notified.
+        """
+        app.notify_user(scored_listings([0.5], CRAWL_TIME - datetime.timedelta(days=1)), CRAWL_TIME, "anna")
+        self.webhook.assert_not_called()
+
+    def test_load_profiles(self):
+        """
+        The webhook of a profile is loaded with its preferences.
+        """
+        profiles_dir = os.path.join(self.directory.name, "profiles")
+        os.makedirs(profiles_dir)
+        with open(os.path.join(profiles_dir, "anna.json"), "w", encoding="utf-8") as f:
+            f.write('{"max_price": 20000, "webhook_url": "https://example.com/anna"}')
+        with open(os.path.join(profiles_dir, "petr.json"), "w", encoding="utf-8") as f:
+            f.write('{"max_price": 30000}')
+        with mock.patch.object(app, "PROFILES_DIR", profiles_dir), mock.patch.object(
+            app, "PREFERENCES_FILE", os.path.join(self.directory.name, "preferences.json")
+        ):
+            profiles = app.load_profiles()
+        self.assertEqual(list(profiles), [app.DEFAULT_PROFILE, "anna", "petr"])
+        webhooks = [profile.webhook_url for profile in profiles.values()]
+        self.assertEqual(webhooks, [None, "https://example.com/anna", None])
+        self.assertEqual(profiles["anna"].max_price, 20000)
+
+
+class TestDatabasePipeline(unittest.TestCase):
+    """
+    Tests of storing the scraped listings in batches while the spiders run.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        rnd = random.Random(2)
+        self.items = [random_item(rnd, str(i)) for i in range(12)]
+        db = DatabaseWrapper(self.path)
+        db.create_table()
+        # the listings of the previous crawl, the first ones are scraped again
+        db.upsert_listings([Listing(item) for item in self.items[:8]], CRAWL_TIME - datetime.timedelta(days=1))
+        db.close_conn()
+        self.crawl_time = CRAWL_TIME
+        self.upserts = self.enterContext(
+            mock.patch.object(
+                DatabaseWrapper, "upsert_listings", autospec=True, side_effect=DatabaseWrapper.upsert_listings
+            )
+        )
+        self.deletes = self.enterContext(
+            mock.patch.object(
+                DatabaseWrapper, "delete_old_listings", autospec=True, side_effect=DatabaseWrapper.delete_old_listings
+            )
+        )
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def stored_ids(self) -> list:
+        """
+        Returns the IDs of the stored listings.
+        """
+        db = DatabaseWrapper(self.path)
+        ids = sorted(row["id"] for row in db.conn.execute("SELECT id FROM listings").fetchall())
+        db.close_conn()
+        return ids
+
+    def pipeline(self) -> app.DatabasePipeline:
+        """
+        Returns a pipeline created from the settings of a crawl, storing batches of 3 listings.
+        """
+        settings = Settings(
+            {"LISTINGS_DB_FILE": self.path, "CRAWL_TIME": self.crawl_time.isoformat(), "DATABASE_BATCH_SIZE": 3}
+        )
+        return app.DatabasePipeline.from_crawler(mock.Mock(settings=settings))
+
+    def test_nothing_expires_mid_crawl(self):
+        """
+        The listings of the previous crawl are kept until all spiders have finished, then deleted once.
+        """
+        previous = self.stored_ids()
+        spiders = [mock.Mock(), mock.Mock()]
+        spiders[0].name, spiders[1].name = "sreality", "bezrealitky"
+        # the spiders scrape the listings of the previous crawl last
+        for spider, items in zip(spiders, [self.items[:1] + self.items[8:], self.items[1:4]]):
+            pipeline = self.pipeline()
+            pipeline.open_spider(spider)
+            for item in items:
+                self.assertIs(pipeline.process_item(item, spider), item)
+                self.assertTrue(set(previous) <= set(self.stored_ids()))
+            pipeline.close_spider(spider)
+            self.assertEqual(sum(pipeline.result.values()), len(items))
+        self.assertEqual(self.upserts.call_count, 3)
+        self.assertTrue(all(call.kwargs == {"expire": False} for call in self.upserts.call_args_list))
+        self.assertEqual(self.stored_ids(), sorted(item["id"] for item in self.items))
+        self.deletes.assert_not_called()
+
+        app.update_listing_database(self.path, self.crawl_time)
+        self.assertEqual(self.deletes.call_count, 1)
+        self.assertEqual(self.stored_ids(), sorted(item["id"] for item in self.items[:4] + self.items[8:]))
+
+    def test_batches(self):
+        """
+        The listings are stored once a batch is full, the rest when the spider closes.
+        """
+        spider = mock.Mock()
+        spider.name = "sreality"
+        pipeline = self.pipeline()
+        pipeline.open_spider(spider)
+        for item in self.items[8:]:
+            pipeline.process_item(item, spider)
+        self.assertEqual(pipeline.result, {"inserted": 3, "changed": 0, "unchanged": 0})
+        pipeline.close_spider(spider)
+        self.assertEqual(pipeline.result, {"inserted": 4, "changed": 0, "unchanged": 0})
+        self.assertEqual([len(call.args[1]) for call in self.upserts.call_args_list], [3, 1])
+
+
+class CrawlTestCase(unittest.TestCase):
+    """
+    Base of the tests of running the crawls, with the files of the app in a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        for name, filename in [("DB_FILE", "listings.db"), ("CRAWL_LOCK_FILE", "crawl.lock")]:
+            self.enterContext(mock.patch.object(app, name, os.path.join(self.directory.name, filename)))
+        self.output = self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def crawl_runs(self) -> list:
+        """
+        Returns the statuses of the recorded crawls with the phases they got through, the oldest first.
+        """
+        db = DatabaseWrapper(app.DB_FILE)
+        runs = db.get_crawl_runs()
+        db.close_conn()
+        phases = [f"{phase}_seconds" for phase in app.CRAWL_PHASES]
+        return [(run["status"], [phase for phase in phases if run[phase] is not None]) for run in reversed(runs)]
+
+
+class TestCrawlOnce(CrawlTestCase):
+    """
+    Tests of running a crawl and recording how it ended.
+    """
+
+    def test_crawl_lock(self):
+        """
+        The lock is taken by one crawl at a time and released when it ends.
+        """
+        with app.crawl_lock() as locked:
+            self.assertTrue(locked)
+            with app.crawl_lock() as other:
+                self.assertFalse(other)
+        with app.crawl_lock() as locked:
+            self.assertTrue(locked)
+
+    def test_statuses(self):
+        """
+        The crawls are recorded as ok, failed with the phase that failed or skipped while another one runs.
+        """
+
+        def fail_update(isolate, durations):  # pylint: disable=unused-argument
+            durations["spiders"] = 1.0
+            raise ValueError("the database is locked")
+
+        def succeed(isolate, durations):
+            self.assertTrue(isolate)
+            durations.update(dict.fromkeys(app.CRAWL_PHASES, 1.0))
+
+        crawls = [succeed, fail_update]
+
+        def crawl_regularly(isolate, durations):
+            crawls.pop(0)(isolate, durations)
+
+        with mock.patch.object(app, "crawl_regularly", side_effect=crawl_regularly) as crawl:
+            self.assertEqual(app.crawl_once(isolate=True), "ok")
+            self.assertEqual(app.crawl_once(isolate=True), "failed: update")
+            with app.crawl_lock():
+                self.assertEqual(app.crawl_once(isolate=True), "skipped")
+            self.assertEqual(crawl.call_count, 2)
+        self.assertIn("Traceback", self.output.getvalue())
+        self.assertIn("ValueError: the database is locked", self.output.getvalue())
+        phases = [f"{phase}_seconds" for phase in app.CRAWL_PHASES]
+        self.assertEqual(
+            self.crawl_runs(), [("ok", phases), ("failed: update", ["spiders_seconds"]), ("skipped", [])]
+        )
+
+    def test_notify_errors_are_not_fatal(self):
+        """
+        A profile that cannot be notified fails neither the crawl nor the notifications of the other profiles.
+        """
+        rnd = random.Random(3)
+        items = [random_item(rnd, str(i)) for i in range(20)]
+
+        def run_spiders(crawl_time):
+            pipeline = app.DatabasePipeline(app.DB_FILE, crawl_time)
+            pipeline.open_spider(None)
+            for item in items:
+                pipeline.process_item(item, None)
+            pipeline.close_spider(None)
+
+        def notify_user(df, last_crawl_time, profile, webhook_url):  # pylint: disable=unused-argument
+            if webhook_url is None:
+                raise ConnectionError("the webhook is unreachable")
+
+        profiles = {
+            app.DEFAULT_PROFILE: UserPreferences(),
+            "anna": UserPreferences.from_dict({"webhook_url": "https://example.com/anna"}),
+        }
+        self.enterContext(mock.patch.object(app, "run_spiders_isolated", side_effect=run_spiders))
+        self.enterContext(mock.patch.object(app, "GEOCODER", Geocoder(":memory:", lambda address: None)))
+        self.enterContext(mock.patch.object(app, "LISTINGS_CACHE", ListingsCache()))
+        self.enterContext(mock.patch.object(app, "load_profiles", return_value=profiles))
+        notify = self.enterContext(mock.patch.object(app, "notify_user", side_effect=notify_user))
+        self.assertEqual(app.crawl_once(isolate=True), "ok")
+        self.assertEqual([call.args[2] for call in notify.call_args_list], [app.DEFAULT_PROFILE, "anna"])
+        self.assertEqual([len(call.args[0]) for call in notify.call_args_list], [20, 20])
+        self.assertIn("ConnectionError: the webhook is unreachable", self.output.getvalue())
+        self.assertEqual(self.crawl_runs(), [("ok", [f"{phase}_seconds" for phase in app.CRAWL_PHASES])])
+
+
+class TestCrawlDaemon(unittest.TestCase):
+    """
+    Tests of the intervals between the crawls of the crawler daemon.
+    """
+
+    def test_intervals(self):
+        """
+        The crawls start every interval moved by the jitter, a long crawl delays the next one instead of overlapping it.
+        """
+        clock = FakeClock()
+        # the number of seconds each crawl takes, the daemon is stopped by the fourth one
+        crawls = iter([100, 700, 50])
+        started = []
+
+        def crawl_once(isolate):
+            self.assertTrue(isolate)
+            started.append(clock.now)
+            clock.now += next(crawls)
+
+        jitters = iter([10, -20, 5, 0])
+        with mock.patch.object(app, "time", mock.Mock(time=clock.time, sleep=clock.sleep)), mock.patch.object(
+            app, "crawl_once", side_effect=crawl_once
+        ), mock.patch.object(app.signal, "signal") as handler, mock.patch.object(
+            app.random, "uniform", side_effect=lambda low, high: next(jitters)
+        ), contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(StopIteration):
+                app.crawl_daemon(interval=600, jitter=30)
+        handler.assert_called_once_with(app.signal.SIGTERM, mock.ANY)
+        self.assertEqual(started, [1000, 1610, 2310, 2915])
+        self.assertEqual(clock.sleeps, [510, 555])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,342 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+from database_wrapper import DatabaseWrapper, LISTING_COLUMNS, SCHEMA_VERSION, format_timestamp
+from listing import FIELDS, Listing, PAYLOAD_FIELDS
+
+
+# the times of three crawls a day apart
+CRAWLS = [datetime.datetime(2024, 4, day, 12, 0, 0, 5) for day in (1, 2, 3)]
+
+
+def scraped(listing_id: str, **fields) -> Listing:
+    """
+    Returns a scraped listing, the fields not given are None.
+    """
+    return Listing(
+        dict.fromkeys(PAYLOAD_FIELDS)
+        | {"id": listing_id, "address": "Praha 2", "price": 15000, "area": 65, "disposition": "2+kk"}
+        | fields
+    )
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Base of the tests run on a temporary database file.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        self.db = DatabaseWrapper(self.path)
+        self.db.create_table()
+
+    def tearDown(self):
+        self.db.close_conn()
+        os.remove(self.path)
+
+
+class TestDatabaseWrapper(DatabaseTestCase):
+    """
+    Tests of the listings database on a temporary database file.
+    """
+
+    def test_migration_nulls_empty_coordinates(self):
+        """
+        Missing coordinates stored as empty strings become NULL.
+        """
+        with self.db.conn:
+            self.db.conn.execute(
+                "INSERT INTO listings_clean (id, address, gps_lat, gps_lon) VALUES ('1', 'Praha 2', '', ''), "
+                "('2', 'Brno', 49.19, 16.61)"
+            )
+        self.db.conn.execute("PRAGMA user_version = 7")
+        self.db.create_table()
+        rows = self.db.conn.execute("SELECT id, gps_lat, gps_lon FROM listings_clean ORDER BY id").fetchall()
+        self.assertEqual(
+            rows,
+            [
+                {"id": "1", "gps_lat": None, "gps_lon": None},
+                {"id": "2", "gps_lat": 49.19, "gps_lon": 16.61},
+            ],
+        )
+
+    def test_migration_recleans_missing_available_from(self):
+        """
+        Listings cleaned without an available_from date are cleaned again.
+        """
+        with self.db.conn:
+            self.db.conn.execute(
+                "INSERT INTO listings_clean (id, available_from, source_hash) VALUES ('1', NULL, 'a'), "
+                "('2', '2024-05-01', 'b')"
+            )
+        self.db.conn.execute("PRAGMA user_version = 8")
+        self.db.create_table()
+        rows = self.db.conn.execute("SELECT id, source_hash FROM listings_clean ORDER BY id").fetchall()
+        self.assertEqual(rows, [{"id": "1", "source_hash": None}, {"id": "2", "source_hash": "b"}])
+
+    def test_addresses_without_coordinates(self):
+        """
+        Listings with NULL or empty coordinates and an address are returned by their address.
+        """
+        with self.db.conn:
+            self.db.conn.execute(
+                "INSERT INTO listings_clean (id, address, gps_lat, gps_lon) VALUES ('1', 'Praha 2', NULL, NULL), "
+                "('2', 'Praha 2', '', ''), ('3', 'Brno', 49.19, ''), ('4', 'Brno', 49.19, 16.61), "
+                "('5', '', NULL, NULL), ('6', NULL, NULL, NULL)"
+            )
+        self.assertEqual(self.db.get_addresses_without_coordinates(), {"Praha 2": ["1", "2"], "Brno": ["3"]})
+        self.db.store_coordinates([(50.07, 14.43, "1"), (50.07, 14.43, "2"), (49.19, 16.61, "3")])
+        self.assertEqual(self.db.get_addresses_without_coordinates(), {})
+
+    def test_quarter_cities(self):
+        """
+        The cities of the quarters are looked up in the cleaned listings.
+        """
+        with self.db.conn:
+            self.db.conn.execute(
+                "INSERT INTO listings_clean (id, city, district, quarter) VALUES ('1', 'Praha', 'Praha 8', 'Karlín'), "
+                "('2', 'Praha', 'Praha 8', 'Karlín'), ('3', 'Brno', NULL, 'Veveří'), ('4', 'Praha', 'Praha 2', NULL)"
+            )
+        self.assertEqual(
+            self.db.get_quarter_cities(["Karlín", "Veveří", "Praha 2", "Žižkov"]),
+            {"Karlín": ["Praha"], "Veveří": ["Brno"]},
+        )
+        self.assertEqual(self.db.get_quarter_cities([]), {})
+
+
+class TestMigration(unittest.TestCase):
+    """
+    Tests of upgrading a database created by the first version of the app.
+    """
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        # the untyped table created from the Listing attributes, with the timestamps written by str()
+        conn = sqlite3.connect(self.path)
+        with conn:
+            conn.execute(f"CREATE TABLE listings ({','.join(sorted(FIELDS))})")
+            conn.executemany(
+                "INSERT INTO listings (id, address, price, area, gps_lat, created, updated, last_seen) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    ("1", "Praha 2", "15000", "65", "50.07", "2024-04-01 12:00:00", "2024-04-01 12:00:00",
+                     "2024-04-02 12:00:00.000005"),
+                    ("2", "Brno", 9000, 40, None, "2024-04-01 12:00:00.000005", "2024-04-01 12:00:00.000005",
+                     "2024-04-01 12:00:00.000005"),
+                    ("1", "Praha 3", "16000", "65", "50.07", "2024-04-01 12:00:00", "2024-04-03 12:00:00",
+                     "2024-04-03 12:00:00"),
+                ],
+            )
+        conn.close()
+        self.db = DatabaseWrapper(self.path)
+        self.db.create_table()
+
+    def tearDown(self):
+        self.db.close_conn()
+        os.remove(self.path)
+
+    def test_schema_version(self):
+        """
+        The database is upgraded to the current schema version.
+        """
+        version = self.db.conn.execute("PRAGMA user_version").fetchone()["user_version"]
+        self.assertEqual(version, SCHEMA_VERSION)
+
+    def test_column_types(self):
+        """
+        The listings table gets the declared column types.
+        """
+        columns = self.db.conn.execute("PRAGMA table_info(listings)").fetchall()
+        types = {column["name"]: column["type"] for column in columns}
+        declared = {name: kind.split()[0] for name, kind in LISTING_COLUMNS.items()}
+        self.assertEqual(types, declared | {"content_hash": "TEXT"})
+
+    def test_rows(self):
+        """
+        No listing is lost, the last written duplicate is kept and the values get the column affinities.
+        """
+        rows = self.db.conn.execute("SELECT id, address, price, area, gps_lat FROM listings ORDER BY id").fetchall()
+        self.assertEqual(
+            rows,
+            [
+                {"id": "1", "address": "Praha 3", "price": 16000, "area": 65, "gps_lat": 50.07},
+                {"id": "2", "address": "Brno", "price": 9000, "area": 40, "gps_lat": None},
+            ],
+        )
+        for row in self.db.conn.execute("SELECT * FROM listings").fetchall():
+            self.assertEqual(row["content_hash"], Listing(row).content_hash())
+
+    def test_timestamps_are_padded(self):
+        """
+        The timestamps written without microseconds are padded to the format_timestamp format.
+        """
+        rows = self.db.conn.execute("SELECT id, created, updated, last_seen FROM listings ORDER BY id").fetchall()
+        self.assertEqual(
+            rows,
+            [
+                {
+                    "id": "1",
+                    "created": "2024-04-01 12:00:00.000000",
+                    "updated": "2024-04-03 12:00:00.000000",
+                    "last_seen": "2024-04-03 12:00:00.000000",
+                },
+                {
+                    "id": "2",
+                    "created": "2024-04-01 12:00:00.000005",
+                    "updated": "2024-04-01 12:00:00.000005",
+                    "last_seen": "2024-04-01 12:00:00.000005",
+                },
+            ],
+        )
+        self.assertEqual(rows[0]["created"], format_timestamp("2024-04-01 12:00:00"))
+
+    def test_rescrape_is_unchanged(self):
+        """
+        Listings scraped again the same are unchanged, though their hashes were computed from converted values.
+        """
+        rescraped = [
+            Listing(dict.fromkeys(PAYLOAD_FIELDS) | {"id": "1", "address": "Praha 3", "price": "16000", "area": "65",
+                                                     "gps_lat": "50.07"}),
+            Listing(dict.fromkeys(PAYLOAD_FIELDS) | {"id": "2", "address": "Brno", "price": 9000, "area": 40}),
+        ]
+        result = self.db.upsert_listings(rescraped, CRAWLS[2])
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 2, "expired": 0})
+        updated = self.db.conn.execute("SELECT updated FROM listings WHERE id = '1'").fetchone()["updated"]
+        self.assertEqual(updated, "2024-04-03 12:00:00.000000")
+        self.assertEqual(self.db.upsert_listings(rescraped, CRAWLS[2])["unchanged"], 2)
+
+
+class TestChangedListings(DatabaseTestCase):
+    """
+    Tests of finding the changed listings of a batch in the database, compared to Listing.__eq__.
+    """
+
+    def test_parity_with_listing_equality(self):
+        """
+        The changed listings and their changed fields are the same as compared by Listing.__eq__.
+        """
+        values = {"TEXT": "Praha 2", "NUMERIC": 15000, "REAL": 50.07, "BLOB": "ano"}
+        compared = [field for field in PAYLOAD_FIELDS if field != "id"]
+        stored = {
+            "full": {field: values[LISTING_COLUMNS[field]] for field in compared},
+            "empty": dict.fromkeys(compared),
+        }
+        self.db.upsert_listings([Listing(fields | {"id": name}) for name, fields in stored.items()], CRAWLS[0])
+        batch = []
+        for name, fields in stored.items():
+            batch.append(Listing(fields | {"id": name}))
+            for field in compared:
+                for value in (None, "", 0, "jiné", 16000.5):
+                    batch.append(Listing(fields | {"id": f"{name}-{field}-{value!r}", field: value}))
+        self.db.upsert_listings(
+            [Listing(stored[item.id.split("-")[0]] | {"id": item.id}) for item in batch], CRAWLS[0]
+        )
+        expected = []
+        for item in batch:
+            # the way update_listing_database used to compare each scraped listing with the stored one
+            found = self.db.get_listing(item.id)
+            if item != found:
+                fields = [field for field in compared if getattr(item, field) != getattr(found, field)]
+                expected.append((item.id, fields))
+        changed = [(item.id, fields) for item, fields in self.db.get_changed_listings(batch)]
+        self.assertCountEqual(changed, expected)
+        self.assertGreater(len(expected), 0)
+        self.assertLess(len(expected), len(batch))
+
+
+class TestUpsertListings(DatabaseTestCase):
+    """
+    Tests of storing the listings of crawls.
+    """
+
+    def stored(self, listing_id: str) -> dict:
+        """
+        Returns the stored row of a listing.
+        """
+        return self.db.conn.execute("SELECT * FROM listings WHERE id = ?", (listing_id,)).fetchone()
+
+    def test_new_listings_are_inserted(self):
+        """
+        New listings are inserted with all their timestamps set to the crawl time.
+        """
+        result = self.db.upsert_listings([scraped("1"), scraped("2", price=9000)], CRAWLS[0])
+        self.assertEqual(result, {"inserted": 2, "changed": 0, "unchanged": 0, "expired": 0})
+        row = self.stored("2")
+        self.assertEqual(row["price"], 9000)
+        self.assertEqual(row["content_hash"], scraped("2", price=9000).content_hash())
+        now = format_timestamp(CRAWLS[0])
+        self.assertEqual((row["created"], row["updated"], row["last_seen"]), (now, now, now))
+        self.assertEqual(self.db.get_listing("2"), scraped("2", price=9000))
+
+    def test_unchanged_listings_are_only_seen(self):
+        """
+        Listings scraped again without changes only get their last_seen date bumped.
+        """
+        self.db.upsert_listings([scraped("1"), scraped("2")], CRAWLS[0])
+        before = self.stored("1")
+        result = self.db.upsert_listings([scraped("1"), scraped("2")], CRAWLS[1])
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 2, "expired": 0})
+        self.assertEqual(self.stored("1"), before | {"last_seen": format_timestamp(CRAWLS[1])})
+
+    def test_same_scrape_is_unchanged(self):
+        """
+        Storing the same scrape again reports all the listings as unchanged, also those with a stale hash.
+        """
+        crawl = [scraped("1"), scraped("2", price="9000"), scraped("3", gps_lat=50.07)]
+        self.db.upsert_listings(crawl, CRAWLS[0])
+        result = self.db.upsert_listings(crawl, CRAWLS[1])
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 3, "expired": 0})
+        with self.db.conn:
+            self.db.conn.execute("UPDATE listings SET content_hash = 'stale' WHERE id != '1'")
+        result = self.db.upsert_listings(crawl, CRAWLS[2])
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 3, "expired": 0})
+        self.assertEqual(self.stored("2")["content_hash"], crawl[1].content_hash())
+        self.assertEqual(self.stored("2")["updated"], format_timestamp(CRAWLS[0]))
+
+    def test_changed_listings_are_rewritten(self):
+        """
+        Changed listings are rewritten in full and get their updated date bumped.
+        """
+        self.db.upsert_listings([scraped("1"), scraped("2")], CRAWLS[0])
+        changed = scraped("1", price=14000, description="Nová kuchyň", balcony=1)
+        result = self.db.upsert_listings([changed, scraped("2")], CRAWLS[1])
+        self.assertEqual(result, {"inserted": 0, "changed": 1, "unchanged": 1, "expired": 0})
+        row = self.stored("1")
+        self.assertEqual(self.db.get_listing("1"), changed)
+        self.assertEqual(row["content_hash"], changed.content_hash())
+        self.assertEqual(row["created"], format_timestamp(CRAWLS[0]))
+        self.assertEqual(row["updated"], format_timestamp(CRAWLS[1]))
+        self.assertEqual(row["last_seen"], format_timestamp(CRAWLS[1]))
+        self.assertEqual(self.stored("2")["updated"], format_timestamp(CRAWLS[0]))
+
+    def test_expire(self):
+        """
+        The listings not seen by a crawl are deleted, unless expire is off.
+        """
+        self.db.upsert_listings([scraped("1"), scraped("2")], CRAWLS[0])
+        result = self.db.upsert_listings([scraped("1")], CRAWLS[1], expire=False)
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 1, "expired": 0})
+        self.assertIsNotNone(self.stored("2"))
+        result = self.db.upsert_listings([scraped("1")], CRAWLS[2])
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 1, "expired": 1})
+        self.assertIsNone(self.stored("2"))
+        self.assertIsNotNone(self.stored("1"))
+
+    def test_last_duplicate_wins(self):
+        """
+        Of the listings with the same ID in a batch, the last one is stored.
+        """
+        result = self.db.upsert_listings([scraped("1", price=1), scraped("1", price=2)], CRAWLS[0])
+        self.assertEqual(result["inserted"], 1)
+        self.assertEqual(self.stored("1")["price"], 2)
+        result = self.db.upsert_listings([scraped("1", price=3), scraped("1", price=2)], CRAWLS[1])
+        self.assertEqual(result, {"inserted": 0, "changed": 0, "unchanged": 1, "expired": 0})
+        self.assertEqual(self.stored("1")["price"], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from flask import Flask  # pylint: disable=import-error
+from forms import UserPreferencesForm
+
+
+app = Flask(__name__)
+app.config["WTF_CSRF_ENABLED"] = False
+
+
+def validate(field: str, data: dict) -> tuple:
+    """
+    Returns the value and the errors of a field of the preferences form submitted with the data.
+    """
+    with app.test_request_context(method="POST", data=data):
+        form = UserPreferencesForm()
+        getattr(form, field).validate(form)
+        return getattr(form, field).data, getattr(form, field).errors
+
+
+class TestUserPreferencesForm(unittest.TestCase):
+    """
+    Tests of the validation of the preferences form.
+    """
+
+    def test_poi_weights(self):
+        """
+        The weights are numbers separated by commas, one for each point of interest.
+        """
+        points = "NTK Praha; 50.0755,14.4378"
+        for weights in ["", "2,1", " 2 , 0.5 ", "0,0"]:
+            self.assertEqual(validate("poi_weights", {"points_of_interest": points, "poi_weights": weights})[1], [])
+        for weights in ["1;2", "1,,2", "1,", "a,b", "-1,2", "1.,2"]:
+            errors = validate("poi_weights", {"points_of_interest": points, "poi_weights": weights})[1]
+            self.assertEqual(len(errors), 1, weights)
+        for weights in ["1", "1,2,3"]:
+            errors = validate("poi_weights", {"points_of_interest": points, "poi_weights": weights})[1]
+            self.assertEqual(len(errors), 1, weights)
+        self.assertEqual(len(validate("poi_weights", {"poi_weights": "1"})[1]), 1)
+
+    def test_location(self):
+        """
+        The location lists at least one place, the places are saved separated by commas.
+        """
+        for location, places in [
+            ("Praha", "Praha"),
+            ("Praha 2,Karlín", "Praha 2, Karlín"),
+            (" Brno ,, Ostrava ", "Brno, Ostrava"),
+        ]:
+            self.assertEqual(validate("location", {"location": location}), (places, []))
+        for location in ["", " ", ",", " , ,"]:
+            self.assertEqual(len(validate("location", {"location": location})[1]), 1, location)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,211 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+from geopy import Point  # type: ignore pylint: disable=import-error
+from geopy.exc import GeocoderUnavailable  # type: ignore pylint: disable=import-error
+import geocoding
+from geocoding import Geocoder, RateLimitedBackend, normalize_address, parse_coordinates
+
+
+ADDRESSES = {
+    "NTK Praha": (50.1036, 14.3901),
+    "Brno": (49.1951, 16.6068),
+    "Ostrava": (49.8209, 18.2625),
+}
+
+
+class FakeBackend:
+    """
+    A geocoding backend knowing the ADDRESSES, recording the addresses it was asked for.
+    """
+
+    def __init__(self) -> None:
+        self.calls: list[str] = []
+        self.unavailable = False
+
+    def __call__(self, address: str) -> None | tuple[float, float]:
+        self.calls.append(address)
+        if self.unavailable:
+            raise GeocoderUnavailable("unavailable")
+        return ADDRESSES.get(address)
+
+
+class FakeClock:
+    """
+    The time of time.time, time.monotonic and time.sleep, moved only by sleep and by the tests.
+    """
+
+    def __init__(self) -> None:
+        self.now = 1000.0
+        self.sleeps: list[float] = []
+
+    def time(self) -> float:
+        """
+        Returns the current time.
+        """
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        """
+        Moves the time by the given number of seconds.
+        """
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestGeocoder(unittest.TestCase):
+    """
+    Tests of the geocoding cache with a fake backend.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.enterContext(mock.patch.object(geocoding.time, "time", self.clock.time))
+        self.backend = FakeBackend()
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def geocoder(self, db_file: str = ":memory:", **kwargs) -> Geocoder:
+        """
+        Returns a geocoder of the fake backend, with the database cache in memory by default,
+        which is gone after each lookup.
+        """
+        return Geocoder(db_file, self.backend, **kwargs)
+
+    def test_memory_cache(self):
+        """
+        An address is looked up once, also when written differently.
+        """
+        geocoder = self.geocoder()
+        self.assertEqual(geocoder.geocode("NTK Praha"), Point(50.1036, 14.3901))
+        self.assertEqual(geocoder.geocode("  ntk   PRAHA "), Point(50.1036, 14.3901))
+        self.assertEqual(self.backend.calls, ["NTK Praha"])
+        self.assertEqual(geocoder.stats(), {"hits": 1, "db_hits": 0, "misses": 1})
+        self.assertIsNone(geocoder.geocode(" , "))
+
+    def test_database_cache(self):
+        """
+        The addresses looked up by one geocoder are loaded from the database by another.
+        """
+        self.geocoder(self.path).geocode("Brno")
+        geocoder = self.geocoder(self.path)
+        self.assertEqual(geocoder.geocode("brno"), Point(49.1951, 16.6068))
+        self.assertEqual(geocoder.geocode("brno"), Point(49.1951, 16.6068))
+        self.assertEqual(self.backend.calls, ["Brno"])
+        self.assertEqual(geocoder.stats(), {"hits": 1, "db_hits": 1, "misses": 0})
+
+    def test_ttl(self):
+        """
+        The coordinates are looked up again once they expire, in memory and in the database.
+        """
+        geocoder = self.geocoder(self.path, ttl=100)
+        geocoder.geocode("Brno")
+        self.clock.now += 99
+        geocoder.geocode("Brno")
+        self.geocoder(self.path, ttl=100).geocode("Brno")
+        self.assertEqual(self.backend.calls, ["Brno"])
+        self.clock.now += 1
+        geocoder.geocode("Brno")
+        self.assertEqual(self.backend.calls, ["Brno", "Brno"])
+        self.geocoder(self.path, ttl=100).geocode("Brno")
+        self.assertEqual(self.backend.calls, ["Brno", "Brno"])
+
+    def test_negative_cache(self):
+        """
+        An address that was not found is not looked up again for the shorter negative_ttl.
+        """
+        geocoder = self.geocoder(self.path, ttl=1000, negative_ttl=10)
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.clock.now += 9
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.assertIsNone(self.geocoder(self.path).geocode("nowhere"))
+        self.assertEqual(self.backend.calls, ["Nowhere"])
+        self.clock.now += 1
+        self.assertIsNone(geocoder.geocode("Nowhere"))
+        self.assertEqual(self.backend.calls, ["Nowhere", "Nowhere"])
+
+    def test_failed_lookups_are_not_cached(self):
+        """
+        A lookup that failed is made again by the next geocode.
+        """
+        geocoder = self.geocoder(self.path)
+        self.backend.unavailable = True
+        self.assertIsNone(geocoder.geocode("Ostrava"))
+        self.backend.unavailable = False
+        self.assertEqual(geocoder.geocode("Ostrava"), Point(49.8209, 18.2625))
+        self.assertEqual(self.backend.calls, ["Ostrava", "Ostrava"])
+
+    def test_lru_eviction(self):
+        """
+        Only the max_entries most recently used addresses are kept in memory.
+        """
+        geocoder = self.geocoder(max_entries=2)
+        for address in ["NTK Praha", "Brno", "NTK Praha", "Ostrava", "NTK Praha", "Brno"]:
+            geocoder.geocode(address)
+        self.assertEqual(self.backend.calls, ["NTK Praha", "Brno", "Ostrava", "Brno"])
+        self.assertEqual(geocoder.stats(), {"hits": 2, "db_hits": 0, "misses": 4})
+
+
+class TestRateLimitedBackend(unittest.TestCase):
+    """
+    Tests of limiting the rate of the backend calls.
+    """
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.enterContext(mock.patch.object(geocoding.time, "monotonic", self.clock.time))
+        self.enterContext(mock.patch.object(geocoding.time, "sleep", self.clock.sleep))
+        self.backend = FakeBackend()
+
+    def test_min_interval(self):
+        """
+        The calls wait for the previous one to be min_interval seconds ago.
+        """
+        limited = RateLimitedBackend(self.backend, min_interval=1.0)
+        self.assertEqual(limited("Brno"), (49.1951, 16.6068))
+        self.assertEqual(limited("Ostrava"), (49.8209, 18.2625))
+        self.clock.now += 0.25
+        limited("Brno")
+        self.clock.now += 5
+        limited("Brno")
+        self.assertEqual(self.clock.sleeps, [1.0, 0.75])
+        self.assertEqual(len(self.backend.calls), 4)
+
+    def test_failed_calls_count(self):
+        """
+        A failed call is waited for the same way.
+        """
+        limited = RateLimitedBackend(self.backend, min_interval=2.0)
+        self.backend.unavailable = True
+        with self.assertRaises(GeocoderUnavailable):
+            limited("Brno")
+        self.backend.unavailable = False
+        limited("Brno")
+        self.assertEqual(self.clock.sleeps, [2.0])
+
+
+class TestParsing(unittest.TestCase):
+    """
+    Tests of parsing the addresses and coordinates.
+    """
+
+    def test_normalize_address(self):
+        """
+        Addresses differing in letter case and whitespace have the same key.
+        """
+        self.assertEqual(normalize_address(" Vinohradská 12 ,Praha  2 "), "vinohradská 12, praha 2")
+
+    def test_parse_coordinates(self):
+        """
+        Coordinates are parsed, addresses are not.
+        """
+        self.assertEqual(parse_coordinates("50.1036, 14.3901"), Point(50.1036, 14.3901))
+        self.assertIsNone(parse_coordinates("NTK Praha"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,237 @@
+import glob
+import os
+import tempfile
+import time
+import unittest
+from email.utils import formatdate
+from unittest import mock
+from scrapy import Request, Spider  # type: ignore pylint: disable=import-error
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware  # type: ignore pylint: disable=import-error
+from scrapy.http import Response  # type: ignore pylint: disable=import-error
+from scrapy.statscollectors import MemoryStatsCollector  # type: ignore pylint: disable=import-error
+from scrapy.utils.test import get_crawler  # type: ignore pylint: disable=import-error
+from http_cache import HTTP_CACHE_TTL_META, PRICE_HEADER, HttpCacheStats, http_cache_settings, prune
+from tests.test_geocoding import FakeClock
+from tests.test_incremental_crawl import detail_request
+
+
+SEARCH_TTL = 60
+DETAIL_TTL = 3600
+MAX_AGE = 86400
+SEARCH_URL = "https://www.sreality.cz/hledani/pronajem/byty"
+
+
+class FakePortal:
+    """
+    A portal serving its pages with an ETag, answering 304 to the requests with the ETag of the current page.
+    """
+
+    def __init__(self, clock) -> None:
+        self.clock = clock
+        # the ETag and the body of each page
+        self.pages: dict[str, tuple[bytes, bytes]] = {}
+        # the If-None-Match header of each request the portal got
+        self.requests: list[None | bytes] = []
+        self.cache_control: None | bytes = None
+
+    def __call__(self, request: Request) -> Response:
+        self.requests.append(request.headers.get(b"If-None-Match"))
+        etag, body = self.pages.get(request.url, (b'"0"', b"page"))
+        headers = {b"ETag": etag, b"Date": formatdate(self.clock.now, usegmt=True)}
+        if self.cache_control is not None:
+            headers[b"Cache-Control"] = self.cache_control
+        if request.headers.get(b"If-None-Match") == etag:
+            return Response(request.url, status=304, headers=headers)
+        return Response(request.url, body=body, headers=headers)
+
+
+class HttpCacheTestCase(unittest.TestCase):
+    """
+    Base of the tests of the HTTP cache, downloading the pages of a fake portal through the cache middleware
+    with the settings of http_cache_settings and the cache in a temporary directory.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.clock = FakeClock()
+        # the pages are stored with the time of the files
+        self.clock.now = time.time()
+        self.enterContext(mock.patch("scrapy.extensions.httpcache.time", self.clock.time))
+        self.portal = FakePortal(self.clock)
+        crawler = get_crawler(
+            Spider, http_cache_settings(self.directory.name, SEARCH_TTL, DETAIL_TTL, MAX_AGE)
+        )
+        self.spider = crawler._create_spider("sreality")  # pylint: disable=protected-access
+        self.stats = crawler.stats
+        self.middleware = HttpCacheMiddleware.from_crawler(crawler)
+        self.middleware.spider_opened(self.spider)
+
+    def tearDown(self):
+        self.middleware.spider_closed(self.spider)
+        self.directory.cleanup()
+
+    def fetch(self, request: Request) -> Response:
+        """
+        Returns the page of a request from the cache or from the portal.
+        """
+        cached = self.middleware.process_request(request, self.spider)
+        if cached is not None:
+            return cached
+        return self.middleware.process_response(request, self.portal(request), self.spider)
+
+    def counts(self) -> dict[str, int]:
+        """
+        Returns the number of requests of each outcome counted by the cache middleware.
+        """
+        return {
+            outcome: self.stats.get_value(f"httpcache/{outcome}", 0)
+            for outcome in ("hit", "miss", "revalidate", "invalidate", "store", "uncacheable")
+        }
+
+
+class TestListingCachePolicy(HttpCacheTestCase):
+    """
+    Tests of the freshness of the cached pages and of revalidating them with their ETag.
+    """
+
+    def test_search_page(self):
+        """
+        A search results page is used for SEARCH_TTL seconds, then revalidated, a 304 keeps the cached page.
+        """
+        self.portal.pages[SEARCH_URL] = (b'"1"', b"first")
+        self.assertEqual(self.fetch(Request(SEARCH_URL)).body, b"first")
+        self.clock.now += SEARCH_TTL - 1
+        self.assertEqual(self.fetch(Request(SEARCH_URL)).body, b"first")
+        self.assertEqual(self.portal.requests, [None])
+        self.clock.now += 1
+        response = self.fetch(Request(SEARCH_URL))
+        self.assertEqual((response.status, response.body), (200, b"first"))
+        self.assertIn("cached", response.flags)
+        self.assertEqual(self.portal.requests, [None, b'"1"'])
+        self.assertEqual(
+            self.counts(), {"hit": 1, "miss": 1, "revalidate": 1, "invalidate": 0, "store": 1, "uncacheable": 0}
+        )
+
+    def test_changed_page(self):
+        """
+        A stale page the portal has changed is downloaded in full and cached again.
+        """
+        self.portal.pages[SEARCH_URL] = (b'"1"', b"first")
+        self.fetch(Request(SEARCH_URL))
+        self.clock.now += SEARCH_TTL
+        self.portal.pages[SEARCH_URL] = (b'"2"', b"second")
+        self.assertEqual(self.fetch(Request(SEARCH_URL)).body, b"second")
+        self.assertEqual(self.fetch(Request(SEARCH_URL)).body, b"second")
+        self.assertEqual(self.portal.requests, [None, b'"1"'])
+        self.assertEqual(
+            self.counts(), {"hit": 1, "miss": 1, "revalidate": 0, "invalidate": 1, "store": 2, "uncacheable": 0}
+        )
+
+    def test_detail_page(self):
+        """
+        A detail page is used for DETAIL_TTL seconds while the price of the listing is the same,
+        a changed price is always revalidated.
+        """
+        self.fetch(detail_request("1", "15000"))
+        self.clock.now += DETAIL_TTL - 1
+        self.fetch(detail_request("1", 15000.0))
+        self.assertEqual(self.portal.requests, [None])
+        self.fetch(detail_request("1", "14500"))
+        self.assertEqual(self.portal.requests, [None, b'"0"'])
+        self.clock.now += 1
+        self.fetch(detail_request("1", "15000"))
+        self.assertEqual(self.portal.requests, [None, b'"0"', b'"0"'])
+
+    def test_ttl_meta(self):
+        """
+        The TTL of a request overrides the one of its page type, a page without a TTL is always revalidated.
+        """
+        self.fetch(Request(SEARCH_URL, meta={HTTP_CACHE_TTL_META: DETAIL_TTL}))
+        self.clock.now += SEARCH_TTL
+        self.fetch(Request(SEARCH_URL, meta={HTTP_CACHE_TTL_META: DETAIL_TTL}))
+        self.fetch(Request(SEARCH_URL, meta={HTTP_CACHE_TTL_META: 0}))
+        self.assertEqual(self.portal.requests, [None, b'"0"'])
+
+    def test_no_store(self):
+        """
+        Pages with "Cache-Control: no-store" are not cached, also with a TTL.
+        """
+        self.portal.cache_control = b"no-store"
+        self.fetch(Request(SEARCH_URL))
+        self.fetch(Request(SEARCH_URL))
+        self.assertEqual(self.portal.requests, [None, None])
+        self.assertEqual(self.counts()["uncacheable"], 2)
+
+
+class TestListingCacheStorage(HttpCacheTestCase):
+    """
+    Tests of storing the cached pages and deleting the old ones.
+    """
+
+    def test_price_header(self):
+        """
+        A cached detail page keeps the price it was requested for, a search results page no price.
+        """
+        self.fetch(detail_request("1", " 15 000 "))
+        self.fetch(Request(SEARCH_URL))
+        storage = self.middleware.storage
+        cached = storage.retrieve_response(self.spider, detail_request("1"))
+        self.assertEqual((cached.headers.get(PRICE_HEADER), cached.body), (b"15 000", b"page"))
+        self.assertIsNone(storage.retrieve_response(self.spider, Request(SEARCH_URL)).headers.get(PRICE_HEADER))
+
+    def test_max_age(self):
+        """
+        A page cached more than MAX_AGE seconds ago is downloaded in full.
+        """
+        self.fetch(Request(SEARCH_URL))
+        self.clock.now += MAX_AGE + 1
+        self.fetch(Request(SEARCH_URL))
+        self.assertEqual(self.portal.requests, [None, None])
+        self.assertEqual(self.counts()["miss"], 2)
+
+    def test_prune(self):
+        """
+        Only the pages cached more than max_age seconds ago are deleted.
+        """
+        self.fetch(Request(SEARCH_URL))
+        self.fetch(detail_request("1", "15000"))
+        metas = glob.glob(f"{self.directory.name}/*/*/*/pickled_meta")
+        self.assertEqual(len(metas), 2)
+        os.utime(metas[0], (0, 0))
+        self.assertEqual(prune(self.directory.name, MAX_AGE), 1)
+        self.assertFalse(os.path.exists(os.path.dirname(metas[0])))
+        self.assertTrue(os.path.exists(metas[1]))
+        self.assertEqual(prune(self.directory.name, MAX_AGE), 0)
+
+
+class TestHttpCacheStats(unittest.TestCase):
+    """
+    Tests of the shares of the requests served by the HTTP cache.
+    """
+
+    def setUp(self):
+        self.spider = Spider("sreality")
+        self.stats = MemoryStatsCollector(mock.Mock())
+
+    def test_ratios(self):
+        """
+        The stale pages that changed count as downloaded with the pages not in the cache.
+        """
+        for key, count in {"hit": 5, "revalidate": 3, "miss": 1, "invalidate": 1}.items():
+            self.stats.set_value(f"httpcache/{key}", count)
+        HttpCacheStats(self.stats).spider_closed(self.spider)
+        self.assertEqual(
+            [self.stats.get_value(f"httpcache/{ratio}_ratio") for ratio in ("hit", "revalidate", "download")],
+            [0.5, 0.3, 0.2],
+        )
+
+    def test_without_requests(self):
+        """
+        No ratios are added if the spider made no requests.
+        """
+        HttpCacheStats(self.stats).spider_closed(self.spider)
+        self.assertEqual(self.stats.get_stats(), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,159 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+from scrapy import Request  # type: ignore pylint: disable=import-error
+from scrapy.exceptions import IgnoreRequest, NotConfigured  # type: ignore pylint: disable=import-error
+from scrapy.settings import Settings  # type: ignore pylint: disable=import-error
+from database_wrapper import DatabaseWrapper, format_timestamp
+from incremental_crawl import (
+    LISTING_ID_META,
+    LISTING_PRICE_META,
+    SkipKnownListingsMiddleware,
+    load_known_listings,
+    price_marker,
+    read_known_listings,
+    save_known_listings,
+)
+from listing import Listing, PAYLOAD_FIELDS
+
+
+PREVIOUS_CRAWL = datetime.datetime(2024, 4, 1, 12, 0, 0, 5)
+CRAWL_TIME = datetime.datetime(2024, 4, 2, 12, 0, 0, 5)
+
+
+def detail_request(listing_id: str | None = None, price=None) -> Request:
+    """
+    Returns the request of the detail page of a listing, tagged with its ID and price if the ID is given.
+    """
+    meta = {} if listing_id is None else {LISTING_ID_META: listing_id, LISTING_PRICE_META: price}
+    return Request(f"https://www.sreality.cz/detail/{listing_id}", meta=meta)
+
+
+class TestSkipKnownListingsMiddleware(unittest.TestCase):
+    """
+    Tests of skipping the detail pages of the stored listings whose price has not changed.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        self.db_file = os.path.join(self.directory.name, "listings.db")
+        self.known_file = os.path.join(self.directory.name, "known_listings.json")
+        db = DatabaseWrapper(self.db_file)
+        db.create_table()
+        db.upsert_listings(
+            [
+                Listing(dict.fromkeys(PAYLOAD_FIELDS) | {"id": "1", "price": "15000"}),
+                Listing(dict.fromkeys(PAYLOAD_FIELDS) | {"id": "2", "price": 20000.0}),
+            ],
+            PREVIOUS_CRAWL,
+        )
+        db.close_conn()
+        save_known_listings(self.known_file, load_known_listings(self.db_file))
+        self.spider = mock.Mock()
+        self.spider.name = "sreality"
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def middleware(self, **settings) -> SkipKnownListingsMiddleware:
+        """
+        Returns the middleware of a crawler with the settings of a crawl.
+        """
+        crawler = mock.Mock()
+        crawler.settings = Settings(
+            {
+                "LISTINGS_DB_FILE": self.db_file,
+                "CRAWL_TIME": CRAWL_TIME.isoformat(),
+                "KNOWN_LISTINGS_FILE": self.known_file,
+            }
+            | settings
+        )
+        middleware = SkipKnownListingsMiddleware.from_crawler(crawler)
+        crawler.signals.connect.assert_called_once_with(middleware.spider_closed, signal=mock.ANY)
+        return middleware
+
+    def last_seen(self, listing_id: str) -> str:
+        """
+        Returns the last_seen date of a stored listing.
+        """
+        db = DatabaseWrapper(self.db_file)
+        listing = db.get_listing(listing_id)
+        db.close_conn()
+        return listing.to_dict()["last_seen"]
+
+    def test_known_listing_is_skipped(self):
+        """
+        The request of a known listing with the same price is dropped, the listing is seen when the spider closes.
+        """
+        middleware = self.middleware()
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_request(detail_request("1", "15000"), self.spider)
+        with self.assertRaises(IgnoreRequest):
+            middleware.process_request(detail_request("2", 20000), self.spider)
+        self.assertEqual(middleware.skipped, ["1", "2"])
+        self.assertEqual(middleware.fetched, 0)
+        self.spider.crawler.stats.inc_value.assert_called_with("incremental/skipped")
+        self.assertEqual(self.last_seen("1"), format_timestamp(PREVIOUS_CRAWL))
+        middleware.spider_closed(self.spider)
+        self.assertEqual(self.last_seen("1"), format_timestamp(CRAWL_TIME))
+        self.assertEqual(self.last_seen("2"), format_timestamp(CRAWL_TIME))
+
+    def test_changed_price_is_fetched(self):
+        """
+        The request of a known listing with a changed price, or of a new listing, is fetched.
+        """
+        middleware = self.middleware()
+        self.assertIsNone(middleware.process_request(detail_request("1", "14500"), self.spider))
+        self.assertIsNone(middleware.process_request(detail_request("3", "15000"), self.spider))
+        self.assertEqual((middleware.skipped, middleware.fetched), ([], 2))
+        self.spider.crawler.stats.inc_value.assert_called_with("incremental/fetched")
+        middleware.spider_closed(self.spider)
+        self.assertEqual(self.last_seen("1"), format_timestamp(PREVIOUS_CRAWL))
+
+    def test_untagged_request_is_fetched(self):
+        """
+        Requests without the listing ID are always fetched and not counted.
+        """
+        middleware = self.middleware()
+        self.assertIsNone(middleware.process_request(detail_request(), self.spider))
+        self.assertEqual((middleware.skipped, middleware.fetched), ([], 0))
+        self.spider.crawler.stats.inc_value.assert_not_called()
+
+    def test_known_listings_file(self):
+        """
+        The crawlers of a process share the known listings read from the file, they are read again once it changes.
+        """
+        first, second = self.middleware(), self.middleware()
+        self.assertEqual(first.known, {"1": "15000", "2": "20000"})
+        self.assertIs(first.known, second.known)
+        save_known_listings(self.known_file, {"1": "15000"})
+        os.utime(self.known_file, ns=(0, 0))
+        self.assertEqual(read_known_listings(self.known_file), {"1": "15000"})
+
+    def test_without_known_listings_file(self):
+        """
+        The known listings are loaded from the database if no file is given.
+        """
+        self.assertEqual(self.middleware(KNOWN_LISTINGS_FILE=None).known, {"1": "15000", "2": "20000"})
+
+    def test_not_configured(self):
+        """
+        The middleware is off if INCREMENTAL_CRAWL is.
+        """
+        with self.assertRaises(NotConfigured):
+            self.middleware(INCREMENTAL_CRAWL=False)
+
+    def test_price_marker(self):
+        """
+        Prices as scraped and as stored are compared the same.
+        """
+        self.assertEqual([price_marker(price) for price in ("15000", 15000, 15000.0)], ["15000"] * 3)
+        self.assertEqual(price_marker(12500.5), "12500.5")
+        self.assertEqual(price_marker(" 12 500 € "), "12 500 €")
+        self.assertEqual(price_marker(None), "")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import sqlite3
+import unittest
+from listing import FIELDS, Listing, PAYLOAD_FIELDS
+
+
+# a row of a listing with a value of each type stored in the database
+ROW = (
+    "1",
+    "Vinohradská 12, Praha 2 - Vinohrady",
+    65,
+    "01.05.2024",
+    "Světlý byt",
+    "2+kk",
+    3,
+    "částečně",
+    15000,
+    30000,
+    2500.5,
+    None,
+    "byt",
+    "https://example.com/1",
+    True,
+    False,
+    None,
+    "",
+    1,
+    0,
+    None,
+    None,
+    "osobní",
+    50.075,
+    14.44,
+    "2024-04-01 12:00:00.000005",
+    "2024-04-02 12:00:00.000005",
+    "2024-04-03 12:00:00.000005",
+)
+
+
+class TestListing(unittest.TestCase):
+    """
+    Tests of converting the listings from and to database rows and comparing them.
+    """
+
+    def test_row_round_trip(self):
+        """
+        A listing created from a row gives back the same row, also when created from the row as a dictionary.
+        """
+        listing = Listing.from_row(ROW)
+        self.assertEqual(listing.to_row(), ROW)
+        self.assertEqual(listing.payload(), ROW[: len(PAYLOAD_FIELDS)])
+        self.assertEqual(Listing.from_row(listing.to_dict()).to_row(), ROW)
+        self.assertEqual(listing.to_dict(), dict(zip(FIELDS, ROW)))
+        self.assertEqual([getattr(listing, field) for field in ("price", "gps_lat")], [15000, 50.075])
+
+    def test_sqlite_round_trip(self):
+        """
+        A listing read from a sqlite row is stored back unchanged.
+        """
+        conn = sqlite3.connect(":memory:")
+        conn.execute(f"CREATE TABLE listings ({','.join(FIELDS)})")
+        conn.execute(f"INSERT INTO listings VALUES ({','.join('?' for _ in FIELDS)})", ROW)
+        listing = Listing.from_row(conn.execute("SELECT * FROM listings").fetchone())
+        conn.execute("DELETE FROM listings")
+        conn.execute(f"INSERT INTO listings VALUES ({','.join('?' for _ in FIELDS)})", listing.to_row())
+        self.assertEqual(Listing.from_row(conn.execute("SELECT * FROM listings").fetchone()), listing)
+        conn.close()
+
+    def test_missing_fields(self):
+        """
+        Fields missing from the data are empty strings, all fields are None without data.
+        """
+        listing = Listing({"id": "1", "price": 15000})
+        self.assertEqual(listing.to_dict(), dict.fromkeys(FIELDS, "") | {"id": "1", "price": 15000})
+        self.assertEqual(Listing().to_row(), (None,) * len(FIELDS))
+
+    def test_equality(self):
+        """
+        Listings are equal when their content is, the timestamps are not compared.
+        """
+        listing = Listing.from_row(ROW)
+        seen_later = Listing.from_row(ROW[: len(PAYLOAD_FIELDS)] + ("2024-04-01", None, "2024-05-01"))
+        self.assertEqual(listing, seen_later)
+        self.assertEqual(listing.content_hash(), seen_later.content_hash())
+        for index, field in enumerate(PAYLOAD_FIELDS):
+            changed = Listing.from_row(ROW[:index] + ("jiné",) + ROW[index + 1 :])
+            self.assertNotEqual(listing, changed, field)
+            self.assertNotEqual(listing.content_hash(), changed.content_hash(), field)
+        # a missing garden is not the same as an empty one
+        self.assertNotEqual(listing, Listing.from_row(ROW[:16] + ("",) + ROW[17:]))
+        self.assertNotEqual(listing, dict(zip(FIELDS, ROW)))
+
+
+if __name__ == "__main__":
+    unittest.main()
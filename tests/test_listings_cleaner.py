@@ -0,0 +1,199 @@
+import datetime
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np  # type: ignore pylint: disable=import-error
+import pandas as pd  # type: ignore pylint: disable=import-error
+from database_wrapper import DatabaseWrapper
+from listing import Listing, PAYLOAD_FIELDS
+import listings_cleaner
+from listings_cleaner import clean_listing_database, clean_listings, _apply_distinct
+
+
+CRAWL_TIME = datetime.datetime(2024, 4, 1, 12, 0, 0, 5)
+
+
+def bezrealitky_item(listing_id: str, **fields) -> dict:
+    """
+    Returns a listing as scraped from bezrealitky.cz, the fields not given are None.
+    """
+    return (
+        dict.fromkeys(PAYLOAD_FIELDS)
+        | {
+            "id": listing_id,
+            "address": "Praha 2, Vinohrady",
+            "area": "65",
+            "disposition": "2+kk",
+            "price": "15 000 Kč",
+            "floor": "3. podlaží z celkem 5",
+            "url": f"https://www.bezrealitky.cz/{listing_id}",
+        }
+        | fields
+    )
+
+
+def sreality_item(listing_id: str, **fields) -> dict:
+    """
+    Returns a listing as scraped from sreality.cz, with the codes of the portal, the fields not given are None.
+    """
+    return (
+        dict.fromkeys(PAYLOAD_FIELDS)
+        | {
+            "id": listing_id,
+            "address": "Brno - Žabovřesky",
+            "area": 65,
+            "disposition": 4,
+            "price": 15000,
+            "floor": 3,
+            "furnished": 1,
+            "ownership": 1,
+            "type": 2,
+            "elevator": 1,
+            "url": f"https://www.sreality.cz/{listing_id}",
+            "gps_lat": 49.2,
+            "gps_lon": 16.6,
+        }
+        | fields
+    )
+
+
+# listings of both portals with the values the cleaner unifies, the same values are repeated
+# as different types, e.g. the sreality code 2 and 2.0
+MIXED_ITEMS = [
+    sreality_item("s1"),
+    sreality_item("s2", disposition=2, elevator=2, balcony=1, cellar=1, available_from="01.05.2024"),
+    sreality_item("s3", disposition=2.0, elevator=2.0, type=3, furnished=2, garage=1, available_from="Ihned"),
+    sreality_item("s4", disposition=47, ownership=2, floor=0, price=9999.0, available_from=" 1.07.2024"),
+    sreality_item("s5", disposition=16, type=1, furnished=3, garden=50, loggie=1, parking=1, terrace=1),
+    bezrealitky_item("b1"),
+    bezrealitky_item("b2", disposition="Garsoniéra", balcony="Balkón 5 m²", cellar="Sklep 3 m²"),
+    bezrealitky_item("b3", disposition="6+1", elevator="Výtah", garage="Garáž", available_from="od 1.5."),
+    bezrealitky_item("b4", floor="přízemí", garden="Předzahrádka 20 m²", loggie="Lodžie", parking="Parkování"),
+    bezrealitky_item("b5", area="1 200", price="12 500 Kč", terrace="Terasa", ownership="Obecní"),
+    bezrealitky_item("b6", floor="2. podlaží včetně 1 podzemního", available_from="15.06.2024", type="Cihla"),
+    bezrealitky_item("b7", disposition="2+kk", furnished="Vybaveno", ownership="Osobní", gps_lat="", gps_lon=""),
+]
+
+
+class TestListingsCleaner(unittest.TestCase):
+    """
+    Tests of the listings cleaner on a temporary database file.
+    """
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def store(self, listings):
+        """
+        Stores scraped listings in the database.
+        """
+        db = DatabaseWrapper(self.path)
+        db.create_table()
+        db.upsert_listings(listings, CRAWL_TIME)
+        db.close_conn()
+
+    def test_missing_coordinates_are_stored_as_null(self):
+        """
+        Listings scraped without coordinates have them stored as NULL and loaded as NaN.
+        """
+        self.store(
+            [
+                # the spiders leave out the coordinates of listings without them, they are set to ""
+                Listing({k: v for k, v in bezrealitky_item("1").items() if k not in ["gps_lat", "gps_lon"]}),
+                Listing(bezrealitky_item("2", gps_lat=50.0755, gps_lon=14.4378)),
+            ]
+        )
+        df = clean_listing_database(self.path)
+        self.assertTrue(np.isnan(df.loc["1", "gps_lat"]) and np.isnan(df.loc["1", "gps_lon"]))
+        self.assertEqual((df.loc["2", "gps_lat"], df.loc["2", "gps_lon"]), (50.0755, 14.4378))
+        db = DatabaseWrapper(self.path)
+        row = db.conn.execute("SELECT gps_lat, gps_lon FROM listings_clean WHERE id = '1'").fetchone()
+        db.close_conn()
+        self.assertEqual(row, {"gps_lat": None, "gps_lon": None})
+
+    def test_listings_without_coordinates_are_geocoded(self):
+        """
+        Listings stored without coordinates are picked up for geocoding once cleaned.
+        """
+        self.store(
+            [
+                Listing({k: v for k, v in bezrealitky_item("1").items() if k not in ["gps_lat", "gps_lon"]}),
+                Listing(bezrealitky_item("2", gps_lat=50.0755, gps_lon=14.4378)),
+            ]
+        )
+        clean_listing_database(self.path)
+        db = DatabaseWrapper(self.path)
+        addresses = db.get_addresses_without_coordinates()
+        db.close_conn()
+        self.assertEqual(addresses, {"Praha 2, Vinohrady": ["1"]})
+
+    def test_mixed_listings_match_row_by_row_cleaning(self):
+        """
+        Cleaning once per distinct value gives the same frame as cleaning the rows one by one.
+        """
+        self.store([Listing(item) for item in MIXED_ITEMS])
+        db = DatabaseWrapper(self.path)
+        raw = db.get_unclean_df()
+        db.close_conn()
+        cleaned = clean_listings(raw.copy())
+        with mock.patch.object(listings_cleaner, "_apply_distinct", lambda series, func: series.apply(func)):
+            expected = clean_listings(raw.copy())
+        pd.testing.assert_frame_equal(cleaned, expected, check_exact=True)
+        self.assertEqual(cleaned.loc["s2", "disposition"], "1+kk")
+        self.assertEqual(cleaned.loc["b2", "disposition"], "1+kk")
+        self.assertEqual(cleaned.loc["s2", "elevator"], 0)
+        self.assertEqual(cleaned.loc["b3", "elevator"], 1)
+        self.assertEqual(cleaned.loc["b5", "price"], 12500)
+
+    def test_available_from_keeps_only_dates(self):
+        """
+        Dates are parsed, "Ihned" is the date the listing was updated and other values become NaN.
+        """
+        self.store([Listing(item) for item in MIXED_ITEMS] + [Listing(bezrealitky_item("b8", available_from=""))])
+        available_from = clean_listing_database(self.path).available_from
+        self.assertEqual(available_from["s2"], datetime.date(2024, 5, 1))
+        self.assertEqual(available_from["s3"], CRAWL_TIME.date())
+        self.assertEqual(available_from["s4"], datetime.date(2024, 7, 1))
+        self.assertEqual(available_from["b6"], datetime.date(2024, 6, 15))
+        for listing_id in ["s1", "b3", "b8"]:
+            self.assertTrue(pd.isna(available_from[listing_id]), listing_id)
+
+
+class TestApplyDistinct(unittest.TestCase):
+    """
+    Tests of evaluating a function once per distinct value.
+    """
+
+    def test_equal_values_of_different_types_are_kept_apart(self):
+        """
+        1, 1.0 and True are equal, but the function is called for each of them.
+        """
+        series = pd.Series([1, 1.0, True, "1", None, 1, 1.0], index=list("abcdefg"), dtype=object)
+        calls = []
+
+        def type_name(value):
+            calls.append(value)
+            return type(value).__name__
+
+        result = _apply_distinct(series, type_name)
+        pd.testing.assert_series_equal(result, series.apply(lambda value: type(value).__name__))
+        self.assertEqual(len(calls), 5)
+
+    def test_dtype_is_inferred_like_apply(self):
+        """
+        The result has the dtype Series.apply would give it.
+        """
+        series = pd.Series(["65", "1 200", "65", None], dtype=object)
+
+        def area(value):
+            return int(value.replace(" ", "")) if isinstance(value, str) else value
+
+        pd.testing.assert_series_equal(_apply_distinct(series, area), series.apply(area))
+
+
+if __name__ == "__main__":
+    unittest.main()
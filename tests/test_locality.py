@@ -0,0 +1,40 @@
+import unittest
+from locality import SEARCHED_CITIES, parse_address, search_cities, split_places
+
+
+class TestLocality(unittest.TestCase):
+    """
+    Tests of parsing the addresses and the location preference.
+    """
+
+    def test_parse_address(self):
+        """
+        The address is split into its city, district, quarter and street.
+        """
+        self.assertEqual(
+            parse_address("Vinohradská 12, Praha 2 - Vinohrady"), ("Praha", "Praha 2", "Vinohrady", "Vinohradská 12")
+        )
+        self.assertEqual(parse_address("Údolní, Brno - Veveří"), ("Brno", None, "Veveří", "Údolní"))
+        self.assertEqual(parse_address(None), (None, None, None, None))
+
+    def test_split_places(self):
+        """
+        The places are separated by commas.
+        """
+        self.assertEqual(split_places(" Praha  2, ,Karlín "), ["Praha 2", "Karlín"])
+        self.assertEqual(split_places(None), [])
+
+    def test_search_cities(self):
+        """
+        Each place is searched in its city once, quarters in the cities they are known in.
+        """
+        quarter_cities = {"Karlín": ["Praha"], "Veveří": ["Brno"]}
+        self.assertEqual(search_cities(["Praha 2", "Praha 3", "Karlín"], quarter_cities), ["Praha"])
+        self.assertEqual(search_cities(["Karlín", "Brno", "Veveří"], quarter_cities), ["Praha", "Brno"])
+        self.assertEqual(search_cities(["Ostrava", "Kladno"], quarter_cities), ["Ostrava"])
+        self.assertEqual(search_cities(["Žižkov"], quarter_cities), SEARCHED_CITIES)
+        self.assertEqual(search_cities([], quarter_cities), SEARCHED_CITIES)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import datetime
+import os
+import random
+import tempfile
+import unittest
+from scrapy.exporters import JsonLinesItemExporter  # type: ignore pylint: disable=import-error
+from scrapy.extensions.postprocessing import PostProcessingManager  # type: ignore pylint: disable=import-error
+from listing import Listing
+from scrape_archive import ARCHIVE_COMPRESSIONS, archive_feed, crawl_files, read_items, rotate
+from tests.test_user_preferences import random_item
+
+
+CRAWLS = [datetime.datetime(2024, 4, 1, hour, 0, 0, 5) for hour in (10, 11, 12)]
+
+
+def write_feed(directory: str, crawl_time: datetime.datetime, compression: str, spider: str, items: list) -> str:
+    """
+    Writes the items of a spider to the archive the way the feed exports of Scrapy do, returns the path of the file.
+    """
+    (path, options), = archive_feed(directory, crawl_time, compression, "Praha").items()
+    path = path % {"name": spider}
+    with open(path, "wb") as f:
+        file = PostProcessingManager(options["postprocessing"], f, options) if "postprocessing" in options else f
+        exporter = JsonLinesItemExporter(file, encoding=options["encoding"])
+        exporter.start_exporting()
+        for item in items:
+            exporter.export_item(item)
+        exporter.finish_exporting()
+        if file is not f:
+            file.close()
+    return path
+
+
+class TestScrapeArchive(unittest.TestCase):
+    """
+    Tests of archiving the scraped items and reading them back.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        rnd = random.Random(0)
+        self.items = [random_item(rnd, str(i)) for i in range(50)]
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        """
+        The items read back from each compression are the same listings as the ones written.
+        """
+        for compression, extension in ARCHIVE_COMPRESSIONS.items():
+            with self.subTest(compression=compression):
+                path = write_feed(self.directory.name, CRAWLS[0], compression, f"sreality{compression}", self.items)
+                self.assertTrue(path.endswith(".jsonl" + extension))
+                read = [Listing(item).payload() for item in read_items(path)]
+                self.assertEqual(read, [Listing(item).payload() for item in self.items])
+
+    def test_rotate(self):
+        """
+        Only the files of the most recent crawls are kept, and their items are read back.
+        """
+        for i, crawl_time in enumerate(CRAWLS):
+            write_feed(self.directory.name, crawl_time, "gz", "sreality", self.items[i::3])
+            write_feed(self.directory.name, crawl_time, "zst", "bezrealitky", self.items[i + 1 :: 3])
+        oldest = crawl_files(self.directory.name, CRAWLS[0])
+        deleted = rotate(self.directory.name, 2)
+        self.assertEqual(sorted(deleted), oldest)
+        self.assertEqual(len(deleted), 2)
+        self.assertFalse(any(os.path.exists(path) for path in deleted))
+        files = crawl_files(self.directory.name, CRAWLS[2])
+        self.assertEqual([os.path.basename(path) for path in files], [
+            "20240401T120000_bezrealitky-Praha.jsonl.zst",
+            "20240401T120000_sreality-Praha.jsonl.gz",
+        ])
+        read = [Listing(item).payload() for path in files for item in read_items(path)]
+        expected = [Listing(item).payload() for item in self.items[3::3] + self.items[2::3]]
+        self.assertEqual(read, expected)
+        self.assertEqual(rotate(self.directory.name, 2), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
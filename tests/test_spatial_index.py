@@ -0,0 +1,53 @@
+import unittest
+import numpy as np  # type: ignore pylint: disable=import-error
+import pandas as pd  # type: ignore pylint: disable=import-error
+from geopy import Point  # type: ignore pylint: disable=import-error
+from spatial_index import GridIndex, to_coordinates
+from user_preferences import UserPreferences
+
+
+# listings scraped without coordinates have them stored as ""
+LISTINGS = pd.DataFrame(
+    {
+        "gps_lat": [50.0755, "", None, 50.08],
+        "gps_lon": [14.4378, "", 14.42, 14.43],
+    },
+    index=["a", "b", "c", "d"],
+)
+
+
+class TestMissingCoordinates(unittest.TestCase):
+    """
+    Tests of listings without coordinates, stored as "" or NULL.
+    """
+    def test_to_coordinates(self):
+        """
+        Missing coordinates become NaN, the others floats.
+        """
+        np.testing.assert_array_equal(to_coordinates(LISTINGS.gps_lat), [50.0755, np.nan, np.nan, 50.08])
+        np.testing.assert_array_equal(to_coordinates([1, "2.5"]), [1.0, 2.5])
+
+    def test_grid_index_skips_missing_coordinates(self):
+        """
+        Listings without coordinates are not indexed.
+        """
+        index = GridIndex(LISTINGS.index, LISTINGS.gps_lat, LISTINGS.gps_lon)
+        self.assertEqual(len(index), 2)
+        self.assertEqual(sorted(index.within(50.0755, 14.4378, 5000)), ["a", "d"])
+
+    def test_poi_distances_of_missing_coordinates_are_nan(self):
+        """
+        The distances of listings without coordinates are NaN.
+        """
+        profile = UserPreferences()
+        profile.points_of_interest = [Point(50.0755, 14.4378)]
+        for exact in [False, True]:
+            distances = profile.poi_distances(LISTINGS, exact=exact)
+            self.assertEqual(distances.shape, (4, 1))
+            self.assertAlmostEqual(distances[0, 0], 0)
+            self.assertTrue(np.isnan(distances[1:3, 0]).all())
+            self.assertFalse(np.isnan(distances[3, 0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
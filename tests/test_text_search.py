@@ -0,0 +1,93 @@
+import random
+import sqlite3
+import unittest
+from text_search import FTS_TOKENIZER, TextQuery
+
+
+TEXTS = [
+    "Byt s výtahem a sklepem",
+    "Světlý byt, výtah, garáž",
+    "Výtah, sklep i garážové stání",
+    "Balkon do dvora, sklep",
+    "Klidná lokalita, nový cihlový dům",
+    "výtah",
+    "",
+]
+
+QUERY_WORDS = ["výtah", "sklep", "garáž", "balkon", "byt", '"nový cihlový"', "dvora"]
+
+
+def random_query(rnd: random.Random) -> str:
+    """
+    Returns a random query of words, operators and parentheses.
+    """
+    tokens = QUERY_WORDS + ["AND", "OR", "NOT", "NOT", "(", ")"]
+    return " ".join(rnd.choice(tokens) for _ in range(rnd.randint(1, 8)))
+
+
+class TestTextQuery(unittest.TestCase):
+    """
+    Tests of the keyword search, in memory and in an FTS5 index of the texts.
+    """
+
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:")
+        self.conn.execute(f"CREATE VIRTUAL TABLE texts USING fts5(description, tokenize='{FTS_TOKENIZER}')")
+        self.conn.executemany("INSERT INTO texts(rowid, description) VALUES (?, ?)", enumerate(TEXTS))
+
+    def tearDown(self):
+        self.conn.close()
+
+    def search(self, query: TextQuery) -> set[int]:
+        """
+        Returns the indexes of the texts found by the FTS5 query.
+        """
+        rows = self.conn.execute("SELECT rowid FROM texts WHERE texts MATCH ?", (query.fts_match("description"),))
+        found = {row[0] for row in rows}
+        return set(range(len(TEXTS))) - found if query.negated else found
+
+    def assert_finds(self, text: str, expected: set[int]):
+        """
+        Asserts that the query finds the texts both in memory and in the index.
+        """
+        query = TextQuery(text)
+        self.assertEqual({i for i, text in enumerate(TEXTS) if query.matches(text)}, expected, text)
+        self.assertEqual(self.search(query), expected, text)
+
+    def test_operators(self):
+        """
+        The operators combine the words.
+        """
+        self.assert_finds("výtah", {0, 1, 2, 5})
+        self.assert_finds("výtah sklep", {0, 2})
+        self.assert_finds("výtah OR balkon", {0, 1, 2, 3, 5})
+        self.assert_finds("výtah NOT sklep", {1, 5})
+        self.assert_finds("NOT výtah", {3, 4, 6})
+        self.assert_finds('"nový cihlový"', {4})
+
+    def test_negated_operands_in_or(self):
+        """
+        Negated operands of OR find the texts without the words.
+        """
+        self.assert_finds("výtah (NOT sklep OR garáž)", {1, 2, 5})
+        self.assert_finds("NOT sklep OR garáž", {1, 2, 4, 5, 6})
+        self.assert_finds("NOT výtah OR NOT sklep", {1, 3, 4, 5, 6})
+        self.assert_finds("(NOT výtah OR sklep) (NOT balkon OR dvora)", {0, 2, 3, 4, 6})
+        self.assert_finds("NOT (NOT výtah)", {0, 1, 2, 5})
+        self.assert_finds("byt NOT (NOT sklep NOT garáž)", {0, 1})
+
+    def test_index_and_memory_agree(self):
+        """
+        Random queries find the same texts in memory and in the index.
+        """
+        rnd = random.Random(0)
+        for _ in range(500):
+            query = TextQuery(random_query(rnd))
+            if not query:
+                continue
+            expected = {i for i, text in enumerate(TEXTS) if query.matches(text)}
+            self.assertEqual(self.search(query), expected, query.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
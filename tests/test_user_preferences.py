@@ -0,0 +1,168 @@
+import datetime
+import os
+import random
+import tempfile
+import unittest
+from database_wrapper import DatabaseWrapper
+from disposition import Disposition
+from furnished import Furnished
+from listing import Listing, PAYLOAD_FIELDS
+from listings_cleaner import clean_listing_database
+from property_status import PropertyStatus
+from property_type import PropertyType
+from user_preferences import FilterPlan, UserPreferences
+
+
+ADDRESSES = ["Vinohrady, Praha 2", "Praha 8 - Karlín", "Sokolovská, Praha 8 - Karlín", "Brno - Žabovřesky", "Ostrava"]
+DESCRIPTIONS = [
+    "Byt s výtahem a sklepem",
+    "Světlý byt, výtah, terasa",
+    "Balkon do dvora",
+    "Klidná lokalita u parku",
+    None,
+]
+
+# the preferences the filters are compared on, each one set of the preferences
+PREFERENCES = [
+    {},
+    {"location": "Praha 2"},
+    {"location": "Karlín, Brno"},
+    {"disposition": ["2+kk", "3+kk"], "max_price": 20000},
+    {"min_area": 50, "max_area": 80, "min_price": 10000},
+    {"balcony": True, "elevator": True, "garden": True},
+    {"garden": False, "cellar": True, "furnished": ["Vybaveno"], "status": ["Novostavba"]},
+    {"type": ["Cihla"], "parking": True, "terrace": False, "garage": None},
+    {"available_from": "2024-06-01", "floor": 2},
+    {"description": "výtah"},
+    {"description": "výtah NOT sklep"},
+    {"description": "terasa OR balkon"},
+    {"description": "výtah (NOT sklep OR terasa)"},
+    {"description": "NOT výtah OR NOT sklep"},
+    {"location": "Praha 8", "disposition": ["2+kk", "2+1"], "max_area": 90, "elevator": True, "description": "byt"},
+]
+
+# the preferences filtered by the distance from the points of interest, which is not part of the SQL condition
+POI_PREFERENCES = [
+    {"points_of_interest": [(50.08, 14.42)], "max_poi_distance": 3},
+    {"points_of_interest": [(50.08, 14.42), (50.12, 14.55)], "max_poi_distance": 2, "max_price": 25000},
+]
+
+
+def random_item(rnd: random.Random, listing_id: str) -> dict:
+    """
+    Returns a random listing as scraped from bezrealitky.cz.
+    """
+    return dict.fromkeys(PAYLOAD_FIELDS) | {
+        "id": listing_id,
+        "address": rnd.choice(ADDRESSES),
+        "area": str(rnd.randint(20, 120)),
+        "disposition": rnd.choice([d.value for d in Disposition] + ["Garsoniéra"]),
+        "price": f"{rnd.randint(8, 40)} {rnd.choice(['000', '500'])} Kč",
+        "floor": rnd.choice(["přízemí", "1. podlaží", "2. podlaží z celkem 5", "4. podlaží"]),
+        "furnished": rnd.choice([f.value for f in Furnished] + [None]),
+        "status": rnd.choice([s.value for s in PropertyStatus] + [None]),
+        "type": rnd.choice([t.value for t in PropertyType] + [None]),
+        "available_from": rnd.choice(["Ihned", "01.05.2024", "15.06.2024", "01.09.2024", None]),
+        "description": rnd.choice(DESCRIPTIONS),
+        "balcony": rnd.choice(["Balkón 4 m²", None]),
+        "cellar": rnd.choice(["Sklep 2 m²", None]),
+        "elevator": rnd.choice(["Výtah", None]),
+        "garage": rnd.choice(["Garáž", None]),
+        "garden": rnd.choice(["Předzahrádka 20 m²", None]),
+        "loggie": rnd.choice(["Lodžie", None]),
+        "parking": rnd.choice(["Parkování", None]),
+        "terrace": rnd.choice(["Terasa", None]),
+        "url": f"https://www.bezrealitky.cz/{listing_id}",
+        "gps_lat": rnd.choice([rnd.uniform(50.0, 50.15), None]),
+        "gps_lon": rnd.uniform(14.3, 14.6),
+    }
+
+
+class SeededDatabaseTestCase(unittest.TestCase):
+    """
+    Base of the tests run on a database seeded with random listings.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        handle, cls.path = tempfile.mkstemp(suffix=".db")
+        os.close(handle)
+        rnd = random.Random(0)
+        db = DatabaseWrapper(cls.path)
+        db.create_table()
+        db.upsert_listings(
+            [Listing(random_item(rnd, str(i))) for i in range(500)], datetime.datetime(2024, 4, 1, 12, 0, 0, 5)
+        )
+        db.close_conn()
+        cls.listings = clean_listing_database(cls.path)
+
+    @classmethod
+    def tearDownClass(cls):
+        os.remove(cls.path)
+
+
+class TestSqlFilter(SeededDatabaseTestCase):
+    """
+    Tests of the SQL condition of the preferences on a seeded database.
+    """
+
+    def test_sql_filter_matches_filter_plan(self):
+        """
+        The listings loaded with to_sql_filter are the ones kept by filter_plan.
+        """
+        for data in PREFERENCES:
+            with self.subTest(preferences=data):
+                preferences = UserPreferences.from_dict(data)
+                expected = self.listings.index[preferences.filter_plan().mask(self.listings)]
+                loaded = clean_listing_database(self.path, *preferences.to_sql_filter())
+                self.assertEqual(sorted(loaded.index), sorted(expected))
+                if data:
+                    self.assertTrue(0 < len(expected) < len(self.listings))
+
+
+class TestFilterPlan(SeededDatabaseTestCase):
+    """
+    Tests of filtering the cleaned listings with the filter plan of the preferences.
+    """
+
+    @staticmethod
+    def chained(plan: FilterPlan, df):
+        """
+        Filters the listings by each predicate of the plan in turn, the way filter_listings used to.
+        """
+        for _, predicate in plan.predicates:
+            df = df[predicate(df)]
+        return df
+
+    def test_apply_matches_chained_filters(self):
+        """
+        The listings selected by the single mask of the plan are the ones left by filtering one preference at a time.
+        """
+        for data in PREFERENCES + POI_PREFERENCES:
+            with self.subTest(preferences=data):
+                plan = UserPreferences.from_dict(data).filter_plan()
+                selected = plan.apply(self.listings)
+                self.assertTrue(selected.equals(self.chained(plan, self.listings)))
+                self.assertEqual(plan.selectivity(self.listings)["all"], len(selected))
+                if data:
+                    self.assertTrue(0 < len(selected) < len(self.listings))
+
+    def test_order_does_not_change_result(self):
+        """
+        Ordering the predicates by their selectivity, or in any other way, selects the same listings.
+        """
+        rnd = random.Random(0)
+        for data in PREFERENCES + POI_PREFERENCES:
+            with self.subTest(preferences=data):
+                plan = UserPreferences.from_dict(data).filter_plan()
+                expected = plan.apply(self.listings)
+                counts = plan.selectivity(self.listings)
+                by_selectivity = sorted(plan.predicates, key=lambda named, counts=counts: counts[named[0]])
+                shuffled = rnd.sample(plan.predicates, len(plan.predicates))
+                for predicates in (by_selectivity, by_selectivity[::-1], shuffled):
+                    self.assertTrue(FilterPlan(predicates).apply(self.listings).equals(expected))
+                    self.assertTrue(self.chained(FilterPlan(predicates), self.listings).equals(expected))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,256 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+
+# the FTS5 tokenizer of the listing texts, words are case and diacritics insensitive
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+
+# quoted phrases, parentheses and words of a query
+QUERY_TOKEN = re.compile(r'"[^"]*"?|[()]|[^\s()"]+')
+# letters and digits, the other characters separate the words like in the FTS5 tokenizer
+WORD = re.compile(r"[^\W_]+")
+
+
+def _strip_diacritics(text: str) -> str:
+    return "".join(
+        char
+        for char in unicodedata.normalize("NFD", text)
+        if unicodedata.category(char) != "Mn"
+    )
+
+
+def fold(text: str) -> tuple[str, ...]:
+    """
+    Splits a text into words, lowercased and without diacritics.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        tuple[str, ...]: The words of the text, e.g. ("vytah", "sklep") for "Výtah, sklep".
+    """
+    return tuple(WORD.findall(_strip_diacritics(text.lower())))
+
+
+@lru_cache(maxsize=None)
+def _letter_variants() -> dict[str, str]:
+    """
+    Returns the Latin letters with diacritics by the letter they are folded to, e.g. "áä..." for "a".
+    """
+    variants: dict[str, str] = {}
+    for code in list(range(0xC0, 0x250)) + list(range(0x1E00, 0x1F00)):
+        letter = chr(code)
+        base = _strip_diacritics(letter.lower())
+        if len(base) == 1 and base != letter.lower():
+            variants[base] = variants.get(base, "") + letter
+    return variants
+
+
+def _phrase_pattern(words: tuple[str, ...], prefix: bool) -> re.Pattern:
+    """
+    Compiles a regular expression finding the folded words next to each other in a text that is not folded,
+    the last word may be followed by more letters if prefix is set.
+    """
+    variants = _letter_variants()
+    pattern = r"[\W_]+".join(
+        "".join(f"[{re.escape(char + variants.get(char, ''))}]" for char in word)
+        for word in words
+    )
+    return re.compile(
+        r"(?<![^\W_])" + pattern + ("" if prefix else r"(?![^\W_])"), re.IGNORECASE
+    )
+
+
+class TextQuery:
+    """
+    A keyword search in a text column of the listings.
+
+    The query consists of words, "quoted phrases" and parentheses combined with the AND, OR and NOT
+    operators, words next to each other must all be present. Words match the words of the text
+    starting with them, so "výtah" also finds "výtahem", phrases match whole words.
+    A query starting with NOT finds the texts without the words, NOT may negate any operand,
+    e.g. "výtah (NOT sklep OR garáž)". Misplaced operators and parentheses are ignored.
+
+    The query is evaluated either by the listings_fts full-text index of the database (fts_match)
+    or in memory (matches), both find the same texts.
+
+    Attributes:
+        text (str): The query as entered by the user.
+        negated (bool): Whether the query finds the texts not matching fts_match.
+    """
+
+    def __init__(self, text: str) -> None:
+        """
+        Initialize a TextQuery object.
+
+        Args:
+            text (str): The query as entered by the user.
+        """
+        self.text = text
+        self._tokens = self._balance(QUERY_TOKEN.findall(text))
+        self._position = 0
+        # ("or", [nodes]), ("and", [nodes], [negated nodes]) or ("phrase", words, is prefix, pattern)
+        self._tree = self._parse_or()
+        self._fts_query, self.negated = ("", False) if self._tree is None else self._fts(self._tree)
+
+    def __bool__(self) -> bool:
+        return self._tree is not None
+
+    @staticmethod
+    def _balance(tokens: list[str]) -> list[str]:
+        """
+        Removes the closing parentheses without an opening one and closes the unclosed ones.
+        """
+        balanced = []
+        depth = 0
+        for token in tokens:
+            if token == ")":
+                if depth == 0:
+                    continue
+                depth -= 1
+            elif token == "(":
+                depth += 1
+            balanced.append(token)
+        return balanced + [")"] * depth
+
+    def _peek(self) -> None | str:
+        if self._position < len(self._tokens):
+            return self._tokens[self._position]
+        return None
+
+    def _parse_or(self) -> None | tuple:
+        """
+        Parses operands separated by OR.
+        """
+        operands = [self._parse_and()]
+        while self._peek() == "OR":
+            self._position += 1
+            operands.append(self._parse_and())
+        operands = [operand for operand in operands if operand is not None]
+        if len(operands) == 0:
+            return None
+        if len(operands) == 1:
+            return operands[0]
+        return ("or", operands)
+
+    def _parse_and(self) -> None | tuple:
+        """
+        Parses operands all of which must match, or must not match when preceded by NOT.
+        """
+        matching: list[tuple] = []
+        negated: list[tuple] = []
+        negate = False
+        while self._peek() not in (None, ")", "OR"):
+            token = self._tokens[self._position]
+            self._position += 1
+            if token in ("AND", "NOT"):
+                negate = negate or token == "NOT"
+                continue
+            operand = self._parse_operand(token)
+            if operand is None:
+                continue
+            if operand[0] == "and" and not operand[1]:
+                # a parenthesized group of negated operands, negating it finds the texts with any of them
+                if not negate:
+                    negated += operand[2]
+                elif len(operand[2]) == 1:
+                    matching.append(operand[2][0])
+                else:
+                    matching.append(("or", operand[2]))
+            elif negate:
+                negated.append(operand)
+            else:
+                matching.append(operand)
+            negate = False
+        if not matching and not negated:
+            return None
+        if len(matching) == 1 and not negated:
+            return matching[0]
+        return ("and", matching, negated)
+
+    def _parse_operand(self, token: str) -> None | tuple:
+        """
+        Parses a parenthesized group, a quoted phrase or a word.
+        """
+        if token == "(":
+            node = self._parse_or()
+            if self._peek() == ")":
+                self._position += 1
+            return node
+        if token == ")":
+            return None
+        quoted = token.startswith('"')
+        words = fold(token.strip('"'))
+        if not words:
+            return None
+        return ("phrase", words, not quoted, _phrase_pattern(words, not quoted))
+
+    def fts_match(self, column: str) -> str:
+        """
+        Returns the FTS5 query of the listings_fts table matching the query in the column.
+
+        Args:
+            column (str): The column of listings_fts searched, e.g. "description".
+
+        Returns:
+            str: The FTS5 query, texts it matches do not match the query if negated is set.
+        """
+        return f"{{{column}}} : ({self._fts_query})"
+
+    def _fts(self, node: tuple) -> tuple[str, bool]:
+        """
+        Compiles a node to an FTS5 query and whether the query finds the texts not matching the node.
+
+        FTS5 has only the binary "a NOT b", so a node without operands that must match is compiled
+        to its complement, e.g. "NOT a OR b" to "a NOT b", and the complement is subtracted where used.
+        """
+        if node[0] == "phrase":
+            return f'"{" ".join(node[1])}"' + ("*" if node[2] else ""), False
+        operands = [self._fts(operand) for operand in node[1]]
+        if node[0] == "and":
+            # a negated complement is the node itself
+            operands += [(query, not complement) for query, complement in map(self._fts, node[2])]
+        matching = [query for query, complement in operands if not complement]
+        excluded = [query for query, complement in operands if complement]
+        if node[0] == "or":
+            if not excluded:
+                return "(" + " OR ".join(matching) + ")", False
+            # not matching any operand: matching all the complements and none of the others
+            return self._subtract(excluded, matching), True
+        if not matching:
+            return "(" + " OR ".join(excluded) + ")", True
+        return self._subtract(matching, excluded), False
+
+    @staticmethod
+    def _subtract(queries: list[str], subtracted: list[str]) -> str:
+        """
+        Returns the FTS5 query finding the texts matching all of the queries and none of the subtracted ones.
+        """
+        query = "(" + " AND ".join(queries) + ")"
+        return f"({query} NOT ({' OR '.join(subtracted)}))" if subtracted else query
+
+    def matches(self, text) -> bool:
+        """
+        Evaluates the query in memory.
+
+        Args:
+            text: The searched text, missing values (e.g. NaN) have no words.
+
+        Returns:
+            bool: Whether the text matches the query.
+        """
+        if self._tree is None:
+            return True
+        if not isinstance(text, str):
+            text = ""
+        return self._matches(self._tree, text)
+
+    def _matches(self, node: tuple, text: str) -> bool:
+        if node[0] == "phrase":
+            return node[3].search(text) is not None
+        if node[0] == "or":
+            return any(self._matches(operand, text) for operand in node[1])
+        return all(self._matches(operand, text) for operand in node[1]) and not any(
+            self._matches(operand, text) for operand in node[2]
+        )
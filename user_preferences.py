@@ -1,4 +1,7 @@
+import json
+import operator
 from datetime import date
+from typing import Callable
 import numpy as np  # type: ignore pylint: disable=import-error
 import pandas as pd  # type: ignore pylint: disable=import-error
 from geopy import Point  # type: ignore pylint: disable=import-error
@@ -7,6 +10,10 @@ from disposition import Disposition
 from property_status import PropertyStatus
 from property_type import PropertyType
 from furnished import Furnished
+from spatial_index import GridIndex, haversine_distance, to_coordinates
+from database_wrapper import FTS_MATCHING_IDS
+from text_search import TextQuery
+from locality import split_places
 
 
 BOOLEAN_COLUNNS = [
@@ -36,6 +43,103 @@ SCORING_COLUMNS = [
 ]
 
 
+# the disposition values in the order they are scored
+DISPOSITION_SCALE = {
+    "1+1": 1,
+    "1+kk": 2,
+    "2+1": 3,
+    "2+kk": 4,
+    "3+1": 5,
+    "3+kk": 6,
+    "4+1": 7,
+    "4+kk": 8,
+    "5+kk": 9,
+    "5+1": 10,
+    "6-a-více": 11,
+    "other": np.nan,
+}
+
+# ways of combining the distances to the points of interest into one distance
+POI_AGGREGATIONS = ["nearest", "mean", "weighted"]
+
+
+def _text_matches(texts: pd.Series, query: TextQuery) -> np.ndarray:
+    """
+    Evaluates a keyword search once per distinct text.
+    """
+    codes, distinct = pd.factorize(texts)
+    matches = np.array([query.matches(text) for text in distinct] + [query.matches(None)])
+    return matches[codes]
+
+
+class FilterPlan:
+    """
+    The predicates of the active user preferences, combined into a single mask over the listings.
+
+    Attributes:
+        predicates (list[tuple[str, Callable]]): The names of the preferences and the functions
+            returning a boolean mask of the listings of a DataFrame meeting them.
+    """
+
+    def __init__(self, predicates: list[tuple[str, Callable]]) -> None:
+        """
+        Initialize a FilterPlan object.
+
+        Args:
+            predicates (list[tuple[str, Callable]]): The named predicates of the plan.
+        """
+        self.predicates = predicates
+
+    def mask(self, df: pd.DataFrame) -> np.ndarray:
+        """
+        Evaluates all predicates of the plan.
+
+        Args:
+            df (pd.DataFrame): The listings.
+
+        Returns:
+            np.ndarray: Whether each listing meets all the predicates.
+        """
+        mask = np.ones(len(df), dtype=bool)
+        for _, predicate in self.predicates:
+            mask &= np.asarray(predicate(df), dtype=bool)
+        return mask
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Selects the listings meeting all predicates of the plan.
+
+        Args:
+            df (pd.DataFrame): The listings.
+
+        Returns:
+            pd.DataFrame: The selected listings.
+        """
+        if not self.predicates:
+            return df
+        return df[self.mask(df)]
+
+    def selectivity(self, df: pd.DataFrame) -> dict[str, int]:
+        """
+        Counts the listings meeting each of the predicates on its own, to find out which
+        of the preferences filter out the most listings.
+
+        Args:
+            df (pd.DataFrame): The listings.
+
+        Returns:
+            dict[str, int]: The number of listings meeting each predicate and all of them ("all").
+        """
+        counts = {}
+        mask = np.ones(len(df), dtype=bool)
+        for name, predicate in self.predicates:
+            matches = np.asarray(predicate(df), dtype=bool)
+            counts[name] = int(matches.sum())
+            mask &= matches
+        counts["all"] = int(mask.sum())
+        return counts
+
+
 class UserPreferences:
     """
     Represents the user's preferences for property listings.
@@ -43,8 +147,13 @@ class UserPreferences:
     Attributes:
         estate_type (None | str): The type of estate preferred by the user.
         listing_type (None | str): The type of listing preferred by the user.
-        location (None | str): The preferred location for the property.
+        location (None | str): The preferred cities, districts or quarters separated by commas,
+            e.g. "Praha 2, Praha 3" or "Karlín".
         points_of_interest (None | list[Point]): The points of interest near the property.
+        poi_aggregation (None | str): How the distances to the points of interest are combined,
+            one of POI_AGGREGATIONS.
+        poi_weights (None | list[float]): The weights of the points of interest for the weighted aggregation.
+        max_poi_distance (None | float): The maximum distance in kilometers from the nearest point of interest.
         disposition (None | list[Disposition]): The preferred disposition of the property.
         min_area (None | int): The minimum area preferred by the user.
         max_area (None | int): The maximum area preferred by the user.
@@ -76,6 +185,8 @@ class UserPreferences:
         weight_garage (None | float): The weight assigned to the garage preference.
         weight_parking (None | float): The weight assigned to the parking preference.
         weight_poi_distance (None | float): The weight assigned to the points of interest distance preference.
+        webhook_url (None | str): The Discord webhook the user is notified through, the WEBHOOK_URL
+            of the app if None.
     """
     def __init__(self) -> None:
         """
@@ -83,8 +194,11 @@ class UserPreferences:
         """
         self.estate_type: None | str = None
         self.listing_type: None | str = None
-        self.location: None | str = None  # later region, city, district, street
+        self.location: None | str = None
         self.points_of_interest: None | list[Point] = None
+        self.poi_aggregation: None | str = "nearest"
+        self.poi_weights: None | list[float] = None
+        self.max_poi_distance: None | float = None
 
         self.disposition: None | list[Disposition] = None
 
@@ -126,6 +240,8 @@ class UserPreferences:
         self.weight_parking: None | float = 1
         self.weight_poi_distance: None | float = 1
 
+        self.webhook_url: None | str = None
+
     # initialize class from json
     @classmethod
     def from_dict(cls, data):
@@ -177,6 +293,9 @@ class UserPreferences:
                 if self.points_of_interest
                 else None
             ),
+            "poi_aggregation": self.poi_aggregation,
+            "poi_weights": self.poi_weights,
+            "max_poi_distance": self.max_poi_distance,
             "disposition": (
                 [d.value for d in self.disposition] if self.disposition else None
             ),
@@ -212,142 +331,347 @@ class UserPreferences:
             "weight_garage": self.weight_garage,
             "weight_parking": self.weight_parking,
             "weight_poi_distance": self.weight_poi_distance,
+            "webhook_url": self.webhook_url,
         }
 
-    def filter_listings(self, df: pd.DataFrame) -> pd.DataFrame:
+    def filter_plan(
+        self,
+        spatial_index: None | GridIndex = None,
+        text_search: None | Callable[[TextQuery, str], list] = None,
+    ) -> "FilterPlan":
         """
-        Filters the given DataFrame based on the user's preferences.
+        Compiles the user's preferences into the predicates of a filter plan.
 
         Args:
-            df (pd.DataFrame): The DataFrame to be filtered.
+            spatial_index (None | GridIndex, optional): An index of the listing coordinates by the
+                listing IDs of the filtered DataFrame, built from it if not given. Defaults to None.
+            text_search (None | Callable[[TextQuery, str], list], optional): A function returning the
+                IDs of the listings matching a keyword search in a column, e.g. DatabaseWrapper.search_text.
+                The keywords are searched in the DataFrame if not given. Defaults to None.
 
         Returns:
-            pd.DataFrame: The filtered DataFrame.
+            FilterPlan: The filter plan of the active preferences.
         """
-        if self.disposition:
-            df = df[df["disposition"].isin([d.value for d in self.disposition])]
-        if self.type:
-            df = df[df["type"].isin([d.value for d in self.type])]
-        if self.furnished:
-            df = df[df["furnished"].isin([d.value for d in self.furnished])]
-        if self.status:
-            df = df[df["status"].isin([d.value for d in self.status])]
-
-        if self.min_area:
-            df = df[df["area"] >= self.min_area]
-        if self.max_area:
-            df = df[df["area"] <= self.max_area]
-        if self.min_price:
-            df = df[df["price"] >= self.min_price]
-        if self.max_price:
-            df = df[df["price"] <= self.max_price]
-        if self.floor:
-            df = df[df["floor"] >= self.floor]
-        if self.available_from:
-            df = df[df["available_from"] >= self.available_from]
+        predicates = []
+        for attr, enums in (
+            ("disposition", self.disposition),
+            ("type", self.type),
+            ("furnished", self.furnished),
+            ("status", self.status),
+        ):
+            if enums:
+                values = [value.value for value in enums]
+                predicates.append(
+                    (attr, lambda df, attr=attr, values=values: df[attr].isin(values))
+                )
+
+        for attr, column, compare in (
+            ("min_area", "area", operator.ge),
+            ("max_area", "area", operator.le),
+            ("min_price", "price", operator.ge),
+            ("max_price", "price", operator.le),
+            ("floor", "floor", operator.ge),
+            ("available_from", "available_from", operator.ge),
+        ):
+            value = getattr(self, attr)
+            if value:
+                predicates.append(
+                    (
+                        attr,
+                        lambda df, column=column, compare=compare, value=value: compare(
+                            df[column], value
+                        ),
+                    )
+                )
 
         for attr in BOOLEAN_COLUNNS:
             col = getattr(self, attr)
             if col is not None and col is True:
-                df = df[df[attr] == 1]
+                predicates.append((attr, lambda df, attr=attr: df[attr] == 1))
 
         if self.garden is not None:
             if self.garden is True:
-                df = df[df["garden"] > 0]
+                predicates.append(("garden", lambda df: df["garden"] > 0))
             else:
-                df = df[df["garden"] <= 0]
+                predicates.append(("garden", lambda df: df["garden"] <= 0))
+
+        places = split_places(self.location)
+        if places:
+            predicates.append(
+                (
+                    "location",
+                    lambda df: df.city.isin(places)
+                    | df.district.isin(places)
+                    | df.quarter.isin(places),
+                )
+            )
+
+        query = TextQuery(self.description or "")
+        if query and text_search is None:
+            predicates.append(
+                ("description", lambda df: _text_matches(df.description, query))
+            )
+        elif query:
+            predicates.append(
+                (
+                    "description",
+                    lambda df: df.index.isin(text_search(query, "description")),  # type: ignore
+                )
+            )
 
-        if self.description:
-            df = df[
-                df["description"].str.contains(self.description, case=False, na=False)
-            ]
+        if self._filters_poi_distance():
+            predicates.append(
+                (
+                    "max_poi_distance",
+                    lambda df: self._within_poi_distance(df, spatial_index),
+                )
+            )
 
-        if self.location:
-            df = df[df["address"].str.contains(self.location, case=False, na=False)]
+        return FilterPlan(predicates)
 
-        return df
+    def filter_listings(
+        self, df: pd.DataFrame, spatial_index: None | GridIndex = None
+    ) -> pd.DataFrame:
+        """
+        Filters the given DataFrame based on the user's preferences.
 
-    def calculate_score(self, df: pd.DataFrame) -> pd.DataFrame:
+        Args:
+            df (pd.DataFrame): The DataFrame to be filtered.
+            spatial_index (None | GridIndex, optional): An index of the listing coordinates by the
+                listing IDs of the DataFrame, built from the DataFrame if not given. Defaults to None.
+
+        Returns:
+            pd.DataFrame: The filtered DataFrame.
         """
-        Calculates the score for each row in the given DataFrame based on the user's preferences.
+        return self.filter_plan(spatial_index).apply(df)
+
+    def filter_poi_distance(
+        self, df: pd.DataFrame, spatial_index: None | GridIndex = None
+    ) -> pd.DataFrame:
+        """
+        Filters out the listings farther than max_poi_distance from all points of interest.
 
         Args:
-            df (pd.DataFrame): The DataFrame containing the data to be scored.
+            df (pd.DataFrame): The DataFrame to be filtered.
+            spatial_index (None | GridIndex, optional): An index of the listing coordinates by the
+                listing IDs of the DataFrame, built from the DataFrame if not given. Defaults to None.
 
         Returns:
-            pd.DataFrame: The DataFrame with an additional 'score' column representing the calculated score.
+            pd.DataFrame: The filtered DataFrame.
+        """
+        if not self._filters_poi_distance():
+            return df
+        return df[self._within_poi_distance(df, spatial_index)]
 
+    def _filters_poi_distance(self) -> bool:
+        """
+        Returns whether the listings are filtered by the distance from the points of interest.
         """
-        if self.points_of_interest is not None and len(self.points_of_interest) > 0:
-            # Calculate the central latitude and longitude
-            x = 0.0
-            y = 0.0
-            z = 0.0
+        return bool(self.max_poi_distance) and any(
+            point is not None for point in self.points_of_interest or []
+        )
 
-            for point in self.points_of_interest:
-                if point is None:
-                    continue
-                latitude = np.radians(point.latitude)
-                longitude = np.radians(point.longitude)
+    def _within_poi_distance(
+        self, df: pd.DataFrame, spatial_index: None | GridIndex
+    ) -> np.ndarray:
+        """
+        Returns whether each listing is within max_poi_distance from any of the points of interest.
+        """
+        if spatial_index is None:
+            spatial_index = GridIndex(df.index, df.gps_lat, df.gps_lon)
+        points = [point for point in self.points_of_interest or [] if point is not None]
+        ids = spatial_index.within(
+            [point.latitude for point in points],
+            [point.longitude for point in points],
+            self.max_poi_distance * 1000,  # type: ignore
+        )
+        return df.index.isin(ids)
+
+    def to_sql_filter(self) -> tuple[str, list]:
+        """
+        Compiles the filters of filter_listings, except the distance from the points of interest,
+        into a parameterized SQL condition over the cleaned listings.
+
+        Returns:
+            tuple[str, list]: The condition and its parameters, the condition is empty if nothing is filtered.
+        """
+        conditions = []
+        params: list = []
+        for column, values in (
+            ("disposition", self.disposition),
+            ("type", self.type),
+            ("furnished", self.furnished),
+            ("status", self.status),
+        ):
+            if values:
+                conditions.append(f"{column} IN ({','.join(['?' for _ in values])})")
+                params += [value.value for value in values]
+
+        for column, comparison, value in (
+            ("area", ">=", self.min_area),
+            ("area", "<=", self.max_area),
+            ("price", ">=", self.min_price),
+            ("price", "<=", self.max_price),
+            ("floor", ">=", self.floor),
+        ):
+            if value:
+                conditions.append(f"{column} {comparison} ?")
+                params.append(value)
+        if self.available_from:
+            conditions.append("available_from >= ?")
+            params.append(self.available_from.isoformat())
+
+        for attr in BOOLEAN_COLUNNS:
+            if getattr(self, attr) is True:
+                conditions.append(f"{attr} = 1")
+
+        if self.garden is not None:
+            conditions.append("garden > 0" if self.garden is True else "garden <= 0")
+
+        # the cities, districts and quarters are looked up in their indexes
+        places = split_places(self.location)
+        if places:
+            placeholders = ",".join(["?" for _ in places])
+            conditions.append(
+                f"(city IN ({placeholders}) OR district IN ({placeholders}) OR quarter IN ({placeholders}))"
+            )
+            params += places * 3
+
+        # keyword search in the full-text index
+        query = TextQuery(self.description or "")
+        if query:
+            conditions.append(f"id {'NOT IN' if query.negated else 'IN'} ({FTS_MATCHING_IDS})")
+            params.append(query.fts_match("description"))
+
+        return " AND ".join(conditions), params
+
+    def aggregate_poi_distances(self, distances: np.ndarray) -> np.ndarray:
+        """
+        Combines the distances to the individual points of interest into one distance per listing.
+
+        Without matching poi_weights, the weighted aggregation weights all points equally.
+
+        Args:
+            distances (np.ndarray): The listings x points of interest distance matrix.
+
+        Returns:
+            np.ndarray: The distance to the nearest point, the mean distance or the weighted mean distance.
+        """
+        if self.poi_aggregation == "mean":
+            return distances.mean(axis=1)
+        if self.poi_aggregation == "weighted":
+            weights = np.ones(distances.shape[1])
+            if self.poi_weights is not None and len(self.poi_weights) == distances.shape[1]:
+                weights = np.asarray(self.poi_weights, dtype=float)
+            if weights.sum() <= 0:
+                weights = np.ones(distances.shape[1])
+            return distances @ weights / weights.sum()
+        return distances.min(axis=1)
+
+    def scoring_signature(self) -> str:
+        """
+        Returns a key of all preferences except the scoring weights and the webhook.
 
-                x += np.cos(latitude) * np.cos(longitude)
-                y += np.cos(latitude) * np.sin(longitude)
-                z += np.sin(latitude)
+        The listings prepared by prepare_scoring depend on the listings and these preferences only,
+        so they can be scored again with other weights as long as the signature does not change.
 
-            total = len(self.points_of_interest)
+        Returns:
+            str: The preferences without the weights, serialized to JSON.
+        """
+        return json.dumps(
+            {
+                key: value
+                for key, value in self.to_dict().items()
+                if not key.startswith("weight_") and key != "webhook_url"
+            },
+            sort_keys=True,
+        )
 
-            x = x / total
-            y = y / total
-            z = z / total
+    def scoring_weights(self) -> np.ndarray:
+        """
+        Returns the weights of the scoring columns.
 
-            central_longitude = np.degrees(np.arctan2(y, x))
-            central_square_root = np.sqrt(x * x + y * y)
-            central_latitude = np.degrees(np.arctan2(z, central_square_root))
+        Returns:
+            np.ndarray: The weight of each of the SCORING_COLUMNS, in their order.
+        """
+        return np.array(
+            [getattr(self, "weight_" + col) for col in SCORING_COLUMNS], dtype=float
+        )
+
+    def poi_distances(self, df: pd.DataFrame, exact: bool = False) -> None | np.ndarray:
+        """
+        Calculates the distances from each listing to each point of interest.
+
+        Args:
+            df (pd.DataFrame): The listings.
+            exact (bool, optional): Whether to measure the distance on the WGS-84 ellipsoid
+                with geopy instead, row by row. Defaults to False.
 
-            # Calculate the distance from each row to the central latitude and longitude
-            for i, row in df.iterrows():
-                df.loc[i, "poi_distance"] = int(
-                    distance(  # type: ignore
-                        (central_latitude, central_longitude),
-                        (row.gps_lat, row.gps_lon),
+        Returns:
+            None | np.ndarray: The distances in meters with a row for each listing and a column
+                for each point of interest, NaN for listings without coordinates.
+                None if there are no points of interest.
+        """
+        points = [point for point in self.points_of_interest or [] if point is not None]
+        if len(points) == 0:
+            return None
+        lat = to_coordinates(df.gps_lat)[:, np.newaxis]
+        lon = to_coordinates(df.gps_lon)[:, np.newaxis]
+        if exact:
+            distances = np.full((len(df), len(points)), np.nan)
+            for i in np.flatnonzero(~np.isnan(lat[:, 0]) & ~np.isnan(lon[:, 0])):
+                for j, point in enumerate(points):
+                    distances[i, j] = distance(  # type: ignore
+                        (point.latitude, point.longitude), (lat[i, 0], lon[i, 0])
                     ).m
-                )
-            df.poi_distance = df.poi_distance.astype(int)
+            return distances
+        poi_lat = np.array([point.latitude for point in points])
+        poi_lon = np.array([point.longitude for point in points])
+        return haversine_distance(lat, lon, poi_lat, poi_lon)
+
+    def calculate_score(self, df: pd.DataFrame, exact: bool = False) -> pd.DataFrame:
+        """
+        Calculates the score for each row in the given DataFrame based on the user's preferences.
+
+        Args:
+            df (pd.DataFrame): The DataFrame containing the data to be scored.
+            exact (bool, optional): Whether to measure the distance on the WGS-84 ellipsoid
+                with geopy instead, row by row. Defaults to False.
+
+        Returns:
+            pd.DataFrame: The DataFrame with an additional 'score' column representing the calculated score.
+
+        """
+        df = self.prepare_scoring(df, exact)
+        df["score"] = self.score(df)
+        return df
+
+    def prepare_scoring(self, df: pd.DataFrame, exact: bool = False) -> pd.DataFrame:
+        """
+        Calculates the distances to the points of interest and the normalized_<column> features
+        of the scoring columns, which are weighted by score.
+
+        The distance to each point of interest is measured in whole meters along a great circle
+        and stored in the poi_distance_<i> columns, poi_distance combines them as set by poi_aggregation.
+        Listings without coordinates get no distance and the lowest distance score.
+
+        Args:
+            df (pd.DataFrame): The DataFrame containing the data to be scored.
+            exact (bool, optional): Whether to measure the distance on the WGS-84 ellipsoid
+                with geopy instead, row by row. Defaults to False.
+
+        Returns:
+            pd.DataFrame: The DataFrame with the distance and normalized_<column> columns.
+        """
+        distances = self.poi_distances(df, exact)
+        if distances is not None:
+            for j in range(distances.shape[1]):
+                df[f"poi_distance_{j}"] = np.trunc(distances[:, j])
+            df["poi_distance"] = np.trunc(self.aggregate_poi_distances(distances))
         else:
             df["poi_distance"] = 0
 
-        # Mapping for disposition values
-        disposition_mapping = {
-            "1+1": 1,
-            "1+kk": 2,
-            "2+1": 3,
-            "2+kk": 4,
-            "3+1": 5,
-            "3+kk": 6,
-            "4+1": 7,
-            "4+kk": 8,
-            "5+kk": 9,
-            "5+1": 10,
-            "6-a-více": 11,
-            "other": np.nan,
-        }
-        df.disposition = df.disposition.map(disposition_mapping)
-
-        # Mapping for scoring weights
-        scoring_weights = {
-            "normalized_area": self.weight_area,
-            "normalized_price": self.weight_price,
-            "normalized_disposition": self.weight_disposition,
-            "normalized_garden": self.weight_garden,
-            "normalized_balcony": self.weight_balcony,
-            "normalized_cellar": self.weight_cellar,
-            "normalized_loggie": self.weight_loggie,
-            "normalized_elevator": self.weight_elevator,
-            "normalized_terrace": self.weight_terrace,
-            "normalized_garage": self.weight_garage,
-            "normalized_parking": self.weight_parking,
-            "normalized_poi_distance": self.weight_poi_distance,
-        }
+        df.disposition = df.disposition.map(DISPOSITION_SCALE)
 
         # Normalize columns
         for col in SCORING_COLUMNS:
@@ -363,13 +687,28 @@ class UserPreferences:
             else:
                 df["normalized_" + col] = (df[col] - min_val) / denominator
 
-        scoring_columns = ["normalized_" + col for col in SCORING_COLUMNS]
-        # Calculate score
-        df["score"] = (df[scoring_columns] * pd.Series(scoring_weights)).sum(axis=1)
-        # normalize score
-        # df["score"] = (df["score"] - df["score"].min()) / (df["score"].max() - df["score"].min())
         df.disposition = df.disposition.map(
-            {v: k for k, v in disposition_mapping.items()}
+            {v: k for k, v in DISPOSITION_SCALE.items()}
         )
 
         return df
+
+    def score(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Weights the normalized features of listings prepared by prepare_scoring.
+
+        Missing features do not add to the score.
+
+        Args:
+            df (pd.DataFrame): The listings prepared by prepare_scoring.
+
+        Returns:
+            pd.Series: The score of each listing.
+        """
+        features = df[["normalized_" + col for col in SCORING_COLUMNS]].to_numpy(dtype=float)
+        weights = self.scoring_weights()
+        # normalize score
+        # score = (score - score.min()) / (score.max() - score.min())
+        return pd.Series(
+            np.nan_to_num(features) @ np.nan_to_num(weights), index=df.index, name="score"
+        )